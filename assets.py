@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+準備済みアセット（リサイズ済みの背景画像と統計値）のキャッシュ
+
+背景画像の読み込み・リサイズや、背景の平均HSV値の計算は
+画像と動画の解像度・人物の配置だけで決まる。解像度の違う動画が混ざった
+大量の処理でも、同じ組み合わせの準備は1回で済むようにする。
+
+    メモリ: 最近使ったものから maxsize 個を保持（LRU）
+    ディスク: cache_dir を指定すると .npz として保存し、次回の実行でも再利用
+
+キーには画像ファイルの内容のハッシュを使うので、同じ名前で画像を
+差し替えた場合は別のエントリになる。
+"""
+
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+
+@lru_cache(maxsize=64)
+def _file_digest(path, mtime_ns, size):
+    """ファイル内容のSHA-1（パス・更新時刻・サイズが同じ間は再計算しない）"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """
+    ファイル内容のハッシュ値（16進数文字列）
+
+    Args:
+        path: ファイルパス
+
+    Returns:
+        str: SHA-1
+    """
+    stat = os.stat(path)
+    return _file_digest(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+class AssetCache:
+    """
+    キー → 配列の辞書 をメモリ（LRU）とディスクにキャッシュする
+
+    Args:
+        maxsize: メモリに保持するエントリ数
+        cache_dir: ディスクに保存するディレクトリ（None ならメモリのみ）
+    """
+
+    def __init__(self, maxsize=8, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_path(self, key):
+        # キーの各要素をつないだ文字列をファイル名にする（長さを揃えるためハッシュ化）
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return self.cache_dir / f"{key[0]}_{name}.npz"
+
+    def _load(self, key):
+        path = self._disk_path(key)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            # 書き込み途中・壊れたファイルは作り直す
+            return None
+
+    def _store(self, key, value):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._disk_path(key)
+        # 並列に動く他のプロセスが読みかけのファイルを見ないよう、一時ファイルから置き換える
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **value)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"  ! アセットキャッシュを保存できません: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def get(self, key, create):
+        """
+        キャッシュから取得し、なければ create() で作成して保存
+
+        Args:
+            key: 先頭が種類名の文字列のタプル（例: ("background", ハッシュ, 幅, 高さ)）
+            create: 値（名前 → numpy配列 の辞書）を作る関数
+
+        Returns:
+            dict: 名前 → numpy配列
+        """
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+        if self.cache_dir is not None:
+            value = self._load(key)
+            if value is not None:
+                self.disk_hits += 1
+
+        if value is None:
+            self.misses += 1
+            value = create()
+            if self.cache_dir is not None:
+                self._store(key, value)
+
+        # 共有される配列なので書き換えられないようにする
+        for array in value.values():
+            array.setflags(write=False)
+
+        self.entries[key] = value
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return value
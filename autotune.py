@@ -0,0 +1,644 @@
+#!/usr/bin/env python3
+"""
+マシンごとに最も速い処理方式を計測して保存する（autotune）
+
+同じ処理でも速い方式は CPU・解像度・動画の長さで変わる（例: Numba の融合処理は
+コア数が多いほど有利、帯単位の処理は 4K 以上で有利、複数プロセスでの合成は
+Python の処理が GIL で詰まる場合に有利）。ここでは対象の解像度の短い合成クリップで、
+使える処理方式とスレッド数の組み合わせを実際に計測し、品質の基準
+（verify.py と同じマスクの不一致率・PSNR・SSIM）を満たす中で最も速い設定を
+マシンのプロファイル（JSON）に保存する。
+
+    run.py                  処理方式（--backend）・マスク推定（--mask-downscale）・
+                            人物矩形追跡（--track-subject）・合成プロセス数
+                            （--frame-processes）・スレッド数
+    remove_greenback_cv.py  スレッド数
+    remove_greenback.py     ffmpeg のスレッド数（ffmpeg がある場合）
+
+以後の実行では、これらを引数で指定しなかった場合にプロファイルの設定を使う
+（動画の解像度に最も近い解像度で計測した設定）。スレッド数は --jobs / --workers の
+割り当てを超えない範囲で、計測で最も速かった数に抑える。CPU・コア数・OpenCV の
+バージョン・Numba の有無が計測時と違う場合は使わない。
+
+使用方法:
+    # 1080p で計測してプロファイルを保存
+    uv run python autotune.py
+
+    # 複数の解像度で計測（解像度ごとに保存し、以前の計測結果に追加する）
+    uv run python autotune.py --sizes 1280x720 1920x1080 3840x2160
+
+    # 保存済みのプロファイルを表示
+    uv run python autotune.py --show
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+import cv2
+
+import fused
+from concurrency import apply_thread_plan, available_cores, plan_threads
+
+PROFILE_VERSION = 1
+
+# 計測に使う合成クリップの長さ（秒）・フレームレートと、品質を比べるフレーム数
+CLIP_SECONDS = 2.0
+CLIP_FPS = 30
+QUALITY_FRAMES = 4
+
+# 品質の基準（verify.py のデフォルトと同じ）
+MAX_MASK_DIFF = 0.002
+MIN_PSNR = 40.0
+MIN_SSIM = 0.99
+
+# 全コアでの計測で速かった処理方式のうち、スレッド数・プロセス数を変えて試す数
+REFINE_TOP = 2
+
+# 監視モードなど動画の解像度が分からない場合に使う解像度
+DEFAULT_SIZE = (1920, 1080)
+
+# verify.py の処理方式 → run.py の (処理方式, マスク推定の縮小率, 人物矩形追跡)
+VARIANTS = {
+    "mask-downscale-4": ("opencv", 4, False),
+    "mask-downscale-8": ("opencv", 8, False),
+    "track-subject": ("opencv", 1, True),
+    "strips": ("strips", 1, False),
+    "fused": ("fused", 1, False),
+}
+
+
+def default_profile_path():
+    """プロファイルの保存先（$XDG_CACHE_HOME/fujitsu/autotune.json）"""
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_dir) / "fujitsu" / "autotune.json"
+
+
+def _cpu_name():
+    """CPUの名前（/proc/cpuinfo がなければ platform の値）"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def machine_info():
+    """プロファイルを使えるマシンかの判定に使う情報"""
+    return {
+        "cpu": _cpu_name(),
+        "cores": available_cores(),
+        "opencv": cv2.__version__,
+        "numba": fused.FUSED_AVAILABLE,
+    }
+
+
+class Profile:
+    """
+    マシンのプロファイル（解像度ごとの、スクリプトごとに最も速かった設定）
+
+    Args:
+        path: 保存先
+        machine: 計測したマシンの machine_info()
+        sizes: {"1920x1080": {"run": 設定, "cv": 設定, "ffmpeg": 設定}}
+    """
+
+    def __init__(self, path, machine=None, sizes=None):
+        self.path = Path(path)
+        self.machine = machine if machine is not None else machine_info()
+        self.sizes = sizes if sizes is not None else {}
+
+    @classmethod
+    def load(cls, path):
+        """
+        保存済みのプロファイルを読み込む
+
+        Raises:
+            OSError: 読み込めない
+            ValueError: 形式・バージョンが違う
+        """
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or data.get("version") != PROFILE_VERSION:
+            raise ValueError("形式が違います（autotune.py で計測し直してください）")
+        return cls(path, data.get("machine"), data.get("sizes", {}))
+
+    def matches(self):
+        """このマシンで計測したプロファイルならTrue"""
+        return self.machine == machine_info()
+
+    def lookup(self, script, width, height):
+        """
+        解像度が最も近い（画素数の比が1に近い）計測結果の設定
+
+        Args:
+            script: "run"、"cv"、"ffmpeg"
+
+        Returns:
+            tuple: (計測した解像度の文字列, 設定の辞書)、なければ (None, None)
+        """
+        best = None
+        for size, scripts in self.sizes.items():
+            if script not in scripts:
+                continue
+            size_width, size_height = map(int, size.split("x"))
+            distance = abs(math.log(size_width * size_height / (width * height)))
+            if best is None or distance < best[0]:
+                best = (distance, size, scripts[script])
+        if best is None:
+            return None, None
+        return best[1], best[2]
+
+    def save(self):
+        """書きかけのファイルを読まれないよう、一時ファイルに書いてから置き換える"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": PROFILE_VERSION,
+            "machine": self.machine,
+            "sizes": self.sizes,
+        }
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+def load_profile(path=None):
+    """
+    実行時に使うプロファイルを読み込む
+
+    Args:
+        path: プロファイルのパス（None なら default_profile_path()）
+
+    Returns:
+        Profile、なければ・使えなければ None（使えない理由を表示する）
+    """
+    path = Path(path) if path else default_profile_path()
+    if not path.exists():
+        return None
+    try:
+        profile = Profile.load(path)
+    except (OSError, ValueError) as e:
+        print(f"  ! autotune のプロファイルを読み込めません（{path}）: {e}")
+        return None
+    if not profile.matches():
+        print(
+            "  ! autotune のプロファイルは別のマシン（CPU・コア数・OpenCV・Numba）で"
+            "計測されたため使いません（autotune.py で計測し直してください）"
+        )
+        return None
+    return profile
+
+
+def add_autotune_arguments(parser):
+    """autotune のプロファイルの引数を argparse に追加"""
+    parser.add_argument(
+        "--autotune-profile",
+        metavar="PATH",
+        help="autotune のプロファイル（デフォルト: ~/.cache/fujitsu/autotune.json）",
+    )
+    parser.add_argument(
+        "--no-autotune",
+        action="store_true",
+        help="autotune のプロファイルを使わない",
+    )
+
+
+def limit_threads(plan, tuned):
+    """計測で最も速かったスレッド数に抑えた ThreadPlan（割り当てより増やさない）"""
+    threads = tuned.get("threads")
+    if not threads or threads >= plan.threads:
+        return plan
+    return plan._replace(threads=threads)
+
+
+def tuned_threads(args, plan, script, width, height):
+    """
+    remove_greenback_cv.py / remove_greenback.py のスレッド数をプロファイルで決める
+
+    --no-autotune・--cores を指定した場合と、プロファイルがない場合は plan のまま。
+
+    Args:
+        args: add_autotune_arguments() と add_thread_arguments() の引数
+        plan: plan_threads() の戻り値
+        script: "cv" または "ffmpeg"
+        width: 動画の幅
+        height: 動画の高さ
+
+    Returns:
+        ThreadPlan
+    """
+    if args.no_autotune or args.cores is not None:
+        return plan
+    profile = load_profile(args.autotune_profile)
+    if profile is None:
+        return plan
+    size, tuned = profile.lookup(script, width, height)
+    if tuned is None:
+        return plan
+    limited = limit_threads(plan, tuned)
+    print(f"autotune（{size} の計測結果）: {tuned['threads']}スレッドが最速")
+    return limited
+
+
+def describe_run(tuned):
+    """run.py の設定の表示用の文字列"""
+    parts = [f"処理方式 {tuned['backend']}"]
+    if tuned["mask_downscale"] > 1:
+        parts.append(f"マスク推定 1/{tuned['mask_downscale']}")
+    if tuned["track_subject"]:
+        parts.append("人物矩形追跡")
+    if tuned["frame_processes"] > 1:
+        parts.append(f"合成プロセス {tuned['frame_processes']}")
+    parts.append(f"{tuned['threads']}スレッド")
+    return " / ".join(parts)
+
+
+# --- 計測 ---
+
+
+class Candidate(NamedTuple):
+    """
+    run.py の設定の候補
+
+    Attributes:
+        backend: 処理方式（--backend）
+        mask_downscale: マスク推定の縮小率（--mask-downscale）
+        track_subject: 人物矩形追跡（--track-subject）
+        threads: 1本の動画のスレッド数
+        frame_processes: 合成プロセス数（--frame-processes）
+    """
+
+    backend: str
+    mask_downscale: int
+    track_subject: bool
+    threads: int
+    frame_processes: int
+
+
+def _quiet(func, *args, **kwargs):
+    """標準出力（進捗表示）を捨てて実行"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def _set_threads(threads):
+    """OpenCV / Numba のスレッド数を設定"""
+    apply_thread_plan(plan_threads(cores=threads))
+
+
+def _fps(func, frames, repeat):
+    """func() を repeat 回実行し、最も速かった回のフレームレート（失敗したら None）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if not func():
+            return None
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return frames / best
+
+
+def check_quality(size, args):
+    """
+    run.py の各処理方式が品質の基準を満たすか verify.py の比較で確認
+
+    Returns:
+        list: 基準を満たした (処理方式, マスク推定の縮小率, 人物矩形追跡)
+              （先頭は通常の処理）
+    """
+    # run.py がこのモジュールを import するので、計測に使うモジュールはここで import する
+    from verify import compare, synthetic_clip
+
+    names = [name for name in VARIANTS if name != "fused" or fused.FUSED_AVAILABLE]
+    passed = [("opencv", 1, False)]
+    rows = compare(synthetic_clip(size, QUALITY_FRAMES), "run", names, args)
+    for name, result in rows[1:]:
+        mask_diff = result["mask_diff"]
+        mask_text = "-" if mask_diff is None else f"{mask_diff * 100:.3f}%"
+        print(
+            f"  品質 {name:<18} マスク差 {mask_text:>7} PSNR {result['psnr']:>6.2f} "
+            f"SSIM {result['ssim']:.4f} {'OK' if result['ok'] else 'NG'}"
+        )
+        if result["ok"]:
+            passed.append(VARIANTS[name])
+    return passed
+
+
+def process_counts(threads, track_subject):
+    """試す合成プロセス数（人物矩形追跡は複数プロセスで使えない）"""
+    if track_subject or threads < 2:
+        return [1]
+    return sorted({1, 2, threads})
+
+
+def tune_run(clip, variants, cores, repeat, tmp):
+    """
+    run.py の設定の候補を計測して最も速いものを選ぶ
+
+    1. 全コアで各処理方式を計測
+    2. 速かった REFINE_TOP 個の処理方式で、スレッド数・合成プロセス数を変えて計測
+
+    Returns:
+        tuple: (Candidate, フレームレート)
+    """
+    from run import change_background
+
+    video_path, bg_path, frames = clip
+    measured = {}
+
+    def measure(candidate):
+        if candidate in measured:
+            return
+        _set_threads(candidate.threads)
+        fps = _fps(
+            lambda: _quiet(
+                change_background,
+                video_path,
+                bg_path,
+                tmp / "run.avi",
+                mask_downscale=candidate.mask_downscale,
+                track_subject=candidate.track_subject,
+                backend=candidate.backend,
+                dedup_tolerance=None,
+                frame_processes=candidate.frame_processes,
+            ),
+            frames,
+            repeat,
+        )
+        measured[candidate] = fps
+        text = "失敗" if fps is None else f"{fps:.1f} fps"
+        print(f"  run.py {describe_run(candidate._asdict())}: {text}")
+
+    # 背景の準備・JITコンパイルを計測に含めないよう、1回実行しておく
+    _set_threads(cores)
+    _quiet(change_background, video_path, bg_path, tmp / "run.avi")
+
+    for backend, mask_downscale, track_subject in variants:
+        measure(Candidate(backend, mask_downscale, track_subject, cores, 1))
+
+    ranked = sorted(
+        (candidate for candidate, fps in measured.items() if fps is not None),
+        key=measured.get,
+        reverse=True,
+    )
+    threads_options = sorted({1, max(1, cores // 2), cores})
+    for candidate in ranked[:REFINE_TOP]:
+        for threads in threads_options:
+            for processes in process_counts(threads, candidate.track_subject):
+                measure(
+                    candidate._replace(threads=threads, frame_processes=processes)
+                )
+
+    best = max(
+        (item for item in measured.items() if item[1] is not None),
+        key=lambda item: item[1],
+        default=None,
+    )
+    if best is None:
+        raise RuntimeError("run.py の処理がすべて失敗しました")
+    return best
+
+
+def tune_cv(clip, cores, repeat, tmp):
+    """
+    remove_greenback_cv.py のスレッド数を計測
+
+    Returns:
+        tuple: (スレッド数, フレームレート)、すべて失敗したら None
+    """
+    from remove_greenback_cv import change_background
+
+    video_path, bg_path, frames = clip
+    results = {}
+    for threads in sorted({1, max(1, cores // 2), cores}):
+        _set_threads(threads)
+        fps = _fps(
+            lambda: _quiet(change_background, video_path, bg_path, tmp / "cv.mp4"),
+            frames,
+            repeat,
+        )
+        text = "失敗" if fps is None else f"{fps:.1f} fps"
+        print(f"  remove_greenback_cv.py {threads}スレッド: {text}")
+        if fps is not None:
+            results[threads] = fps
+    if not results:
+        return None
+    return max(results.items(), key=lambda item: item[1])
+
+
+def tune_ffmpeg(clip, cores, repeat):
+    """
+    remove_greenback.py（ffmpeg chromakey）のスレッド数を計測
+
+    Returns:
+        tuple: (スレッド数, フレームレート)、ffmpeg がなければ None
+    """
+    if shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None:
+        print("  remove_greenback.py: ffmpeg がないため計測しません")
+        return None
+    import ffmpeg
+
+    from remove_greenback import measure_speed
+
+    video_path, bg_path, frames = clip
+    seconds = frames / CLIP_FPS
+    results = {}
+    for threads in sorted({1, max(1, cores // 2), cores}):
+        try:
+            speeds = [
+                measure_speed(video_path, bg_path, seconds, threads)
+                for _ in range(repeat)
+            ]
+        except ffmpeg.Error as e:
+            print(f"  ! remove_greenback.py の計測に失敗しました: {e}")
+            return None
+        results[threads] = max(speeds) * CLIP_FPS
+        print(f"  remove_greenback.py {threads}スレッド: {results[threads]:.1f} fps")
+    return max(results.items(), key=lambda item: item[1])
+
+
+def tune_size(size, args, cores, tmp):
+    """
+    1つの解像度で計測
+
+    Returns:
+        dict: {"run": 設定, "cv": 設定, "ffmpeg": 設定}
+              （cv・ffmpeg は計測できなければなし）
+    """
+    from benchmark import make_background, parse_size, write_synthetic_video
+
+    width, height = parse_size(size)
+    frames = max(1, round(args.seconds * CLIP_FPS))
+    video_path = tmp / f"green_{size}.avi"
+    bg_path = tmp / f"bg_{size}.png"
+    write_synthetic_video(video_path, width, height, frames, CLIP_FPS)
+    cv2.imwrite(str(bg_path), make_background(width, height))
+    clip = (video_path, bg_path, frames)
+
+    print(f"\n解像度: {size}（{frames}フレーム）")
+    variants = check_quality(size, args)
+    candidate, fps = tune_run(clip, variants, cores, args.repeat, tmp)
+    entry = {"run": {**candidate._asdict(), "fps": round(fps, 2)}}
+
+    result = tune_cv(clip, cores, args.repeat, tmp)
+    if result is not None:
+        threads, fps = result
+        entry["cv"] = {"threads": threads, "fps": round(fps, 2)}
+
+    result = tune_ffmpeg(clip, cores, args.repeat)
+    if result is not None:
+        threads, fps = result
+        entry["ffmpeg"] = {"threads": threads, "fps": round(fps, 2)}
+    entry["measured_at"] = datetime.now().isoformat(timespec="seconds")
+    return entry
+
+
+def show_profile(profile):
+    """プロファイルの内容を表示"""
+    machine = profile.machine
+    numba = "あり" if machine.get("numba") else "なし"
+    print(f"プロファイル: {profile.path}")
+    print(
+        f"マシン: {machine.get('cpu')} / {machine.get('cores')}コア / "
+        f"OpenCV {machine.get('opencv')} / Numba {numba}"
+        f"{'' if profile.matches() else '（このマシンとは違うため使われません）'}"
+    )
+    for size, entry in sorted(
+        profile.sizes.items(),
+        key=lambda item: math.prod(map(int, item[0].split("x"))),
+    ):
+        print(f"\n{size}（{entry.get('measured_at', '-')}）")
+        if "run" in entry:
+            print(f"  run.py: {describe_run(entry['run'])}（{entry['run']['fps']} fps）")
+        for script, name in (
+            ("cv", "remove_greenback_cv.py"),
+            ("ffmpeg", "remove_greenback.py"),
+        ):
+            if script in entry:
+                tuned = entry[script]
+                print(f"  {name}: {tuned['threads']}スレッド（{tuned['fps']} fps）")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="マシンごとに最も速い処理方式を計測してプロファイルに保存"
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=["1920x1080"],
+        help="計測する解像度（例: 1280x720 1920x1080、デフォルト: 1920x1080）",
+    )
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=CLIP_SECONDS,
+        help=f"計測に使う合成クリップの長さ（秒、デフォルト: {CLIP_SECONDS:g}）",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=2, help="1つの設定の計測回数（最も速い回を使う）"
+    )
+    parser.add_argument(
+        "--cores", type=int, default=None, help="使ってよいコア数（デフォルト: 自動検出）"
+    )
+    parser.add_argument(
+        "--max-mask-diff",
+        type=float,
+        default=MAX_MASK_DIFF,
+        help="品質の基準: マスクの不一致画素の割合の上限（デフォルト: 0.002）",
+    )
+    parser.add_argument(
+        "--min-psnr",
+        type=float,
+        default=MIN_PSNR,
+        help="品質の基準: PSNRの下限 dB（デフォルト: 40）",
+    )
+    parser.add_argument(
+        "--min-ssim",
+        type=float,
+        default=MIN_SSIM,
+        help="品質の基準: SSIMの下限（デフォルト: 0.99）",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        type=Path,
+        default=None,
+        help="プロファイルの保存先（デフォルト: ~/.cache/fujitsu/autotune.json）",
+    )
+    parser.add_argument(
+        "--show", action="store_true", help="計測せずに保存済みのプロファイルを表示"
+    )
+    args = parser.parse_args()
+    path = args.profile or default_profile_path()
+
+    if args.show:
+        try:
+            show_profile(Profile.load(path))
+        except FileNotFoundError:
+            print(f"プロファイルがありません: {path}（autotune.py で計測してください）")
+            sys.exit(1)
+        except (OSError, ValueError) as e:
+            print(f"エラー: プロファイルを読み込めません（{path}）: {e}")
+            sys.exit(1)
+        return
+
+    # 同じマシンの以前の計測結果に、今回の解像度を追加・上書きする
+    profile = Profile(path)
+    if path.exists():
+        try:
+            previous = Profile.load(path)
+            if previous.matches():
+                profile = previous
+        except (OSError, ValueError):
+            pass
+
+    cores = max(1, args.cores or available_cores())
+    # 計測ではスレッド数を候補ごとに変えるので、1つの解像度を測り終えたら戻す
+    plan = plan_threads(cores=cores)
+    apply_thread_plan(plan)
+    print(f"マシン: {profile.machine['cpu']} / {cores}コア")
+    print(
+        f"品質の基準: マスク差 {args.max_mask_diff * 100:g}% 以下、"
+        f"PSNR {args.min_psnr:g} dB 以上、SSIM {args.min_ssim:g} 以上"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            try:
+                profile.sizes[size] = tune_size(size, args, cores, Path(tmp))
+            except RuntimeError as e:
+                print(f"エラー: {size} の計測に失敗しました: {e}")
+                sys.exit(1)
+            finally:
+                apply_thread_plan(plan)
+            profile.save()
+
+    print()
+    show_profile(profile)
+    print("\n以後の run.py・remove_greenback_cv.py・remove_greenback.py は、この設定を使います")
+    print("（使わない場合は --no-autotune）")
+
+
+if __name__ == "__main__":
+    main()
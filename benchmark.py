@@ -0,0 +1,1041 @@
+#!/usr/bin/env python3
+"""
+処理速度・精度のベンチマークスクリプト
+
+合成したグリーンバックフレームを使って、各処理方式の速度と
+従来の処理（基準）との差を計測します。
+
+使用方法:
+    # マスク推定（低解像度 + 境界再判定）のベンチマーク
+    uv run python benchmark.py mask
+
+    # 解像度と繰り返し回数を指定
+    uv run python benchmark.py mask --sizes 1920x1080 3840x2160 --repeat 20
+
+    # 人物矩形追跡による合成範囲の限定のベンチマーク
+    uv run python benchmark.py composite
+
+    # キーヤー（HSV / YCbCr）の速度比較
+    uv run python benchmark.py keyer --similarity 0.3 --blend 0.1
+
+    # Numba融合処理と通常処理の速度・出力の一致を確認（要numba）
+    uv run python benchmark.py fused
+
+    # 帯単位の処理とフレーム全体の処理の比較（1080p / 4K / 8K）
+    uv run python benchmark.py strips --threads 8
+
+    # 同時実行数ごとのスループット（スレッド数の割り当てあり/なし）
+    uv run python benchmark.py threads --jobs 1 2 4 8
+
+    # 動画の長さを変えてもピークメモリが増えないことを確認（増えたら終了コード1）
+    uv run python benchmark.py memory --size 3840x2160 --frames 30 120
+
+    # 1本の動画を複数プロセスで合成した場合の速度と出力の一致（共有メモリ）
+    uv run python benchmark.py shared --processes 1 2 4 8
+
+    # 解像度違いの版を合成と同時に作る場合と、出力を読み直して作る場合の比較
+    uv run python benchmark.py renditions --size 1920x1080 --heights 720 480
+
+    # 連番PNGの入出力（スレッドで並列）と動画ファイルの入出力の比較
+    uv run python benchmark.py sequence --threads 1 4 8
+
+    # 長い動画の一部だけを処理する場合（--start / --end）の処理時間
+    uv run python benchmark.py range --seconds 120 --excerpt 5
+
+    # fujitsu コマンドの起動時間（--help・list・probe と各スクリプト）
+    uv run python benchmark.py startup --repeat 20
+
+    # パイプラインの段ごとの時間（run.py の各処理方式・remove_greenback_cv.py）
+    uv run python benchmark.py stages --sizes 1920x1080
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import fused
+from concurrency import available_cores, plan_threads
+from keyers import hsv_mask, is_soft_keyer, make_keyer, ycbcr_table
+from image_sequence import SequenceReader, SequenceWriter
+from memory import estimate_job_bytes, format_size
+from renditions import rendition_size
+from pipeline import FrameData, layout_rect
+from remove_greenback_cv import make_pipeline as make_cv_pipeline
+from run import (
+    change_background,
+    composite_frame,
+    compute_bg_hsv_mean,
+    compute_layout,
+    make_pipeline,
+    process_video,
+)
+from strips import StripCompositor
+from tracking import SubjectTracker
+
+LOWER_GREEN = (35, 80, 80)
+UPPER_GREEN = (85, 255, 255)
+
+
+def parse_size(text):
+    """'1920x1080' 形式の文字列を (width, height) に変換"""
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def make_synthetic_frame(width, height, seed=0):
+    """
+    人物シルエット入りの合成グリーンバックフレームを作成
+
+    緑背景には照明ムラとノイズを、人物には肌・服・髪の色と
+    細い髪の毛を入れて、境界付近の判定が難しくなるようにする。
+
+    Args:
+        width: フレーム幅
+        height: フレーム高さ
+        seed: 乱数シード（フレームごとに変えると人物が少し動く）
+
+    Returns:
+        BGRフレーム
+    """
+    rng = np.random.default_rng(seed)
+
+    # 照明ムラのある緑背景
+    gradient = np.linspace(0.8, 1.0, width, dtype=np.float32)[np.newaxis, :]
+    frame = np.zeros((height, width, 3), dtype=np.float32)
+    frame[:, :, 0] = 40 * gradient
+    frame[:, :, 1] = 200 * gradient
+    frame[:, :, 2] = 50 * gradient
+    frame += rng.normal(0, 4, frame.shape).astype(np.float32)
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+
+    # 人物（胴体・頭・髪）
+    cx = width // 2 + int(width * 0.01 * np.sin(seed))
+    unit = min(width, height)
+    cv2.rectangle(
+        frame,
+        (cx - unit // 5, height // 2),
+        (cx + unit // 5, height),
+        (90, 60, 50),
+        -1,
+    )
+    cv2.ellipse(
+        frame,
+        (cx, height // 2 - unit // 10),
+        (unit // 9, unit // 7),
+        0,
+        0,
+        360,
+        (120, 160, 210),
+        -1,
+    )
+    for i in range(12):
+        x = cx - unit // 9 + i * unit // 54
+        cv2.line(
+            frame,
+            (x, height // 2 - unit // 4),
+            (x + unit // 40, height // 2 - unit // 10),
+            (30, 40, 60),
+            1,
+        )
+
+    return frame
+
+
+def time_it(func, repeat):
+    """func を repeat 回実行し、1回あたりの平均秒数を返す"""
+    func()  # ウォームアップ
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def mask_error(mask, reference):
+    """
+    基準マスクとの差を計算
+
+    Returns:
+        tuple: (不一致ピクセルの割合[%], 人物領域のIoU)
+    """
+    mismatch = np.count_nonzero(mask != reference) / reference.size * 100
+    person = mask == 0
+    person_ref = reference == 0
+    union = np.count_nonzero(person | person_ref)
+    iou = np.count_nonzero(person & person_ref) / union if union else 1.0
+    return mismatch, iou
+
+
+def bench_mask(args):
+    """低解像度マスク推定の速度と精度を全解像度HSVと比較"""
+    print(f"{'解像度':>10} {'方式':>12} {'ms/frame':>10} {'fps':>8} {'速度比':>7} {'不一致%':>8} {'IoU':>7}")
+    print("-" * 70)
+
+    for size in args.sizes:
+        width, height = parse_size(size)
+        frame = make_synthetic_frame(width, height)
+        reference = hsv_mask(frame, LOWER_GREEN, UPPER_GREEN)
+        base = time_it(lambda: hsv_mask(frame, LOWER_GREEN, UPPER_GREEN), args.repeat)
+
+        rows = [("hsv", base, 0.0, 1.0)]
+        for downscale in (4, 8):
+            key = make_keyer("hsv", LOWER_GREEN, UPPER_GREEN, downscale=downscale)
+            sec = time_it(lambda: key(frame), args.repeat)
+            mask = key(frame)
+            mismatch, iou = mask_error(mask, reference)
+            rows.append((f"multires/{downscale}", sec, mismatch, iou))
+
+        for name, sec, mismatch, iou in rows:
+            print(
+                f"{size:>10} {name:>12} {sec * 1000:>10.2f} {1 / sec:>8.1f} "
+                f"{base / sec:>6.2f}x {mismatch:>8.4f} {iou:>7.4f}"
+            )
+
+
+def bench_keyer(args):
+    """HSVキーヤーとYCbCrキーヤーの速度を比較"""
+    print(f"{'解像度':>10} {'キーヤー':>14} {'ms/frame':>10} {'fps':>8} {'速度比':>7} {'人物%':>7}")
+    print("-" * 64)
+
+    for size in args.sizes:
+        width, height = parse_size(size)
+        frame = make_synthetic_frame(width, height)
+
+        keyers = [
+            ("hsv", make_keyer("hsv", LOWER_GREEN, UPPER_GREEN)),
+            ("ycbcr", make_keyer("ycbcr", similarity=args.similarity, blend=args.blend)),
+            ("hsv/8", make_keyer("hsv", LOWER_GREEN, UPPER_GREEN, downscale=8)),
+            (
+                "ycbcr/8",
+                make_keyer(
+                    "ycbcr", similarity=args.similarity, blend=args.blend, downscale=8
+                ),
+            ),
+        ]
+
+        base = None
+        for name, key in keyers:
+            sec = time_it(lambda: key(frame), args.repeat)
+            base = base or sec
+            # 人物（マスク値が255未満）の割合
+            person = np.count_nonzero(key(frame) < 255) / (width * height) * 100
+            print(
+                f"{size:>10} {name:>14} {sec * 1000:>10.2f} {1 / sec:>8.1f} "
+                f"{base / sec:>6.2f}x {person:>7.2f}"
+            )
+
+
+def make_background(width, height):
+    """合成先の背景画像（グラデーション）を作成"""
+    x = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+    bg = np.zeros((height, width, 3), dtype=np.uint8)
+    bg[:, :, 0] = (x * 0.5 + 100).astype(np.uint8)
+    bg[:, :, 1] = (y * 0.5 + 60).astype(np.uint8)
+    bg[:, :, 2] = ((x + y) * 0.25 + 40).astype(np.uint8)
+    return bg
+
+
+def bench_composite(args):
+    """人物矩形追跡あり/なしで1フレームの合成時間を比較"""
+    print(f"{'解像度':>10} {'方式':>10} {'ms/frame':>10} {'fps':>8} {'速度比':>7} {'最大差':>6}")
+    print("-" * 60)
+
+    for size in args.sizes:
+        width, height = parse_size(size)
+        frame = make_synthetic_frame(width, height)
+        bg_img = make_background(width, height)
+        layout = compute_layout(width, height, 0.7, 0.2)
+        bg_hsv_mean = compute_bg_hsv_mean(bg_img, layout)
+        mask_inv = cv2.bitwise_not(hsv_mask(frame, LOWER_GREEN, UPPER_GREEN))
+
+        reference, _ = composite_frame(frame, mask_inv, bg_img, layout, bg_hsv_mean)
+        base = time_it(
+            lambda: composite_frame(frame, mask_inv, bg_img, layout, bg_hsv_mean),
+            args.repeat,
+        )
+
+        tracker = SubjectTracker(width, height)
+        canvas = bg_img.copy()
+        state = {"rect": None}
+
+        def tracked():
+            box = tracker.update(mask_inv)
+            if state["rect"] is not None:
+                y0, y1, x0, x1 = state["rect"]
+                canvas[y0:y1, x0:x1] = bg_img[y0:y1, x0:x1]
+            _, state["rect"] = composite_frame(
+                frame, mask_inv, bg_img, layout, bg_hsv_mean, box, canvas
+            )
+            return canvas
+
+        sec = time_it(tracked, args.repeat)
+        diff = np.abs(tracked().astype(np.int16) - reference).max()
+
+        print(f"{size:>10} {'full':>10} {base * 1000:>10.2f} {1 / base:>8.1f} {1:>6.2f}x {0:>6}")
+        print(
+            f"{size:>10} {'tracked':>10} {sec * 1000:>10.2f} {1 / sec:>8.1f} "
+            f"{base / sec:>6.2f}x {diff:>6}"
+        )
+
+
+def bench_fused(args):
+    """Numba融合処理と通常処理（キーヤー + composite_frame）の速度と出力の差を比較"""
+    if not fused.FUSED_AVAILABLE:
+        print("Numba がインストールされていません（pip install numba）")
+        return
+
+    print(
+        f"{'解像度':>10} {'キーヤー':>8} {'輝度':>4} {'opencv ms':>10} {'fused ms':>9} "
+        f"{'速度比':>7} {'最大差':>6} {'差分画素':>8}"
+    )
+    print("-" * 76)
+
+    for size in args.sizes:
+        width, height = parse_size(size)
+        frames = [make_synthetic_frame(width, height, seed) for seed in range(4)]
+        bg_img = make_background(width, height)
+        layout = compute_layout(width, height, 0.7, 0.2)
+
+        for keyer in ("hsv", "ycbcr"):
+            for brightness in (True, False):
+                bg_hsv_mean = compute_bg_hsv_mean(bg_img, layout) if brightness else None
+                key = make_keyer(keyer, LOWER_GREEN, UPPER_GREEN)
+                soft = is_soft_keyer(keyer)
+                compositor = fused.FusedCompositor(
+                    (width, height),
+                    layout,
+                    fused.KEY_HSV if keyer == "hsv" else fused.KEY_LUT,
+                    LOWER_GREEN,
+                    UPPER_GREEN,
+                    ycbcr_table(0.3, 0.1),
+                    bg_hsv_mean,
+                    soft,
+                )
+                canvas = bg_img.copy()
+
+                def reference(frame):
+                    mask_inv = cv2.bitwise_not(key(frame))
+                    return composite_frame(
+                        frame, mask_inv, bg_img, layout, bg_hsv_mean, soft=soft
+                    )[0]
+
+                # 出力の一致を確認（JITコンパイルも兼ねる）
+                max_diff = 0
+                diff_pixels = 0
+                for frame in frames:
+                    diff = cv2.absdiff(
+                        compositor.composite(frame, bg_img, canvas), reference(frame)
+                    )
+                    max_diff = max(max_diff, int(diff.max()))
+                    diff_pixels += np.count_nonzero(diff.max(axis=2))
+
+                base = time_it(lambda: [reference(f) for f in frames], args.repeat)
+                sec = time_it(
+                    lambda: [compositor.composite(f, bg_img, canvas) for f in frames],
+                    args.repeat,
+                )
+                n = len(frames)
+                print(
+                    f"{size:>10} {keyer:>8} {'ON' if brightness else 'OFF':>4} "
+                    f"{base / n * 1000:>10.2f} {sec / n * 1000:>9.2f} "
+                    f"{base / sec:>6.2f}x {max_diff:>6} {diff_pixels:>8}"
+                )
+
+
+def bench_strips(args):
+    """帯単位の処理（StripCompositor）とフレーム全体の処理の速度と出力の差を比較"""
+    threads = args.threads or cv2.getNumThreads()
+    cv2.setNumThreads(threads)
+    print(f"スレッド数: {threads}")
+    print(
+        f"{'解像度':>10} {'輝度':>4} {'帯数':>4} {'full ms':>9} {'strips ms':>10} "
+        f"{'速度比':>7} {'最大差':>6} {'差分画素':>8}"
+    )
+    print("-" * 70)
+
+    for size in args.sizes:
+        width, height = parse_size(size)
+        frame = make_synthetic_frame(width, height)
+        bg_img = make_background(width, height)
+        layout = compute_layout(width, height, args.scale, 0.2)
+        key = make_keyer("hsv", LOWER_GREEN, UPPER_GREEN)
+
+        for brightness in (True, False):
+            bg_hsv_mean = compute_bg_hsv_mean(bg_img, layout) if brightness else None
+
+            def full():
+                mask_inv = cv2.bitwise_not(key(frame))
+                return composite_frame(frame, mask_inv, bg_img, layout, bg_hsv_mean)[0]
+
+            compositor = StripCompositor(
+                (width, height), layout, key, bg_hsv_mean, threads=threads
+            )
+            canvas = bg_img.copy()
+
+            expected = full()
+            base = time_it(full, args.repeat)
+            # 帯単位の処理は OpenCV の内部のスレッドを1つにする（run.change_background と同じ）
+            cv2.setNumThreads(1)
+            diff = cv2.absdiff(compositor.composite(frame, bg_img, canvas), expected)
+            sec = time_it(lambda: compositor.composite(frame, bg_img, canvas), args.repeat)
+            cv2.setNumThreads(threads)
+            compositor.close()
+            print(
+                f"{size:>10} {'ON' if brightness else 'OFF':>4} "
+                f"{len(compositor.strips):>4} {base * 1000:>9.2f} {sec * 1000:>10.2f} "
+                f"{base / sec:>6.2f}x {int(diff.max()):>6} "
+                f"{np.count_nonzero(diff.max(axis=2)):>8}"
+            )
+
+
+def _composite_worker(width, height, frame_count, threads):
+    """
+    1インスタンス分の処理（threads スレッドで frame_count フレームを合成）
+
+    Returns:
+        tuple: (開始時刻, 終了時刻)
+    """
+    cv2.setNumThreads(threads)
+    frame = make_synthetic_frame(width, height)
+    bg_img = make_background(width, height)
+    layout = compute_layout(width, height, 0.7, 0.2)
+    bg_hsv_mean = compute_bg_hsv_mean(bg_img, layout)
+
+    def step():
+        mask_inv = cv2.bitwise_not(hsv_mask(frame, LOWER_GREEN, UPPER_GREEN))
+        composite_frame(frame, mask_inv, bg_img, layout, bg_hsv_mean)
+
+    step()  # ウォームアップ
+    start = time.time()
+    for _ in range(frame_count):
+        step()
+    return start, time.time()
+
+
+def bench_threads(args):
+    """同時実行数を変えて、スレッド数の割り当てあり/なしの合計スループットを比較"""
+    cores = args.cores or available_cores()
+    width, height = parse_size(args.size)
+    default_threads = cv2.getNumThreads()
+    print(f"コア数: {cores} / 解像度: {args.size} / OpenCV既定スレッド数: {default_threads}")
+    print(f"{'同時実行':>8} {'方式':>8} {'スレッド':>8} {'合計fps':>9} {'1本fps':>8} {'効率':>6}")
+    print("-" * 56)
+
+    base = None
+    for jobs in args.jobs:
+        plan = plan_threads(jobs, cores=cores)
+        for name, threads in (("既定", default_threads), ("計画", plan.threads)):
+            with ProcessPoolExecutor(
+                max_workers=jobs, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        _composite_worker, width, height, args.frames, threads
+                    )
+                    for _ in range(jobs)
+                ]
+                spans = [future.result() for future in futures]
+
+            wall = max(end for _, end in spans) - min(start for start, _ in spans)
+            fps = jobs * args.frames / wall
+            base = base or fps
+            # 効率: 1本のときの fps × min(同時実行数, コア数) に対する割合
+            efficiency = fps / (base * min(jobs, cores)) * 100
+            print(
+                f"{jobs:>8} {name:>8} {threads:>8} {fps:>9.1f} "
+                f"{fps / jobs:>8.1f} {efficiency:>5.0f}%"
+            )
+
+
+def write_synthetic_video(path, width, height, frame_count, fps=30, codec="MJPG"):
+    """
+    合成フレームで動画を作成（4枚を繰り返すので、静止フレームの再利用は起きない）
+    """
+    frames = [make_synthetic_frame(width, height, seed) for seed in range(4)]
+    writer = cv2.VideoWriter(
+        str(path), cv2.VideoWriter_fourcc(*codec), fps, (width, height)
+    )
+    for i in range(frame_count):
+        writer.write(frames[i % len(frames)])
+    writer.release()
+
+
+def bench_memory(args):
+    """動画の長さだけを変えて、1本の処理のピークRSSを比較"""
+    width, height = parse_size(args.size)
+    estimate = estimate_job_bytes(width, height)
+    print(f"解像度: {args.size} / 見積もり: {format_size(estimate)}")
+    print(f"{'フレーム数':>10} {'ピークRSS':>10} {'最短との差':>10}")
+    print("-" * 36)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        bg_path = tmp / "bg.png"
+        cv2.imwrite(str(bg_path), make_background(width, height))
+
+        peaks = []
+        for frame_count in args.frames:
+            video_path = tmp / f"green_{frame_count}.avi"
+            write_synthetic_video(video_path, width, height, frame_count)
+
+            # 前の計測の影響を受けないよう、1本ごとに新しいプロセスで処理
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                future = executor.submit(
+                    process_video, video_path, bg_path, tmp / "output.avi"
+                )
+                success, stats = future.result()
+
+            if not success or stats["peak_rss"] is None:
+                print("ピークRSSを計測できませんでした")
+                sys.exit(1)
+            peaks.append(stats["peak_rss"])
+            growth = stats["peak_rss"] - peaks[0]
+            print(
+                f"{frame_count:>10} {format_size(stats['peak_rss']):>10} "
+                f"{growth / 1024**2:>+8.1f}MB"
+            )
+
+    # 動画の長さに比例して増えていたら失敗（1フレーム分の揺らぎは許容）
+    allowed = width * height * 3 + 16 * 1024**2
+    if max(peaks) - peaks[0] > allowed:
+        print(f"✗ 動画が長くなるとメモリが増えています（許容: {format_size(allowed)}）")
+        sys.exit(1)
+    print("✓ メモリは動画の長さによらず一定です")
+
+
+def read_all_frames(path):
+    """動画の全フレームを読み込む（出力の比較用）"""
+    cap = cv2.VideoCapture(str(path))
+    frames = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def bench_shared(args):
+    """1本の動画の合成プロセス数を変えて、処理速度と1プロセスの出力との差を比較"""
+    width, height = parse_size(args.size)
+    print(f"解像度: {args.size} / {args.frames}フレーム / 処理方式: {args.backend}")
+    print(f"{'プロセス':>8} {'fps':>8} {'速度比':>7} {'最大差':>6}")
+    print("-" * 36)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        bg_path = tmp / "bg.png"
+        video_path = tmp / "green.avi"
+        cv2.imwrite(str(bg_path), make_background(width, height))
+        write_synthetic_video(video_path, width, height, args.frames)
+
+        base_fps = base_frames = None
+        for processes in args.processes:
+            output_path = tmp / f"output_{processes}.avi"
+            start = time.perf_counter()
+            success = change_background(
+                video_path,
+                bg_path,
+                output_path,
+                backend=args.backend,
+                frame_processes=processes,
+            )
+            elapsed = time.perf_counter() - start
+            if not success:
+                sys.exit(1)
+
+            frames = read_all_frames(output_path)
+            fps = len(frames) / elapsed
+            if base_fps is None:
+                base_fps, base_frames = fps, frames
+            diff = max(
+                int(cv2.absdiff(frame, base).max())
+                for frame, base in zip(frames, base_frames)
+            )
+            if len(frames) != len(base_frames):
+                diff = 255
+            print(f"{processes:>8} {fps:>8.1f} {fps / base_fps:>6.2f}x {diff:>6}")
+
+
+def reencode(input_path, output_path, height):
+    """出力をデコードし直して縮小・エンコード（convert_video と同じ手順の OpenCV 版）"""
+    cap = cv2.VideoCapture(str(input_path))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    size = rendition_size(
+        int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        height,
+    )
+    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    writer = cv2.VideoWriter(str(output_path), fourcc, fps, size)
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        writer.write(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+    writer.release()
+    cap.release()
+
+
+def bench_renditions(args):
+    """解像度違いの版を、合成と同時に作る場合と出力を読み直して作る場合の処理時間"""
+    width, height = parse_size(args.size)
+    labels = ", ".join(f"{h}p" for h in args.heights)
+    print(f"解像度: {args.size} / {args.frames}フレーム / 版: {labels}")
+    print(f"{'方式':<24} {'秒':>7} {'元の出力だけとの差':>16}")
+    print("-" * 52)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        bg_path = tmp / "bg.png"
+        video_path = tmp / "green.avi"
+        cv2.imwrite(str(bg_path), make_background(width, height))
+        write_synthetic_video(video_path, width, height, args.frames)
+
+        def timed(func):
+            start = time.perf_counter()
+            func()
+            return time.perf_counter() - start
+
+        base = timed(lambda: change_background(video_path, bg_path, tmp / "a.mp4"))
+
+        def separate():
+            change_background(video_path, bg_path, tmp / "b.mp4")
+            for h in args.heights:
+                reencode(tmp / "b.mp4", tmp / f"b_{h}p.mp4", h)
+
+        together = timed(
+            lambda: change_background(
+                video_path, bg_path, tmp / "c.mp4", renditions=args.heights
+            )
+        )
+        rows = [
+            ("元の出力だけ", base),
+            ("合成と同時", together),
+            ("出力を読み直して変換", timed(separate)),
+        ]
+        print()
+        for name, sec in rows:
+            print(f"{name:<24} {sec:>7.2f} {sec - base:>+15.2f}s")
+
+
+def bench_range(args):
+    """長い動画の最後の数秒だけを処理する場合と、全体を処理する場合の処理時間"""
+    width, height = parse_size(args.size)
+    fps = 30
+    print(f"解像度: {args.size} / 動画 {args.seconds:g}秒 / 範囲 {args.excerpt:g}秒")
+    print(f"{'処理':<20} {'フレーム':>8} {'秒':>7} {'ms/frame':>9}")
+    print("-" * 48)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        bg_path = tmp / "bg.png"
+        # mp4v はキーフレームの間のフレームがあるので、シーク後のデコードも含めて計る
+        video_path = tmp / "green.mp4"
+        cv2.imwrite(str(bg_path), make_background(width, height))
+        frame_count = round(args.seconds * fps)
+        write_synthetic_video(video_path, width, height, frame_count, fps, "mp4v")
+
+        start = ("seconds", args.seconds - args.excerpt)
+        rows = []
+        for name, options, frames in [
+            ("全体", {}, frame_count),
+            ("最後の範囲だけ", {"start": start}, round(args.excerpt * fps)),
+        ]:
+            begin = time.perf_counter()
+            change_background(video_path, bg_path, tmp / "out.mp4", **options)
+            rows.append((name, frames, time.perf_counter() - begin))
+
+    print()
+    for name, frames, sec in rows:
+        print(f"{name:<20} {frames:>8} {sec:>7.2f} {sec / frames * 1000:>9.2f}")
+
+
+def bench_stages(args):
+    """パイプラインの段ごとの時間（run.py の各処理方式と remove_greenback_cv.py）"""
+    for size in args.sizes:
+        width, height = parse_size(size)
+        frames = [make_synthetic_frame(width, height, seed) for seed in range(4)]
+        bg_img = make_background(width, height)
+        layout = compute_layout(width, height, 0.7, 0.2)
+        bg_hsv_mean = compute_bg_hsv_mean(bg_img, layout)
+        run_args = (
+            (width, height),
+            layout,
+            "hsv",
+            LOWER_GREEN,
+            UPPER_GREEN,
+            0.3,
+            0.1,
+            1,
+            bg_hsv_mean,
+            False,
+        )
+
+        # (名前, パイプライン, 配置, 背景の平均HSV値)
+        run_configs = [
+            ("run", "opencv", False),
+            ("run track", "opencv", True),
+            ("run strips", "strips", False),
+        ]
+        if fused.FUSED_AVAILABLE:
+            run_configs.append(("run fused", "fused", False))
+        configs = [
+            (name, make_pipeline(*run_args, backend, track), layout, bg_hsv_mean)
+            for name, backend, track in run_configs
+        ]
+        full = (width, height, 0, 0)
+        for name, fuse_copy in (("cv", False), ("cv copy", True)):
+            pipeline = make_cv_pipeline(
+                (width, height), LOWER_GREEN, UPPER_GREEN, fuse_copy
+            )
+            configs.append((name, pipeline, full, None))
+
+        print(f"\n解像度: {size}（ms/frame）")
+        print(f"{'構成':<12} {'合計':>7}  段")
+        print("-" * 76)
+        for name, pipeline, config_layout, mean in configs:
+            canvas = bg_img.copy()
+            dirty = layout_rect(config_layout)
+            # ウォームアップ（JITコンパイル・スレッドの起動）
+            pipeline.process(FrameData(frames[0], bg_img, mean, canvas, dirty, True))
+            pipeline.seconds = {}
+            for _ in range(args.repeat):
+                for frame in frames:
+                    pipeline.last_lap = time.perf_counter()
+                    pipeline.process(FrameData(frame, bg_img, mean, canvas, dirty))
+            n = args.repeat * len(frames)
+            total = sum(pipeline.seconds.values()) / n * 1000
+            parts = "  ".join(
+                f"{stage} {sec / n * 1000:.2f}"
+                for stage, sec in pipeline.seconds.items()
+            )
+            print(f"{name:<12} {total:>7.2f}  {parts}")
+            pipeline.close()
+
+
+def bench_startup(args):
+    """fujitsu コマンドとスクリプトを別プロセスで起動し、終了までの時間を比較"""
+    base_dir = Path(__file__).parent.absolute()
+    # インストールしていなくても python -m fujitsu で起動できるようにする
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [str(base_dir / "src"), str(base_dir), env.get("PYTHONPATH", "")]
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = Path(tmp) / "green.avi"
+        write_synthetic_video(video_path, 320, 180, 10)
+
+        fujitsu = [sys.executable, "-m", "fujitsu"]
+        commands = [
+            ("python（何もしない）", [sys.executable, "-c", "pass"]),
+            ("fujitsu --help", [*fujitsu, "--help"]),
+            ("fujitsu list", [*fujitsu, "list"]),
+            ("fujitsu probe", [*fujitsu, "probe", str(video_path)]),
+            ("fujitsu run --help", [*fujitsu, "run", "--help"]),
+            ("python run.py --help", [sys.executable, "run.py", "--help"]),
+        ]
+        print(f"{'コマンド':<24} {'中央値ms':>9} {'最小ms':>8}")
+        print("-" * 44)
+        for name, command in commands:
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                subprocess.run(
+                    command,
+                    cwd=base_dir,
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    check=False,
+                )
+                times.append((time.perf_counter() - start) * 1000)
+            print(f"{name:<24} {statistics.median(times):>9.1f} {min(times):>8.1f}")
+
+
+def bench_sequence(args):
+    """同じフレームを動画ファイルと連番PNGで入出力し、読み書きだけ・合成込みの fps を比較"""
+    width, height = parse_size(args.size)
+    default_threads = cv2.getNumThreads()
+    print(f"解像度: {args.size} / {args.frames}フレーム")
+    print(f"{'入出力':<20} {'スレッド':>8} {'読込fps':>8} {'書出fps':>8} {'合成込fps':>9}")
+    print("-" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        bg_path = tmp / "bg.png"
+        video_path = tmp / "green.avi"
+        sequence_dir = tmp / "green_sequence"
+        cv2.imwrite(str(bg_path), make_background(width, height))
+        write_synthetic_video(video_path, width, height, args.frames)
+        writer = SequenceWriter(sequence_dir, default_threads)
+        for frame in read_all_frames(video_path):
+            writer.write(frame)
+        writer.release()
+
+        # 書き出しだけの計測に使う合成済みフレーム（4枚を繰り返す）
+        frames = [make_synthetic_frame(width, height, seed) for seed in range(4)]
+        frames = [frames[i % 4] for i in range(args.frames)]
+
+        def fps(func):
+            start = time.perf_counter()
+            func()
+            return args.frames / (time.perf_counter() - start)
+
+        def video_read():
+            read_all_frames(video_path)
+
+        def video_write():
+            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+            out = cv2.VideoWriter(str(tmp / "out.mp4"), fourcc, 30, (width, height))
+            for frame in frames:
+                out.write(frame)
+            out.release()
+
+        rows = [
+            (
+                "動画 → mp4v",
+                default_threads,
+                fps(video_read),
+                fps(video_write),
+                fps(lambda: change_background(video_path, bg_path, tmp / "out.mp4")),
+            )
+        ]
+
+        for threads in args.threads:
+            cv2.setNumThreads(threads)
+
+            def sequence_read():
+                reader = SequenceReader(sequence_dir, threads=threads)
+                while reader.read()[0]:
+                    pass
+                reader.release()
+
+            def sequence_write():
+                writer = SequenceWriter(tmp / "out_sequence", threads)
+                for frame in frames:
+                    writer.write(frame)
+                writer.release()
+
+            def sequence_composite():
+                change_background(
+                    sequence_dir, bg_path, tmp / "out_sequence", encoder="png"
+                )
+
+            rows.append(
+                (
+                    "連番PNG → 連番PNG",
+                    threads,
+                    fps(sequence_read),
+                    fps(sequence_write),
+                    fps(sequence_composite),
+                )
+            )
+        cv2.setNumThreads(default_threads)
+
+    print()
+    for name, threads, read_fps, write_fps, total_fps in rows:
+        print(
+            f"{name:<20} {threads:>8} {read_fps:>8.1f} {write_fps:>8.1f} "
+            f"{total_fps:>9.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="処理速度・精度のベンチマーク")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    mask_parser = subparsers.add_parser(
+        "mask", help="低解像度マスク推定 vs 全解像度HSV"
+    )
+    mask_parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=["1280x720", "1920x1080", "3840x2160"],
+        help="計測する解像度（例: 1920x1080）",
+    )
+    mask_parser.add_argument("--repeat", type=int, default=20, help="繰り返し回数")
+    mask_parser.set_defaults(func=bench_mask)
+
+    composite_parser = subparsers.add_parser(
+        "composite", help="人物矩形追跡あり vs 全体合成"
+    )
+    composite_parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=["1280x720", "1920x1080", "3840x2160"],
+        help="計測する解像度（例: 1920x1080）",
+    )
+    composite_parser.add_argument("--repeat", type=int, default=20, help="繰り返し回数")
+    composite_parser.set_defaults(func=bench_composite)
+
+    keyer_parser = subparsers.add_parser("keyer", help="HSVキーヤー vs YCbCrキーヤー")
+    keyer_parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=["1280x720", "1920x1080", "3840x2160"],
+        help="計測する解像度（例: 1920x1080）",
+    )
+    keyer_parser.add_argument("--similarity", type=float, default=0.3, help="類似度")
+    keyer_parser.add_argument("--blend", type=float, default=0.1, help="ブレンド量")
+    keyer_parser.add_argument("--repeat", type=int, default=20, help="繰り返し回数")
+    keyer_parser.set_defaults(func=bench_keyer)
+
+    fused_parser = subparsers.add_parser("fused", help="Numba融合処理 vs 通常処理")
+    fused_parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=["1280x720", "1920x1080", "3840x2160"],
+        help="計測する解像度（例: 1920x1080）",
+    )
+    fused_parser.add_argument("--repeat", type=int, default=5, help="繰り返し回数")
+    fused_parser.set_defaults(func=bench_fused)
+
+    strips_parser = subparsers.add_parser(
+        "strips", help="帯単位の処理 vs フレーム全体の処理"
+    )
+    strips_parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=["1920x1080", "3840x2160", "7680x4320"],
+        help="計測する解像度（例: 1920x1080）",
+    )
+    strips_parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="スレッド数（デフォルト: OpenCVの既定値）",
+    )
+    strips_parser.add_argument(
+        "--scale", type=float, default=0.7, help="人物のサイズ倍率"
+    )
+    strips_parser.add_argument("--repeat", type=int, default=10, help="繰り返し回数")
+    strips_parser.set_defaults(func=bench_strips)
+
+    threads_parser = subparsers.add_parser(
+        "threads", help="同時実行数ごとのスループット（スレッド数の割り当て）"
+    )
+    threads_parser.add_argument(
+        "--jobs",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="計測する同時実行数",
+    )
+    threads_parser.add_argument("--size", default="1920x1080", help="解像度")
+    threads_parser.add_argument(
+        "--frames", type=int, default=30, help="1本あたりのフレーム数"
+    )
+    threads_parser.add_argument(
+        "--cores", type=int, default=None, help="コア数（デフォルト: 自動検出）"
+    )
+    threads_parser.set_defaults(func=bench_threads)
+
+    memory_parser = subparsers.add_parser(
+        "memory", help="動画の長さとピークメモリ（長さによらず一定か）"
+    )
+    memory_parser.add_argument("--size", default="1920x1080", help="解像度")
+    memory_parser.add_argument(
+        "--frames",
+        type=int,
+        nargs="+",
+        default=[30, 120],
+        help="比較するフレーム数（最初の値が基準）",
+    )
+    memory_parser.set_defaults(func=bench_memory)
+
+    shared_parser = subparsers.add_parser(
+        "shared", help="1本の動画を複数プロセスで合成（共有メモリのフレームリング）"
+    )
+    shared_parser.add_argument(
+        "--processes",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="計測する合成プロセス数（最初の値が基準）",
+    )
+    shared_parser.add_argument("--size", default="1920x1080", help="解像度")
+    shared_parser.add_argument("--frames", type=int, default=120, help="フレーム数")
+    shared_parser.add_argument(
+        "--backend",
+        choices=["opencv", "fused", "strips"],
+        default="opencv",
+        help="処理方式",
+    )
+    shared_parser.set_defaults(func=bench_shared)
+
+    renditions_parser = subparsers.add_parser(
+        "renditions", help="解像度違いの版: 合成と同時 vs 出力を読み直して変換"
+    )
+    renditions_parser.add_argument("--size", default="1920x1080", help="解像度")
+    renditions_parser.add_argument(
+        "--heights",
+        type=int,
+        nargs="+",
+        default=[720, 480],
+        help="作る版の高さ",
+    )
+    renditions_parser.add_argument("--frames", type=int, default=120, help="フレーム数")
+    renditions_parser.set_defaults(func=bench_renditions)
+
+    sequence_parser = subparsers.add_parser(
+        "sequence", help="連番PNGの入出力（スレッドで並列）vs 動画ファイル"
+    )
+    sequence_parser.add_argument("--size", default="1920x1080", help="解像度")
+    sequence_parser.add_argument("--frames", type=int, default=60, help="フレーム数")
+    sequence_parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[1, 4],
+        help="連番画像の読み書きのスレッド数",
+    )
+    sequence_parser.set_defaults(func=bench_sequence)
+
+    range_parser = subparsers.add_parser(
+        "range", help="範囲指定（入力側のシーク）vs 全体の処理"
+    )
+    range_parser.add_argument("--size", default="1280x720", help="解像度")
+    range_parser.add_argument(
+        "--seconds", type=float, default=60, help="動画の長さ（秒）"
+    )
+    range_parser.add_argument(
+        "--excerpt", type=float, default=5, help="処理する範囲の長さ（秒、動画の最後）"
+    )
+    range_parser.set_defaults(func=bench_range)
+
+    stages_parser = subparsers.add_parser(
+        "stages", help="パイプラインの段ごとの時間（処理方式・融合ごと）"
+    )
+    stages_parser.add_argument(
+        "--sizes", nargs="+", default=["1280x720", "1920x1080"], help="解像度"
+    )
+    stages_parser.add_argument("--repeat", type=int, default=5, help="繰り返し回数")
+    stages_parser.set_defaults(func=bench_stages)
+
+    startup_parser = subparsers.add_parser(
+        "startup", help="fujitsu コマンド（サブコマンドを遅延 import）の起動時間"
+    )
+    startup_parser.add_argument("--repeat", type=int, default=10, help="繰り返し回数")
+    startup_parser.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+並列度（スレッド数・プロセス数）の計画
+
+同じマシンで run.py や remove_greenback.py を複数同時に動かすと、
+OpenCV の内部スレッド・libx264 のスレッド・プロセスプールがそれぞれ
+コア数ぶんのスレッドを作り、合計がコア数を大きく超えて奪い合う。
+ここでコア数と同時実行数から各段のスレッド数を決め、全体がコア数に収まるようにする。
+
+    1インスタンスのコア数 = コア数 // 同時実行数（--jobs）
+    1ワーカーのスレッド数 = 1インスタンスのコア数 // ワーカー数（--workers）
+
+各エントリポイントは add_thread_arguments() で共通の引数を追加し、
+plan_threads() → apply_thread_plan() の順に呼ぶ。
+"""
+
+import os
+from typing import NamedTuple
+
+import cv2
+
+import fused
+
+
+class ThreadPlan(NamedTuple):
+    """
+    スレッド数の割り当て
+
+    Attributes:
+        cores: 使ってよいコア数（マシン全体）
+        jobs: 同じマシンで同時に動かすインスタンス数
+        workers: このインスタンス内で同時に処理する動画数（プールサイズ）
+        threads: 1ワーカーあたりのスレッド数（OpenCV / ffmpeg / Numba 共通）
+    """
+
+    cores: int
+    jobs: int
+    workers: int
+    threads: int
+
+
+def available_cores():
+    """このプロセスが使えるコア数（CPUアフィニティを考慮）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # macOS / Windows
+        return os.cpu_count() or 1
+
+
+def plan_threads(jobs=1, workers=1, cores=None):
+    """
+    コア数と同時実行数からスレッド数を決める
+
+    Args:
+        jobs: 同じマシンで同時に動かすインスタンス数
+        workers: このインスタンス内で同時に処理する動画数
+                 （1インスタンスのコア数を超える分は切り詰める）
+        cores: 使ってよいコア数（None なら自動検出）
+
+    Returns:
+        ThreadPlan
+    """
+    cores = max(1, cores or available_cores())
+    jobs = max(1, jobs)
+    per_job = max(1, cores // jobs)
+    workers = max(1, min(workers, per_job))
+    return ThreadPlan(cores, jobs, workers, max(1, per_job // workers))
+
+
+def apply_thread_plan(plan):
+    """
+    現在のプロセスの OpenCV / Numba のスレッド数を設定
+
+    プロセスプールのワーカーでは initializer としても呼ぶ
+    （子プロセスには設定が引き継がれないため）。
+    """
+    cv2.setNumThreads(plan.threads)
+    fused.set_num_threads(plan.threads)
+
+
+def ffmpeg_thread_args(threads):
+    """
+    ffmpeg のスレッド数オプション（-threads: エンコーダ、-filter_threads: フィルタ）
+
+    Args:
+        threads: スレッド数（None または 0 なら ffmpeg の自動設定）
+
+    Returns:
+        dict: ffmpeg.output() に渡すキーワード引数
+    """
+    if not threads:
+        return {}
+    return {"threads": threads, "filter_threads": threads}
+
+
+def describe(plan):
+    """設定表示用の文字列"""
+    return (
+        f"コア数 {plan.cores} / 同時実行 {plan.jobs} / "
+        f"ワーカー {plan.workers} × {plan.threads}スレッド"
+    )
+
+
+def add_thread_arguments(parser, workers=False):
+    """
+    並列度の共通引数を argparse に追加
+
+    Args:
+        parser: argparse.ArgumentParser
+        workers: --workers（インスタンス内の並列数）も追加する
+    """
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="同じマシンで同時に動かすインスタンス数（デフォルト: 1）",
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help="使ってよいコア数（デフォルト: 自動検出）",
+    )
+    if workers:
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="同時に処理する動画数（デフォルト: 1）",
+        )
@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 """
 dougaフォルダ内の動画ファイルをffmpegでH264、mp4、10fpsに変換するスクリプト
+
+使用方法:
+    uv run python convert_videos.py
+
+    # 短い動画が多い場合: 8本ずつ1つのffmpegでまとめて変換
+    uv run python convert_videos.py --batch-size 8
 """
 
+import argparse
 import os
 from pathlib import Path
 import ffmpeg
 
+from concurrency import add_thread_arguments, describe, ffmpeg_thread_args, plan_threads
+
 
-def convert_video(input_path: Path, output_path: Path, fps: int = 10, resolution: str = "1920:1080"):
+def convert_video(input_path: Path, output_path: Path, fps: int = 10, resolution: str = "1920:1080",
+                  threads: int = None):
     """
     動画ファイルをH264、mp4、指定のfpsと解像度に変換
 
@@ -17,6 +27,7 @@ def convert_video(input_path: Path, output_path: Path, fps: int = 10, resolution
         output_path: 出力動画ファイルのパス
         fps: フレームレート（デフォルト: 10）
         resolution: 解像度（デフォルト: "1920:1080" = 1080p）
+        threads: ffmpegのスレッド数（デフォルト: ffmpegの自動設定）
     """
     try:
         print(f"変換中: {input_path.name} -> {output_path.name} (1080p)")
@@ -29,7 +40,8 @@ def convert_video(input_path: Path, output_path: Path, fps: int = 10, resolution
             vcodec='libx264',  # H264コーデック
             vf=f'scale={resolution}',  # 解像度変更
             r=fps,  # フレームレート
-            format='mp4'  # mp4フォーマット
+            format='mp4',  # mp4フォーマット
+            **ffmpeg_thread_args(threads)
         )
 
         # 上書き確認なしで実行
@@ -44,8 +56,65 @@ def convert_video(input_path: Path, output_path: Path, fps: int = 10, resolution
         return False
 
 
+def convert_videos_batch(input_paths, output_paths, fps: int = 10,
+                         resolution: str = "1920:1080", threads: int = None):
+    """
+    複数の動画を1つのffmpegでまとめて変換（ffmpegの起動を1回にする）
+
+    Args:
+        input_paths: 入力動画ファイルのパスのリスト
+        output_paths: 出力動画ファイルのパスのリスト（input_paths と同じ順）
+        fps: フレームレート（デフォルト: 10）
+        resolution: 解像度（デフォルト: "1920:1080" = 1080p）
+        threads: ffmpegのスレッド数（デフォルト: ffmpegの自動設定）
+
+    Returns:
+        list: 動画ごとの成否（1つのffmpegで処理するので全て同じ値）
+    """
+    names = ', '.join(path.name for path in input_paths)
+    try:
+        print(f"変換中（まとめて{len(input_paths)}本）: {names}")
+
+        width, height = resolution.split(':')
+        outputs = [
+            ffmpeg.output(
+                ffmpeg.input(str(input_path)).filter('scale', width, height),
+                str(output_path),
+                vcodec='libx264',
+                r=fps,
+                format='mp4',
+                **ffmpeg_thread_args(threads)
+            )
+            for input_path, output_path in zip(input_paths, output_paths)
+        ]
+
+        ffmpeg.run(ffmpeg.merge_outputs(*outputs), overwrite_output=True, quiet=True)
+
+        for output_path in output_paths:
+            print(f"完了: {output_path.name}")
+        return [True] * len(input_paths)
+
+    except ffmpeg.Error as e:
+        print(f"エラー: {names} の変換に失敗しました")
+        print(f"詳細: {e.stderr.decode() if e.stderr else str(e)}")
+        return [False] * len(input_paths)
+
+
 def main():
     """メイン処理"""
+    parser = argparse.ArgumentParser(description='動画をH264、mp4、10fpsに変換')
+    add_thread_arguments(parser)
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1,
+        help='1つのffmpegでまとめて変換する動画数（デフォルト: 1 = 1本ずつ）'
+    )
+    args = parser.parse_args()
+
+    # スレッド数の割り当て
+    plan = plan_threads(args.jobs, cores=args.cores)
+
     # パス設定
     douga_dir = Path("douga")
     output_dir = douga_dir / "converted"
@@ -67,21 +136,32 @@ def main():
         return
 
     print(f"見つかった動画ファイル: {len(video_files)}個")
+    print(f"並列度: {describe(plan)}")
     print("-" * 50)
 
     # 各動画ファイルを変換
     success_count = 0
     failed_count = 0
 
-    for video_file in video_files:
-        # 出力ファイル名（拡張子を.mp4に変更）
-        output_file = output_dir / f"{video_file.stem}.mp4"
-
-        # 変換実行
-        if convert_video(video_file, output_file, fps=10):
-            success_count += 1
-        else:
-            failed_count += 1
+    if args.batch_size > 1:
+        # batch_size 本ずつまとめて変換（エンコーダが複数動くのでスレッド数を分け合う）
+        for i in range(0, len(video_files), args.batch_size):
+            batch = video_files[i:i + args.batch_size]
+            output_files = [output_dir / f"{f.stem}.mp4" for f in batch]
+            results = convert_videos_batch(batch, output_files, fps=10,
+                                           threads=max(1, plan.threads // len(batch)))
+            success_count += results.count(True)
+            failed_count += results.count(False)
+    else:
+        for video_file in video_files:
+            # 出力ファイル名（拡張子を.mp4に変更）
+            output_file = output_dir / f"{video_file.stem}.mp4"
+
+            # 変換実行
+            if convert_video(video_file, output_file, fps=10, threads=plan.threads):
+                success_count += 1
+            else:
+                failed_count += 1
 
     # 結果表示
     print("-" * 50)
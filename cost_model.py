@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+動画ごとの処理時間の見積もりと処理順の決定
+
+並列に処理する場合、名前順だと長い動画が最後に始まって全体の時間が延びる。
+処理前に全動画のフレーム数と解像度を並列に調べ、このマシンでの
+1画素あたりの処理時間（短いマイクロベンチマークで計測）から処理時間を見積もり、
+長いものから順に処理する。
+
+調べる段階で最初のフレームも読むので、開けない・壊れた動画は
+処理の途中ではなく開始前に見つかる。
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import NamedTuple
+
+import cv2
+import ffmpeg
+
+from image_sequence import DEFAULT_SEQUENCE_FPS, open_video
+
+
+class VideoInfo(NamedTuple):
+    """
+    動画の情報
+
+    Attributes:
+        path: 動画パス
+        width: 幅
+        height: 高さ
+        frames: フレーム数（不明なら0）
+        fps: フレームレート
+    """
+
+    path: object
+    width: int
+    height: int
+    frames: int
+    fps: float
+
+
+def probe_duration(video_path):
+    """
+    ffprobe で調べた動画の長さ（秒）
+
+    Returns:
+        float: 秒、ffprobe がない・長さが分からなければ None
+    """
+    try:
+        duration = float(ffmpeg.probe(str(video_path))["format"]["duration"])
+    except (ffmpeg.Error, FileNotFoundError, KeyError, ValueError):
+        return None
+    return duration if duration > 0 else None
+
+
+def probe_video_file(video_path, sequence_fps=DEFAULT_SEQUENCE_FPS):
+    """
+    動画の解像度・フレーム数を取得し、最初のフレームが読めるか確認
+
+    フレーム数を持たないコンテナ（一部の webm / mkv）は、長さ × フレームレートで見積もる
+    （長さも分からなければ0 = 不明として、処理時間の見積もりでは最後に回る）。
+
+    Args:
+        video_path: 動画パスまたは連番画像のフォルダ
+        sequence_fps: 連番画像のフレームレート
+
+    Returns:
+        tuple: (VideoInfo, None) または読めなければ (None, エラーメッセージ)
+    """
+    cap = open_video(video_path, sequence_fps)
+    try:
+        if not cap.isOpened():
+            return None, "動画ファイルが開けません"
+
+        ok, frame = cap.read()
+        if not ok or frame is None:
+            return None, "フレームを読み込めません（壊れている可能性があります）"
+
+        height, width = frame.shape[:2]
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frames <= 0:
+            duration = probe_duration(video_path) if fps > 0 else None
+            frames = round(duration * fps) if duration is not None else 0
+        return VideoInfo(video_path, width, height, frames, fps), None
+    finally:
+        cap.release()
+
+
+def probe_videos(video_files, workers=4, sequence_fps=DEFAULT_SEQUENCE_FPS):
+    """
+    複数の動画を並列に調べる（OpenCV のデコードは GIL を解放するのでスレッドで並列になる）
+
+    Returns:
+        tuple: (VideoInfo のリスト, [(動画パス, エラーメッセージ), ...])
+    """
+    probe = partial(probe_video_file, sequence_fps=sequence_fps)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(probe, video_files))
+
+    infos = []
+    errors = []
+    for video_file, (info, error) in zip(video_files, results):
+        if info is None:
+            errors.append((video_file, error))
+        else:
+            infos.append(info)
+    return infos, errors
+
+
+def calibrate(info, step, frames=5):
+    """
+    動画の先頭の数フレームで処理時間を計測し、1画素あたりの秒数を返す
+
+    デコードと step（緑色検出〜合成）の時間を含む。
+
+    Args:
+        info: 計測に使う動画の VideoInfo
+        step: 1フレーム分の処理 step(frame)
+        frames: 計測するフレーム数
+
+    Returns:
+        float: 1画素あたりの処理時間（秒）、計測できなければ None
+    """
+    cap = open_video(info.path, info.fps)
+    try:
+        ok, frame = cap.read()
+        if not ok:
+            return None
+        step(frame)  # ウォームアップ
+
+        count = 0
+        start = time.perf_counter()
+        while count < frames:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            step(frame)
+            count += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        cap.release()
+
+    if count == 0:
+        return None
+    return elapsed / count / (info.width * info.height)
+
+
+def estimate_seconds(info, seconds_per_pixel):
+    """動画1本の処理時間の見積もり（秒）"""
+    return info.frames * info.width * info.height * seconds_per_pixel
+
+
+def order_longest_first(infos, seconds_per_pixel):
+    """見積もり時間の長い順に並べ替え"""
+    return sorted(
+        infos, key=lambda info: estimate_seconds(info, seconds_per_pixel), reverse=True
+    )
+
+
+def predict_total_seconds(infos, seconds_per_pixel, workers=1):
+    """
+    workers 本並列で、infos の順に空いたワーカーへ割り当てたときの全体の処理時間
+
+    Returns:
+        float: 予測される全体の処理時間（秒）
+    """
+    loads = [0.0] * max(1, workers)
+    for info in infos:
+        index = loads.index(min(loads))
+        loads[index] += estimate_seconds(info, seconds_per_pixel)
+    return max(loads)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+静止したフレーム（フリーズ・タイトル表示・間）の検出
+
+前のフレームと同じ（または差が許容範囲内の）フレームは、緑色検出〜合成を
+やり直さずに前の合成結果をそのまま書き出せる。
+
+    1. 指紋: フレームを小さく縮小したグレースケール画像（32x18 画素）
+       直前に合成したフレームの指紋と比べ、違えばすぐに「別のフレーム」と判定
+    2. 確認: 指紋が一致したら、全画素の差の最大値を計算して確定
+       （縮小で消える小さな動きを見逃さないため）
+
+比較の基準は「直前に合成したフレーム」なので、少しずつ変化する場面で
+差が積み重なって許容範囲を超えた場合は合成し直す。
+"""
+
+import cv2
+import numpy as np
+
+
+class FrameDeduplicator:
+    """
+    直前に合成したフレームと同じフレームかを判定する
+
+    Args:
+        tolerance: 同じとみなす画素値の差の最大値（0 = 完全一致のみ）
+        fingerprint_size: 指紋の大きさ (幅, 高さ)
+    """
+
+    def __init__(self, tolerance=0, fingerprint_size=(32, 18)):
+        self.tolerance = tolerance
+        self.fingerprint_size = fingerprint_size
+        self.reference = None
+        self.fingerprint = None
+        self.reused = 0
+
+    def _fingerprint(self, frame):
+        small = cv2.resize(frame, self.fingerprint_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def is_repeat(self, frame):
+        """
+        フレームが直前に合成したフレームと同じならTrue
+
+        False の場合は、このフレームを合成するものとして基準を更新する。
+
+        Args:
+            frame: BGRフレーム
+
+        Returns:
+            bool: 前の合成結果を再利用できればTrue
+        """
+        fingerprint = self._fingerprint(frame)
+
+        if self.reference is not None and self.reference.shape == frame.shape:
+            # 指紋の差（縮小で平均されるので、丸め誤差を除けば全画素の差の最大値以下）
+            limit = self.tolerance + 1 if self.tolerance else 0
+            if cv2.norm(fingerprint, self.fingerprint, cv2.NORM_INF) <= limit:
+                # 全画素で確認
+                if cv2.norm(frame, self.reference, cv2.NORM_INF) <= self.tolerance:
+                    self.reused += 1
+                    return True
+            np.copyto(self.reference, frame)
+        else:
+            self.reference = frame.copy()
+
+        self.fingerprint = fingerprint
+        return False
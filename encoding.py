@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+エンコード設定（x264プリセット）の自動選択
+
+「実時間」「2倍速」のような処理速度の目標を指定すると、最初の数秒分で
+各段（デコード〜合成、エンコード）の処理速度を計測し、目標を満たす中で
+最も遅い（＝圧縮効率の良い）x264プリセットを選ぶ。
+その後も動画ごとに実際の処理速度を見て、負荷の変化に合わせて1段ずつ調整する。
+
+速度は「動画の長さ / 処理にかかった時間」の倍率（1.0 = 実時間）で表す。
+"""
+
+import csv
+import threading
+import time
+from pathlib import Path
+
+import ffmpeg
+
+from image_sequence import open_video
+
+# エンコード設定の記録（CSV）の列
+LOG_FIELDS = ("output", "encoder", "preset", "crf", "target", "speed")
+
+# 並列に処理したワーカーから同じCSVに追記するときの排他
+_log_lock = threading.Lock()
+
+# 速い順（placebo は除く）
+X264_PRESETS = (
+    "ultrafast",
+    "superfast",
+    "veryfast",
+    "faster",
+    "fast",
+    "medium",
+    "slow",
+    "slower",
+    "veryslow",
+)
+
+
+def parse_speed_target(text):
+    """
+    速度目標の文字列を倍率に変換
+
+    Args:
+        text: "realtime"（= 1倍）または "2x"、"0.5x" のような倍率
+
+    Returns:
+        float: 実時間に対する倍率
+    """
+    text = text.strip().lower()
+    if text in ("realtime", "real-time", "rt"):
+        return 1.0
+    value = float(text[:-1] if text.endswith("x") else text)
+    if value <= 0:
+        raise ValueError(f"速度目標は正の値で指定してください: {text}")
+    return value
+
+
+class PresetTuner:
+    """
+    速度目標を満たす最も遅いx264プリセットを選ぶ
+
+    複数のワーカーから使われるのでロックで保護する。
+
+    Args:
+        target: 速度目標（実時間に対する倍率）
+        preset: 最初に試すプリセット
+        margin: 目標の何倍以上速ければ1段遅いプリセットに変えるか
+                （隣のプリセットとの速度差より大きくして行き来を防ぐ）
+    """
+
+    def __init__(self, target, preset="medium", margin=1.6):
+        self.target = target
+        self.index = X264_PRESETS.index(preset)
+        self.margin = margin
+        self.calibrated = False
+        self.lock = threading.Lock()
+
+    @property
+    def preset(self):
+        return X264_PRESETS[self.index]
+
+    def calibrate(self, measure, stage_speed=None):
+        """
+        プリセットを実際に試して、目標を満たす最も遅いものを選ぶ
+
+        Args:
+            measure: measure(preset) -> エンコードの速度
+            stage_speed: エンコード以外の段（デコード〜合成）の速度。
+                         全体の速度はエンコードと並行して動く段のうち遅い方で決まる
+
+        Returns:
+            dict: プリセット → 計測した全体の速度
+        """
+        with self.lock:
+            results = {}
+
+            def speed(index):
+                encode = measure(X264_PRESETS[index])
+                total = encode if stage_speed is None else min(encode, stage_speed)
+                results[X264_PRESETS[index]] = total
+                return total
+
+            index = self.index
+            if speed(index) >= self.target:
+                # 満たしている: 満たさなくなるまで遅くする
+                while index + 1 < len(X264_PRESETS):
+                    if speed(index + 1) < self.target:
+                        break
+                    index += 1
+            else:
+                # 満たしていない: 満たすまで速くする
+                while index > 0:
+                    index -= 1
+                    if speed(index) >= self.target:
+                        break
+
+            self.index = index
+            self.calibrated = True
+            return results
+
+    def update(self, speed):
+        """
+        1本処理した実際の速度でプリセットを1段調整
+
+        Returns:
+            str: 次に使うプリセット
+        """
+        with self.lock:
+            if speed < self.target and self.index > 0:
+                self.index -= 1
+            elif speed > self.target * self.margin:
+                self.index = min(self.index + 1, len(X264_PRESETS) - 1)
+            return self.preset
+
+
+class FFmpegWriter:
+    """
+    フレームを ffmpeg（libx264）に渡してエンコードする
+
+    cv2.VideoWriter と同じく write() / release() / isOpened() で使える。
+    エンコードは別プロセスで並行して動く。
+
+    audio_source を指定すると、その動画の音声を再エンコードせずに（ストリームコピー）
+    同じ ffmpeg で出力に入れる。音声のない動画なら映像だけを出力する。
+    audio_range を指定すると、映像と同じ範囲の音声だけを入れる（入力側でシーク）。
+
+    Args:
+        output_path: 出力動画パス
+        width: 幅
+        height: 高さ
+        fps: フレームレート
+        preset: x264プリセット
+        crf: 品質（18-28推奨、低いほど高品質）
+        threads: ffmpegのスレッド数（None なら自動）
+        audio_source: 音声をコピーする元の動画パス（None なら音声なし）
+        audio_range: (開始秒, 長さ秒) 元の動画の一部だけを出力する場合の範囲
+                     （長さ None なら最後まで、None なら全体）
+    """
+
+    def __init__(
+        self,
+        output_path,
+        width,
+        height,
+        fps,
+        preset="medium",
+        crf=23,
+        threads=None,
+        audio_source=None,
+        audio_range=None,
+    ):
+        # 元の動画で映像が音声より遅れて始まる場合は、その分ずらして同期させる
+        offset = video_start_offset(audio_source) if audio_source else 0.0
+        audio_args = {}
+        if audio_range is not None:
+            start, duration = audio_range
+            if start > 0:
+                # 最初のフレームの時刻から音声を始める（映像をずらす必要はなくなる）
+                audio_args["ss"] = offset + start
+                offset = 0.0
+            if duration is not None:
+                audio_args["t"] = offset + duration
+        stream = ffmpeg.input(
+            "pipe:",
+            format="rawvideo",
+            pix_fmt="bgr24",
+            s=f"{width}x{height}",
+            framerate=fps,
+            **({"itsoffset": offset} if offset else {}),
+        )
+        if audio_source is not None:
+            # "a?": 音声がなければ無視
+            audio = ffmpeg.input(str(audio_source), **audio_args)["a?"]
+            stream = ffmpeg.output(
+                stream,
+                audio,
+                str(output_path),
+                vcodec="libx264",
+                pix_fmt="yuv420p",
+                preset=preset,
+                crf=crf,
+                acodec="copy",
+                **({"threads": threads} if threads else {}),
+            )
+        elif output_path is None:
+            # 計測用: エンコードだけして捨てる
+            stream = stream.output(
+                "-", format="null", vcodec="libx264", preset=preset, crf=crf
+            )
+        else:
+            stream = stream.output(
+                str(output_path),
+                vcodec="libx264",
+                pix_fmt="yuv420p",
+                preset=preset,
+                crf=crf,
+                **({"threads": threads} if threads else {}),
+            )
+        stream = stream.global_args("-hide_banner", "-loglevel", "error")
+        stream = stream.overwrite_output()
+        try:
+            self.process = stream.run_async(pipe_stdin=True, pipe_stderr=True)
+        except OSError:
+            # ffmpeg が見つからない
+            self.process = None
+        self.error = b""
+
+    def isOpened(self):
+        return self.process is not None and self.process.poll() is None
+
+    def write(self, frame):
+        self.process.stdin.write(frame.tobytes())
+
+    def release(self):
+        """
+        入力を閉じてエンコードの終了を待つ
+
+        Returns:
+            bool: ffmpeg が正常終了したらTrue（エラー内容は self.error）
+        """
+        if self.process is None:
+            return False
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.error = self.process.stderr.read()
+        return self.process.wait() == 0
+
+
+def video_start_offset(video_path):
+    """
+    元の動画で、最初の映像フレームが音声を含むファイル全体の先頭から何秒遅れて始まるか
+
+    OpenCV で読んだ最初のフレームは時刻 0 として書き出すので、
+    音声をコピーするときはこの分だけ映像をずらす。
+
+    Returns:
+        float: 秒（ffprobe で取得できなければ 0.0）
+    """
+    try:
+        info = ffmpeg.probe(str(video_path))
+    except (ffmpeg.Error, OSError):
+        return 0.0
+
+    starts = {}
+    for stream in info.get("streams", []):
+        if "start_time" in stream:
+            starts.setdefault(stream["codec_type"], float(stream["start_time"]))
+    if "video" not in starts or "audio" not in starts:
+        return 0.0
+    return max(0.0, starts["video"] - min(starts.values()))
+
+
+def measure_encode_speed(frames, fps, preset, crf=23, threads=None):
+    """
+    フレームを指定のプリセットでエンコードし（出力は捨てる）、速度を計測
+
+    Args:
+        frames: BGRフレームのリスト（最初の数秒分）
+        fps: フレームレート
+
+    Returns:
+        float: 実時間に対する倍率
+    """
+    height, width = frames[0].shape[:2]
+    start = time.perf_counter()
+    writer = FFmpegWriter(None, width, height, fps, preset, crf, threads)
+    if not writer.isOpened():
+        raise RuntimeError("ffmpeg を起動できません")
+    for frame in frames:
+        writer.write(frame)
+    if not writer.release():
+        raise RuntimeError(writer.error.decode(errors="replace"))
+    elapsed = time.perf_counter() - start
+    return len(frames) / fps / elapsed
+
+
+def read_first_frames(video_path, count):
+    """動画（連番画像）の先頭から count フレームを読み込む（計測用）"""
+    cap = open_video(video_path)
+    frames = []
+    while len(frames) < count:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def record_encoding(log_path, output_path, **settings):
+    """
+    出力ごとのエンコード設定をCSVに追記
+
+    Args:
+        log_path: CSVファイルのパス
+        output_path: 出力動画パス
+        settings: LOG_FIELDS の列の値（encoder, preset, crf, target, speed）
+    """
+    log_path = Path(log_path)
+    row = {"output": Path(output_path).name, **settings}
+    with _log_lock:
+        write_header = not log_path.exists()
+        with open(log_path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=LOG_FIELDS, restval="")
+            if write_header:
+                writer.writeheader()
+            writer.writerow(row)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+処理するフレームの範囲（--start / --end）と入力側のシーク
+
+長い素材の一部だけが必要な場合に、先頭からデコードして捨てるのではなく、
+開始位置の直前のキーフレームまで入力側でシークしてから目的のフレームまでデコードし、
+範囲の最後のフレームを処理したらデコードをやめる。処理時間は範囲の長さ程度になる。
+
+位置は秒・時刻・フレーム番号で指定できる。
+
+    12.5        12.5秒
+    1:02.5      1分2.5秒（時:分:秒 も可）
+    300f        300フレーム目（先頭が0）
+
+範囲は開始を含み終了を含まない。時刻は、その時刻に表示されているフレーム
+（開始時刻が時刻以下で最も遅いフレーム）に変換する。
+"""
+
+import math
+import re
+
+import cv2
+
+# 時刻からフレームに変換するときの誤差の許容（29.97fps などの丸め誤差を吸収）
+_EPSILON = 1e-6
+
+_FRAME = re.compile(r"^(\d+)f$")
+_TIMECODE = re.compile(r"^(?:(\d+):)?(\d+):(\d+(?:\.\d*)?)$")
+
+
+def parse_position(text):
+    """
+    --start / --end の値を解釈
+
+    Returns:
+        tuple: ("frame", フレーム番号) または ("seconds", 秒)
+    """
+    text = text.strip().lower()
+    match = _FRAME.match(text)
+    if match:
+        return "frame", int(match.group(1))
+
+    match = _TIMECODE.match(text)
+    if match:
+        hours, minutes, seconds = match.groups()
+        seconds = int(hours or 0) * 3600 + int(minutes) * 60 + float(seconds)
+    else:
+        try:
+            seconds = float(text)
+        except ValueError:
+            raise ValueError(
+                f"位置は秒（12.5）、時刻（1:02.5）、フレーム番号（300f）で指定してください: {text}"
+            ) from None
+    if seconds < 0 or not math.isfinite(seconds):
+        raise ValueError(f"位置は0以上で指定してください: {text}")
+    return "seconds", seconds
+
+
+def format_position(position):
+    """parse_position() の戻り値を表示用の文字列に（例: "300f"、"62.5秒"）"""
+    kind, value = position
+    return f"{value}f" if kind == "frame" else f"{value:g}秒"
+
+
+def to_frame(position, fps, end=False):
+    """
+    位置をフレーム番号に変換
+
+    Args:
+        position: parse_position() の戻り値
+        fps: フレームレート
+        end: 範囲の終了（その時刻より前に始まるフレームまでを含める）
+
+    Returns:
+        int: フレーム番号
+    """
+    kind, value = position
+    if kind == "frame":
+        return value
+    if fps <= 0:
+        raise ValueError("フレームレートが不明なため、時刻で範囲を指定できません")
+    if end:
+        return math.ceil(value * fps - _EPSILON)
+    return math.floor(value * fps + _EPSILON)
+
+
+def frame_range(start, end, fps, total_frames=0):
+    """
+    処理するフレームの範囲
+
+    Args:
+        start: 開始位置（parse_position() の戻り値、None なら先頭）
+        end: 終了位置（None なら最後まで）
+        fps: フレームレート
+        total_frames: 動画のフレーム数（不明なら0）
+
+    Returns:
+        tuple: (最初のフレーム番号, 終了のフレーム番号（含まない、最後までなら None）)
+    """
+    first = to_frame(start, fps) if start is not None else 0
+    stop = to_frame(end, fps, end=True) if end is not None else None
+    if total_frames > 0:
+        if first >= total_frames:
+            raise ValueError(
+                f"開始位置が動画の長さ（{total_frames}フレーム）を超えています"
+            )
+        if stop is not None:
+            stop = min(stop, total_frames)
+    if stop is not None and stop <= first:
+        raise ValueError("終了位置が開始位置より前です")
+    return first, stop
+
+
+def seek(cap, frame):
+    """
+    次に読むフレームを frame 番目にする（入力側のシーク）
+
+    OpenCV（FFmpeg）は直前のキーフレームにシークし、目的のフレームまでデコードして進める。
+    シークできない入力（位置が合わない）は、先頭から grab() で読み飛ばす
+    （grab() は色変換をしないので read() より速い）。
+
+    Args:
+        cap: cv2.VideoCapture または SequenceReader
+        frame: フレーム番号
+
+    Returns:
+        bool: frame 番目まで進めたらTrue
+    """
+    if frame <= 0:
+        return True
+    if cap.set(cv2.CAP_PROP_POS_FRAMES, frame):
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == frame:
+            return True
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    for _ in range(frame):
+        if not cap.grab():
+            return False
+    return True
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+キーイング・輝度マッチング・合成を1パスにまとめた高速処理（Numba JIT）
+
+run.change_background の通常の処理は cvtColor → inRange → bitwise_not →
+bitwise_and → resize → ... と10回近くフレーム全体を読み書きする。
+ここでは出力画素ごとに「元画素の読み込み → 緑判定 → 縮小 → 輝度調整 → 合成」を
+まとめて行い、フレームのメモリを読む回数を減らす。
+
+輝度マッチングは人物全体の平均値が必要なので、
+    1. 緑判定 + 縮小 + 人物の平均値の集計
+    2. 輝度調整 + 合成
+の2パスになる（元フレームを読むのは1回目だけ）。どちらも行単位で並列に処理する。
+
+OpenCV の整数演算（resize の固定小数点補間、HSV変換）を再現しているので、
+結果は通常の処理とほぼ一致する（benchmark.py fused で確認できる）。
+
+Numba がインストールされていない場合は FUSED_AVAILABLE が False になり、
+run.py は通常の OpenCV の処理を使う。
+"""
+
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+try:
+    import numba
+    from numba import njit, prange
+
+    FUSED_AVAILABLE = True
+except ImportError:
+    # Numba なしでも import できるようにする（通常は OpenCV の処理を使う）
+    FUSED_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+def set_num_threads(threads):
+    """並列カーネルのスレッド数を設定（Numba がなければ何もしない）"""
+    if FUSED_AVAILABLE:
+        numba.set_num_threads(max(1, min(threads, numba.config.NUMBA_NUM_THREADS)))
+
+
+KEY_HSV = 0
+KEY_LUT = 1
+
+# OpenCV の固定小数点パラメータ
+_HSV_SHIFT = 12
+_RESIZE_BITS = 11
+_YCC_SHIFT = 14
+
+
+def _hsv_tables():
+    """OpenCV の BGR→HSV 変換（8bit）で使う除算テーブル"""
+    index = np.arange(256, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        sdiv = np.where(index > 0, np.rint((255 << _HSV_SHIFT) / index), 0)
+        hdiv = np.where(index > 0, np.rint((180 << _HSV_SHIFT) / (6.0 * index)), 0)
+    return sdiv.astype(np.int32), hdiv.astype(np.int32)
+
+
+_SDIV, _HDIV = _hsv_tables()
+_SECTOR = np.array(
+    [[1, 3, 0], [1, 0, 2], [3, 0, 1], [0, 2, 1], [0, 1, 3], [2, 1, 0]], dtype=np.int32
+)
+
+
+# hsv_bit_table を作るときに1回で判定する B の値の数（1回あたり 16 × 65536 色、約3MB）
+_TABLE_CHUNK = 16
+
+
+@lru_cache(maxsize=4)
+def hsv_bit_table(lower_green, upper_green):
+    """
+    全色（256^3）について HSV 範囲判定の結果を1bitずつ詰めたテーブル（2MB）
+
+    画素ごとの HSV 変換を表引き1回に置き換えるために使う。
+    index = B * 65536 + G * 256 + R の bit が 1 なら緑。
+    作業用の配列が大きくならないように、B の値 _TABLE_CHUNK 個ずつ判定する。
+    同じ範囲のテーブルはプロセス内で使い回す。
+    """
+    lower = np.asarray(lower_green)
+    upper = np.asarray(upper_green)
+    table = np.empty(1 << 21, dtype=np.uint8)
+
+    # 行 = B * 256 + G、列 = R の画像として判定する
+    levels = np.arange(256, dtype=np.uint8)
+    bgr = np.empty((_TABLE_CHUNK * 256, 256, 3), dtype=np.uint8)
+    bgr[:, :, 1] = np.tile(levels, _TABLE_CHUNK)[:, None]
+    bgr[:, :, 2] = levels
+    chunk_bytes = _TABLE_CHUNK * 256 * 256 // 8
+    for start in range(0, 256, _TABLE_CHUNK):
+        bgr[:, :, 0] = np.repeat(levels[start : start + _TABLE_CHUNK], 256)[:, None]
+        hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+        green = cv2.inRange(hsv, lower, upper)
+        offset = start // _TABLE_CHUNK * chunk_bytes
+        table[offset : offset + chunk_bytes] = np.packbits(
+            green.ravel() > 0, bitorder="little"
+        )
+    return table
+
+
+def _resize_coeffs(src_size, dst_size):
+    """
+    cv2.resize（INTER_LINEAR, 8bit）と同じ補間位置と固定小数点の係数を計算
+
+    Returns:
+        tuple: (元画像の位置[dst], 係数0[dst], 係数1[dst])
+    """
+    scale = 1.0 / (dst_size / src_size)
+    pos = ((np.arange(dst_size) + 0.5) * scale - 0.5).astype(np.float32)
+    ofs = np.floor(pos).astype(np.int32)
+    frac = pos - ofs
+    frac[ofs < 0] = 0
+    ofs[ofs < 0] = 0
+    last = ofs >= src_size - 1
+    frac[last] = 0
+    ofs[last] = src_size - 1
+    coef_scale = 1 << _RESIZE_BITS
+    a0 = np.rint((1.0 - frac) * coef_scale).astype(np.int32)
+    a1 = np.rint(frac * coef_scale).astype(np.int32)
+    return ofs, a0, a1
+
+
+@njit(cache=True, inline="always")
+def _bgr_to_hsv(b, g, r, sdiv, hdiv):
+    """OpenCV と同じ整数演算で BGR → HSV（H: 0-179）"""
+    v = max(b, g, r)
+    vmin = min(b, g, r)
+    diff = v - vmin
+    half = 1 << (_HSV_SHIFT - 1)
+    s = (diff * sdiv[v] + half) >> _HSV_SHIFT
+    if v == r:
+        h = g - b
+    elif v == g:
+        h = b - r + 2 * diff
+    else:
+        h = r - g + 4 * diff
+    h = (h * hdiv[diff] + half) >> _HSV_SHIFT
+    if h < 0:
+        h += 180
+    return h, s, v
+
+
+@njit(cache=True, inline="always")
+def _hsv_to_bgr(h, s, v, sector_data):
+    """OpenCV と同じ浮動小数点演算で HSV（8bit）→ BGR（255倍した値は切り捨て）"""
+    fs = np.float32(s) * np.float32(1.0 / 255.0)
+    fv = np.float32(v) * np.float32(1.0 / 255.0)
+    if fs == 0:
+        return v, v, v
+    fh = np.float32(h) * np.float32(6.0 / 180.0)
+    fh = fh % np.float32(6.0)
+    sector = int(np.floor(fh))
+    fh -= np.float32(sector)
+    if sector < 0 or sector >= 6:
+        sector = 0
+        fh = np.float32(0.0)
+    tab = (
+        fv,
+        fv * (np.float32(1.0) - fs),
+        fv * (np.float32(1.0) - fs * fh),
+        fv * (np.float32(1.0) - fs * (np.float32(1.0) - fh)),
+    )
+    b = int(tab[sector_data[sector, 0]] * np.float32(255.0))
+    g = int(tab[sector_data[sector, 1]] * np.float32(255.0))
+    r = int(tab[sector_data[sector, 2]] * np.float32(255.0))
+    return b, g, r
+
+
+@njit(cache=True, inline="always")
+def _key_pixel(b, g, r, key_mode, lut):
+    """1画素の人物マスク値（人物=255、緑=0、半透明キーヤーは中間値）"""
+    if key_mode == KEY_HSV:
+        # 全色（256^3）の判定結果を1色1bitで持つテーブルを参照
+        index = (b << 16) | (g << 8) | r
+        if (lut[index >> 3] >> (index & 7)) & 1:
+            return 0
+        return 255
+
+    # YCbCr（OpenCV の BGR→YCrCb と同じ整数演算）+ テーブル参照
+    half = 1 << (_YCC_SHIFT - 1)
+    y = (b * 1868 + g * 9617 + r * 4899 + half) >> _YCC_SHIFT
+    cr = ((r - y) * 11682 + (128 << _YCC_SHIFT) + half) >> _YCC_SHIFT
+    cb = ((b - y) * 9241 + (128 << _YCC_SHIFT) + half) >> _YCC_SHIFT
+    cr = min(max(cr, 0), 255)
+    cb = min(max(cb, 0), 255)
+    return 255 - lut[cr + cb * 256]
+
+
+@njit(cache=True)
+def _key_row(frame, sy, xofs, xa0, xa1, key_mode, lut, keyed, out_row):
+    """
+    元画像の1行を緑判定し、人物以外を黒にして横方向に補間する
+
+    out_row[dx] に resize の固定小数点の中間値 (B, G, R, マスク) を書き込む。
+    """
+    width = frame.shape[1]
+    for x in range(width):
+        b = np.int32(frame[sy, x, 0])
+        g = np.int32(frame[sy, x, 1])
+        r = np.int32(frame[sy, x, 2])
+        m = _key_pixel(b, g, r, key_mode, lut)
+        if m == 0:
+            b = g = r = 0
+        keyed[x, 0] = b
+        keyed[x, 1] = g
+        keyed[x, 2] = r
+        keyed[x, 3] = m
+
+    last = width - 1
+    for dx in range(out_row.shape[0]):
+        sx0 = xofs[dx]
+        sx1 = sx0 + 1 if sx0 < last else last
+        a0 = xa0[dx]
+        a1 = xa1[dx]
+        out_row[dx, 0] = keyed[sx0, 0] * a0 + keyed[sx1, 0] * a1
+        out_row[dx, 1] = keyed[sx0, 1] * a0 + keyed[sx1, 1] * a1
+        out_row[dx, 2] = keyed[sx0, 2] * a0 + keyed[sx1, 2] * a1
+        out_row[dx, 3] = keyed[sx0, 3] * a0 + keyed[sx1, 3] * a1
+
+
+@njit(cache=True, inline="always")
+def _vresize(v0, v1, b0, b1):
+    """resize の縦方向補間（OpenCV の SIMD 版と同じ丸め）"""
+    return ((((b0 * (v0 >> 4)) >> 16) + ((b1 * (v1 >> 4)) >> 16) + 2) >> 2)
+
+
+@njit(parallel=True, cache=True)
+def _key_scale(
+    frame, xofs, xa0, xa1, yofs, ya0, ya1,
+    key_mode, lut, sdiv, hdiv,
+    to_hsv, person_out, mask_out, row_sums, chunk_rows,
+):
+    """
+    パス1: 緑判定 + 人物の抽出 + 縮小（+ HSV変換と平均値の集計）
+
+    出力を chunk_rows 行ずつのブロックに分けて並列に処理する。ブロック内では
+    補間に使う元画像の2行を使い回すので、元画素の緑判定はほぼ1回で済む。
+
+    person_out には to_hsv なら HSV、そうでなければ BGR を書き込む。
+    row_sums[行] には人物画素の (H, S, V, 画素数) の合計を書き込む。
+    """
+    height, width = frame.shape[:2]
+    out_h, out_w = mask_out.shape
+    n_chunks = (out_h + chunk_rows - 1) // chunk_rows
+    for chunk in prange(n_chunks):
+        keyed = np.empty((width, 4), dtype=np.int32)
+        rows = np.empty((2, out_w, 4), dtype=np.int32)
+        cached = np.full(2, -1, dtype=np.int64)
+
+        for dy in range(chunk * chunk_rows, min(out_h, (chunk + 1) * chunk_rows)):
+            sy0 = yofs[dy]
+            sy1 = min(sy0 + 1, height - 1)
+            b0 = ya0[dy]
+            b1 = ya1[dy]
+
+            # 必要な2行が揃っていなければ、もう片方の行を残して読み込む
+            if cached[0] == sy0:
+                i0 = 0
+            elif cached[1] == sy0:
+                i0 = 1
+            else:
+                i0 = 1 if cached[0] == sy1 else 0
+                _key_row(frame, sy0, xofs, xa0, xa1, key_mode, lut, keyed, rows[i0])
+                cached[i0] = sy0
+            i1 = 1 - i0
+            if sy1 == sy0:
+                i1 = i0
+            elif cached[i1] != sy1:
+                _key_row(frame, sy1, xofs, xa0, xa1, key_mode, lut, keyed, rows[i1])
+                cached[i1] = sy1
+
+            sum_h = 0.0
+            sum_s = 0.0
+            sum_v = 0.0
+            count = 0.0
+            for dx in range(out_w):
+                # 縦方向に補間
+                pb = _vresize(rows[i0, dx, 0], rows[i1, dx, 0], b0, b1)
+                pg = _vresize(rows[i0, dx, 1], rows[i1, dx, 1], b0, b1)
+                pr = _vresize(rows[i0, dx, 2], rows[i1, dx, 2], b0, b1)
+                m = _vresize(rows[i0, dx, 3], rows[i1, dx, 3], b0, b1)
+                mask_out[dy, dx] = m
+
+                if to_hsv:
+                    h, s, v = _bgr_to_hsv(pb, pg, pr, sdiv, hdiv)
+                    person_out[dy, dx, 0] = h
+                    person_out[dy, dx, 1] = s
+                    person_out[dy, dx, 2] = v
+                    if m != 0:
+                        sum_h += h
+                        sum_s += s
+                        sum_v += v
+                        count += 1.0
+                else:
+                    person_out[dy, dx, 0] = pb
+                    person_out[dy, dx, 1] = pg
+                    person_out[dy, dx, 2] = pr
+
+            row_sums[dy, 0] = sum_h
+            row_sums[dy, 1] = sum_s
+            row_sums[dy, 2] = sum_v
+            row_sums[dy, 3] = count
+
+
+@njit(parallel=True, cache=True)
+def _adjust_blend(
+    person, mask, canvas, bg, y_offset, x_offset,
+    is_hsv, v_ratio, s_ratio, adjust_s, soft, sector_data,
+):
+    """パス2: 輝度調整（HSV→BGR）+ 背景との合成"""
+    out_h, out_w = mask.shape
+    for dy in prange(out_h):
+        y = y_offset + dy
+        for dx in range(out_w):
+            x = x_offset + dx
+            if is_hsv:
+                h = person[dy, dx, 0]
+                s = np.float32(person[dy, dx, 1])
+                v = np.float32(person[dy, dx, 2]) * v_ratio
+                v = min(max(v, np.float32(0.0)), np.float32(255.0))
+                if adjust_s:
+                    s = min(max(s * s_ratio, np.float32(0.0)), np.float32(255.0))
+                pb, pg, pr = _hsv_to_bgr(h, int(s), int(v), sector_data)
+                pb = int(pb)
+                pg = int(pg)
+                pr = int(pr)
+            else:
+                pb = int(person[dy, dx, 0])
+                pg = int(person[dy, dx, 1])
+                pr = int(person[dy, dx, 2])
+
+            m = int(mask[dy, dx])
+            for c in range(3):
+                p = pb if c == 0 else (pg if c == 1 else pr)
+                back = int(bg[y, x, c])
+                if soft:
+                    # cv2.multiply(scale=1/255) + cv2.add と同じ丸め
+                    fg_part = int(np.rint(p * m * np.float32(1.0 / 255.0)))
+                    bg_part = int(np.rint(back * (255 - m) * np.float32(1.0 / 255.0)))
+                    canvas[y, x, c] = min(255, fg_part + bg_part)
+                else:
+                    # bitwise_and + bitwise_and + add（通常の処理と同じ）
+                    canvas[y, x, c] = min(255, (p & m) + (back & (255 - m)))
+
+
+class FusedCompositor:
+    """
+    1本の動画分の作業領域と補間係数を保持し、フレームごとに合成する
+
+    Args:
+        frame_size: 入力フレームの (width, height)
+        layout: run.compute_layout() の戻り値
+        key_mode: KEY_HSV または KEY_LUT
+        lower_green: HSVキーヤーの下限値
+        upper_green: HSVキーヤーの上限値
+        lut: YCbCrキーヤーのテーブル（KEY_LUT のとき、keyers.ycbcr_table）
+        bg_hsv_mean: 背景の平均HSV値（None なら輝度マッチングなし）
+        soft: マスクを不透明度としてアルファブレンドする
+        chunk_rows: 並列処理の1単位の行数
+    """
+
+    def __init__(
+        self,
+        frame_size,
+        layout,
+        key_mode=KEY_HSV,
+        lower_green=(35, 80, 80),
+        upper_green=(85, 255, 255),
+        lut=None,
+        bg_hsv_mean=None,
+        soft=False,
+        chunk_rows=32,
+    ):
+        width, height = frame_size
+        scaled_width, scaled_height, self.x_offset, self.y_offset = layout
+        self.xofs, self.xa0, self.xa1 = _resize_coeffs(width, scaled_width)
+        self.yofs, self.ya0, self.ya1 = _resize_coeffs(height, scaled_height)
+        self.key_mode = key_mode
+        if key_mode == KEY_HSV:
+            self.lut = hsv_bit_table(tuple(lower_green), tuple(upper_green))
+        else:
+            self.lut = lut
+        self.bg_hsv_mean = bg_hsv_mean
+        self.soft = soft
+
+        self.person = np.empty((scaled_height, scaled_width, 3), dtype=np.uint8)
+        self.mask = np.empty((scaled_height, scaled_width), dtype=np.uint8)
+        self.row_sums = np.empty((scaled_height, 4), dtype=np.float64)
+        self.chunk_rows = chunk_rows
+
+    def composite(self, frame, bg_img, canvas):
+        """
+        frame の人物を canvas（背景画像で初期化済み）の配置領域に合成
+
+        配置領域の外側は書き換えないので、canvas は動画全体で使い回せる。
+
+        Returns:
+            canvas
+        """
+        brightness = self.bg_hsv_mean is not None
+        _key_scale(
+            frame, self.xofs, self.xa0, self.xa1, self.yofs, self.ya0, self.ya1,
+            self.key_mode, self.lut, _SDIV, _HDIV,
+            brightness, self.person, self.mask, self.row_sums, self.chunk_rows,
+        )
+
+        v_ratio = 1.0
+        s_ratio = 1.0
+        adjust_s = False
+        if brightness:
+            # run.adjust_brightness と同じ比率の計算
+            sums = self.row_sums.sum(axis=0)
+            count = sums[3]
+            person_s = sums[1] / count if count else 0.0
+            person_v = sums[2] / count if count else 0.0
+            if person_v > 0:
+                v_ratio = self.bg_hsv_mean[2] / person_v
+            if person_s > 0:
+                s_ratio = 1.0 + (self.bg_hsv_mean[1] / person_s - 1.0) * 0.3
+                adjust_s = True
+
+        _adjust_blend(
+            self.person, self.mask, canvas, bg_img, self.y_offset, self.x_offset,
+            brightness, np.float32(v_ratio), np.float32(s_ratio), adjust_s,
+            self.soft, _SECTOR,
+        )
+        return canvas
+
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+連番画像（イメージシーケンス）の入出力
+
+VFX の素材は 0001.png, 0002.png, ... のような連番画像で届くことが多く、
+仕上げ用にも劣化のない連番PNGで出力したい。
+1枚ずつ読み書きすると画像のデコード・エンコード（PNG の圧縮など）が
+フレーム処理のループを直列に止めるので、
+
+    - 読み込み: スレッドプールで数フレーム先まで並列に読み込む（先読み）
+    - 書き出し: エンコード・保存をスレッドプールに渡してすぐに戻る（非同期・並列）
+
+cv2.imread / cv2.imwrite は GIL を解放するので、スレッドで並列に動く。
+
+SequenceReader / SequenceWriter は cv2.VideoCapture / cv2.VideoWriter と同じ使い方ができる。
+連番画像はフォルダ単位で扱う（1フォルダ = 1シーケンス）。
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# OpenCV の EXR の読み込みは環境変数で有効にする（最初に EXR を読むときに参照される）
+os.environ.setdefault("OPENCV_IO_ENABLE_OPENEXR", "1")
+
+import cv2
+import numpy as np
+
+from media_files import sequence_files
+
+# 連番画像にはフレームレートの情報がないので、指定がなければこの値を使う
+DEFAULT_SEQUENCE_FPS = 24.0
+
+# 先読み・書き出し待ちのフレーム数（スレッド数の何倍まで）
+QUEUE_PER_THREAD = 2
+
+# 出力PNGの圧縮レベル（0-9、劣化はなく、高いほど小さく遅い）
+PNG_COMPRESSION = 1
+
+
+def read_image(path):
+    """
+    画像を 8bit BGR で読み込む
+
+    16bit（PNG / TIFF）は上位8bit、浮動小数点（EXR）はリニアとみなして
+    sRGB のガンマをかけて 8bit にする。
+
+    Returns:
+        BGR画像（uint8）
+    """
+    image = cv2.imread(str(path), cv2.IMREAD_ANYDEPTH | cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"画像が読めません: {path}")
+    if image.dtype == np.uint16:
+        return (image >> 8).astype(np.uint8)
+    if image.dtype != np.uint8:
+        linear = np.clip(image, 0.0, 1.0)
+        srgb = np.where(
+            linear <= 0.0031308,
+            linear * 12.92,
+            1.055 * np.power(linear, 1 / 2.4) - 0.055,
+        )
+        return (srgb * 255 + 0.5).astype(np.uint8)
+    return image
+
+
+class SequenceReader:
+    """
+    連番画像を順に読み込む（スレッドプールで先読み）
+
+    Args:
+        directory: 連番画像のフォルダ
+        fps: フレームレート
+        threads: 読み込みのスレッド数
+    """
+
+    def __init__(self, directory, fps=DEFAULT_SEQUENCE_FPS, threads=4):
+        self.files = sequence_files(directory)
+        self.fps = fps
+        self.threads = max(1, threads)
+        self.executor = ThreadPoolExecutor(self.threads)
+        self.pending = deque()
+        self.next_index = 0
+        self.width = self.height = 0
+
+        if self.files:
+            first = cv2.imread(str(self.files[0]), cv2.IMREAD_UNCHANGED)
+            if first is not None:
+                self.height, self.width = first.shape[:2]
+        self._fill()
+
+    def _fill(self):
+        """スレッド数 × QUEUE_PER_THREAD フレーム先まで読み込みを投入"""
+        while (
+            len(self.pending) < self.threads * QUEUE_PER_THREAD
+            and self.next_index < len(self.files)
+        ):
+            path = self.files[self.next_index]
+            self.pending.append(self.executor.submit(read_image, path))
+            self.next_index += 1
+
+    def isOpened(self):
+        return self.width > 0
+
+    def get(self, prop):
+        """cv2.VideoCapture.get と同じ（幅・高さ・フレームレート・フレーム数・位置のみ）"""
+        values = {
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_FRAME_COUNT: len(self.files),
+            cv2.CAP_PROP_POS_FRAMES: self.next_index - len(self.pending),
+        }
+        return float(values.get(prop, 0))
+
+    def set(self, prop, value):
+        """
+        cv2.VideoCapture.set と同じ（次に読むフレーム番号 CAP_PROP_POS_FRAMES のみ）
+
+        連番画像は1枚ずつ独立しているので、先読みをやり直すだけで正確に移動できる。
+        """
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.next_index = min(max(0, int(value)), len(self.files))
+        self._fill()
+        return True
+
+    def grab(self):
+        """次のフレームを読み飛ばす"""
+        return self.read()[0]
+
+    def read(self, image=None):
+        """
+        次のフレームを読み込む
+
+        Args:
+            image: 読み込み先（指定時はここにコピーする）
+
+        Returns:
+            tuple: (成否, BGR画像) 最後まで読んだら (False, None)
+        """
+        if not self.pending:
+            return False, None
+        frame = self.pending.popleft().result()
+        self._fill()
+        if frame.shape[:2] != (self.height, self.width):
+            raise ValueError("連番画像の途中で解像度が変わっています")
+        if image is None:
+            return True, frame
+        np.copyto(image, frame)
+        return True, image
+
+    def release(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.pending.clear()
+
+
+class SequenceWriter:
+    """
+    フレームを連番PNG（000000.png, 000001.png, ...）として書き出す
+
+    write() はフレームをコピーしてスレッドプールに渡し、すぐに戻る
+    （書き出し待ちがスレッド数 × QUEUE_PER_THREAD を超えたら古いものを待つ）。
+    FFmpegWriter と同じく release() で成否を返し、エラー内容は self.error（bytes）。
+
+    Args:
+        directory: 出力先フォルダ（なければ作成）
+        threads: エンコード・保存のスレッド数
+    """
+
+    def __init__(self, directory, threads=4):
+        self.directory = directory
+        self.threads = max(1, threads)
+        self.executor = ThreadPoolExecutor(self.threads)
+        self.pending = deque()
+        self.index = 0
+        self.error = b""
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            self.opened = True
+        except OSError as e:
+            self.error = str(e).encode()
+            self.opened = False
+
+    def isOpened(self):
+        return self.opened
+
+    @staticmethod
+    def _save(path, frame):
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+        if not cv2.imwrite(str(path), frame, params):
+            raise OSError(f"画像を保存できません: {path}")
+
+    def write(self, frame):
+        path = self.directory / f"{self.index:06d}.png"
+        self.pending.append(self.executor.submit(self._save, path, frame.copy()))
+        self.index += 1
+        while len(self.pending) > self.threads * QUEUE_PER_THREAD:
+            self.pending.popleft().result()
+
+    def release(self):
+        """
+        書き出しの終了を待つ
+
+        Returns:
+            bool: 全て保存できたらTrue
+        """
+        try:
+            while self.pending:
+                self.pending.popleft().result()
+            return True
+        except Exception as e:
+            self.error = str(e).encode()
+            return False
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def open_video(path, fps=DEFAULT_SEQUENCE_FPS, threads=None):
+    """
+    動画ファイルまたは連番画像のフォルダを開く
+
+    Args:
+        path: 動画パスまたは連番画像のフォルダ
+        fps: 連番画像のフレームレート（動画ファイルでは使わない）
+        threads: 連番画像の読み込みのスレッド数・動画のデコーダのスレッド数
+                 （None なら連番画像は4、動画は OpenCV の既定値）
+
+    Returns:
+        SequenceReader または cv2.VideoCapture
+    """
+    path = Path(path)
+    if path.is_dir():
+        return SequenceReader(path, fps, threads or 4)
+    if threads is None:
+        return cv2.VideoCapture(str(path))
+    return cv2.VideoCapture(
+        str(path), cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, threads]
+    )
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+グリーンバックのマスク生成（キーヤー）
+
+run.py / remove_greenback_cv.py から使う緑色検出処理をまとめたモジュール。
+返すマスクはいずれも cv2.inRange と同じ形式（緑=255、人物=0 の uint8）。
+YCbCrキーヤーは境界で中間値（半透明）を返す。
+
+キーヤー一覧:
+    hsv    HSV色空間の範囲判定（cv2.inRange、二値）
+    ycbcr  YCbCr色差平面での距離判定（ffmpeg chromakey 相当、半透明あり）
+"""
+
+from functools import lru_cache, partial
+
+import cv2
+import numpy as np
+
+KEYERS = ("hsv", "ycbcr")
+
+
+def hsv_mask(frame, lower_green, upper_green):
+    """
+    HSV色空間で緑色を検出（全解像度）
+
+    Args:
+        frame: 入力フレーム（BGR）
+        lower_green: 緑色検出の下限値 (H, S, V)
+        upper_green: 緑色検出の上限値 (H, S, V)
+
+    Returns:
+        緑色部分が255のマスク
+    """
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    return cv2.inRange(hsv, np.asarray(lower_green), np.asarray(upper_green))
+
+
+@lru_cache(maxsize=16)
+def ycbcr_table(similarity, blend, key_color=(0, 255, 0)):
+    """
+    Cr + Cb * 256 → マスク値 のテーブル（65536要素）を作成
+
+    ffmpeg chromakey と同じく、キー色との色差距離を 255*sqrt(2) で
+    正規化した値 diff から不透明度を決める。
+        blend > 0 : alpha = clip((diff - similarity) / blend, 0, 1)
+        blend = 0 : alpha = diff > similarity
+    """
+    key = cv2.cvtColor(np.uint8([[key_color]]), cv2.COLOR_BGR2YCrCb)[0, 0]
+
+    # 色差の二乗距離（整数）
+    cb = np.arange(256, dtype=np.int32)[:, np.newaxis] - int(key[2])
+    cr = np.arange(256, dtype=np.int32)[np.newaxis, :] - int(key[1])
+    dist2 = cr * cr + cb * cb
+    scale2 = 2 * 255 * 255
+
+    if blend > 0.0001:
+        diff = np.sqrt(dist2 / scale2)
+        alpha = np.clip((diff - similarity) / blend, 0.0, 1.0)
+        alpha = np.rint(alpha * 255).astype(np.uint8)
+    else:
+        alpha = np.where(dist2 > similarity * similarity * scale2, 255, 0).astype(np.uint8)
+
+    # 緑=255 の形式に揃える
+    return (255 - alpha).ravel()
+
+
+def ycbcr_mask(frame, similarity=0.3, blend=0.1, key_color=(0, 255, 0)):
+    """
+    YCbCr色差平面でキー色との距離から緑色を検出
+
+    remove_greenback.py の ffmpeg chromakey と同じ similarity / blend で
+    調整できる。画素ごとの処理は整数のみ（色変換・ビット演算・テーブル参照）。
+
+    Args:
+        frame: 入力フレーム（BGR）
+        similarity: 緑色の類似度（0.0-1.0、高いほど広範囲の緑を透過）
+        blend: エッジのブレンド量（0.0-1.0、高いほど滑らか）
+        key_color: キー色（BGR、デフォルトは純緑）
+
+    Returns:
+        緑色部分が255、人物が0、境界が中間値のマスク
+    """
+    lut = ycbcr_table(float(similarity), float(blend), tuple(key_color))
+    ycrcb = cv2.cvtColor(frame, cv2.COLOR_BGR2YCrCb)
+
+    # (Cr, Cb) の2バイトをそのまま16bit整数として読み、テーブルの添字にする
+    # （リトルエンディアンなので 値 = Cr + Cb * 256）
+    index = np.ndarray(
+        ycrcb.shape[:-1],
+        dtype="<u2",
+        buffer=ycrcb,
+        offset=1,
+        strides=ycrcb.strides[:-1],
+    )
+    return np.take(lut, index)
+
+
+def multires_mask(frame, key, downscale=4, band=1):
+    """
+    低解像度でマスクを推定し、境界付近だけ全解像度で再判定する
+
+    フレームの大部分は明らかに背景か人物なので、1/downscale に縮小した画像で
+    判定してから拡大する。縮小画像上で境界から band ピクセル以内の領域だけ、
+    元のフレームの画素を使って判定し直す。
+
+    Args:
+        frame: 入力フレーム（BGR）
+        key: 全解像度のキーヤー関数 key(frame) -> マスク
+        downscale: 縮小率（4なら1/4、8なら1/8）
+        band: 再判定する境界の幅（縮小画像上のピクセル数）
+
+    Returns:
+        緑色部分が255のマスク
+    """
+    if downscale <= 1:
+        return key(frame)
+
+    height, width = frame.shape[:2]
+    d = downscale
+    bh, bw = height // d, width // d
+    if bh == 0 or bw == 0:
+        return key(frame)
+
+    # 1. 縮小画像でマスクを推定（d x d ブロックごとに1画素）
+    small = cv2.resize(
+        frame[: bh * d, : bw * d], (bw, bh), interpolation=cv2.INTER_LINEAR
+    )
+    small_mask = key(small)
+
+    # 2. 縮小画像上で境界の帯を求める（膨張 - 収縮）
+    kernel = np.ones((2 * band + 1, 2 * band + 1), dtype=np.uint8)
+    small_band = cv2.subtract(
+        cv2.dilate(small_mask, kernel), cv2.erode(small_mask, kernel)
+    )
+
+    # 3. 全解像度に拡大
+    mask = np.empty((height, width), dtype=np.uint8)
+    mask[: bh * d, : bw * d] = cv2.resize(
+        small_mask, (bw * d, bh * d), interpolation=cv2.INTER_NEAREST
+    )
+
+    # 4. 境界の帯に含まれるブロックだけ元の画素で再判定
+    ys, xs = np.nonzero(small_band)
+    if len(ys) > 0:
+        frame_blocks = frame[: bh * d, : bw * d].reshape(bh, d, bw, d, 3)
+        mask_blocks = mask[: bh * d, : bw * d].reshape(bh, d, bw, d)
+        pixels = np.ascontiguousarray(frame_blocks[ys, :, xs, :])
+        keyed = key(pixels.reshape(-1, d, 3))
+        mask_blocks[ys, :, xs, :] = keyed.reshape(-1, d, d)
+
+    # 5. 割り切れない右端・下端は全解像度で判定
+    if bh * d < height:
+        mask[bh * d :] = key(frame[bh * d :])
+    if bw * d < width:
+        mask[:, bw * d :] = key(np.ascontiguousarray(frame[:, bw * d :]))
+
+    return mask
+
+
+def make_keyer(
+    name="hsv",
+    lower_green=(35, 80, 80),
+    upper_green=(85, 255, 255),
+    similarity=0.3,
+    blend=0.1,
+    downscale=1,
+):
+    """
+    キーヤー関数を作成
+
+    Args:
+        name: キーヤー名（"hsv" または "ycbcr"）
+        lower_green: HSVキーヤーの下限値 (H, S, V)
+        upper_green: HSVキーヤーの上限値 (H, S, V)
+        similarity: YCbCrキーヤーの類似度
+        blend: YCbCrキーヤーのブレンド量
+        downscale: 低解像度推定の縮小率（1=全解像度）
+
+    Returns:
+        key(frame) -> マスク（緑=255）を返す関数
+    """
+    if name == "hsv":
+        key = partial(
+            hsv_mask,
+            lower_green=np.asarray(lower_green),
+            upper_green=np.asarray(upper_green),
+        )
+    elif name == "ycbcr":
+        key = partial(ycbcr_mask, similarity=similarity, blend=blend)
+    else:
+        raise ValueError(f"未対応のキーヤーです: {name}（{', '.join(KEYERS)}）")
+
+    if downscale > 1:
+        return partial(multires_mask, key=key, downscale=downscale)
+    return key
+
+
+def is_soft_keyer(name, blend=0.1):
+    """キーヤーが半透明（中間値）のマスクを返すならTrue"""
+    return name == "ycbcr" and blend > 0.0001
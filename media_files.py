@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+bg/・green/ の素材ファイルの検出と、素材・出力のあるフォルダ（--base-dir）の指定
+
+cv2 / numpy を読み込まないので、fujitsu コマンドの list のように
+素材の一覧だけが必要な処理からも、起動を遅くせずに使える。
+"""
+
+import re
+from pathlib import Path
+
+# 背景画像・背景動画
+BACKGROUND_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+VIDEO_BACKGROUND_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv")
+
+# グリーンバック動画
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv")
+
+# 連番画像
+IMAGE_SEQUENCE_EXTENSIONS = (".png", ".exr", ".tif", ".tiff", ".jpg", ".jpeg")
+
+# 連番: 末尾の数字（例: plate.0001.png → "plate.", "0001"）
+_FRAME_NUMBER = re.compile(r"^(.*?)(\d+)$")
+
+
+def _glob_extensions(directory, extensions):
+    """拡張子が小文字・大文字のファイルを取得（例: *.mp4 と *.MP4）"""
+    files = []
+    for ext in extensions:
+        files.extend(directory.glob(f"*{ext}"))
+        files.extend(directory.glob(f"*{ext.upper()}"))
+    return files
+
+
+def sequence_files(directory):
+    """
+    フォルダ内の連番画像をフレーム番号の順に取得
+
+    拡張子が混在する場合は最も多い拡張子の画像だけを使う。
+
+    Returns:
+        list: 画像パスのリスト（連番画像がなければ空）
+    """
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+
+    numbered = {}
+    for path in directory.iterdir():
+        ext = path.suffix.lower()
+        match = _FRAME_NUMBER.match(path.stem)
+        if path.is_file() and ext in IMAGE_SEQUENCE_EXTENSIONS and match:
+            numbered.setdefault(ext, []).append((int(match.group(2)), path))
+    if not numbered:
+        return []
+
+    frames = max(numbered.values(), key=len)
+    return [path for _, path in sorted(frames)]
+
+
+def is_image_sequence(path):
+    """連番画像のフォルダならTrue"""
+    return len(sequence_files(path)) > 0
+
+
+def is_video_background(path):
+    """背景ファイルが動画ならTrue"""
+    return path.suffix.lower() in VIDEO_BACKGROUND_EXTENSIONS
+
+
+def get_background_images(bg_dir):
+    """
+    bg/フォルダから背景画像・背景動画を取得
+
+    Returns:
+        list: 背景画像・背景動画のパスリスト
+    """
+    extensions = BACKGROUND_IMAGE_EXTENSIONS + VIDEO_BACKGROUND_EXTENSIONS
+    return sorted(_glob_extensions(bg_dir, extensions))
+
+
+def get_video_files(green_dir):
+    """
+    green/フォルダから動画ファイルと連番画像のフォルダを取得
+
+    連番画像は green/ の中のフォルダごとに1本の動画として扱う（例: green/plateA/0001.png）。
+
+    Returns:
+        list: 動画ファイル・連番画像のフォルダのパスリスト
+    """
+    video_files = _glob_extensions(green_dir, VIDEO_EXTENSIONS)
+
+    # 連番画像のフォルダ
+    for path in green_dir.iterdir():
+        if path.is_dir() and is_image_sequence(path):
+            video_files.append(path)
+
+    return sorted(video_files)
+
+
+def add_base_dir_argument(parser, default):
+    """
+    素材・出力のあるフォルダを指定する --base-dir を追加
+
+    スクリプトを直接実行した場合はスクリプトのあるフォルダ（default）、
+    fujitsu コマンドからはカレントディレクトリを使う（cli.run_script が指定する）。
+
+    Args:
+        parser: argparse.ArgumentParser
+        default: 指定しなかった場合のフォルダ
+    """
+    parser.add_argument(
+        "--base-dir",
+        type=Path,
+        default=default,
+        help="素材・出力のあるフォルダ（デフォルト: スクリプトのあるフォルダ、"
+        "fujitsu コマンドではカレントディレクトリ）",
+    )
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+メモリ使用量の上限（--max-memory）に合わせた並列数・バッファ数の決定と、ピークRSSの計測
+
+change_background はフレームを1枚ずつ読み書きするので、使用メモリは動画の長さではなく
+解像度で決まる。1本あたりの使用量を解像度から見積もり、上限に収まるように
+同時に処理する動画数（ワーカー数）・動画背景の先読みフレーム数・
+背景キャッシュの数を減らす。
+
+    1本あたり ≒ BASE_BYTES + (WORKING_FRAMES + 先読み + キャッシュ) × 1フレームのバイト数
+              + 共有メモリのフレームリング + 合成プロセス × (BASE_BYTES + CHILD_WORKING_FRAMES)
+              + 解像度違いの版・サムネイルのバッファ
+              + 融合処理（--backend fused）なら合成するプロセスごとに FUSED_BYTES
+
+WORKING_FRAMES・CHILD_WORKING_FRAMES は 1080p / 4K で計測したピークRSSから決めた値
+（デコード・色変換・マスク・リサイズ・合成・エンコードの作業用配列の合計）。
+"""
+
+import sys
+from typing import NamedTuple
+
+from shared_frames import SLOTS_PER_PROCESS
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+# OpenCV / NumPy を読み込んだ直後のプロセスのRSS
+BASE_BYTES = 130 * 1024**2
+
+# 合成中に同時に存在する、フレームと同じ大きさ（BGR）の配列の数
+WORKING_FRAMES = 20
+
+# --frame-processes の子プロセス1つの作業用配列の数（触れた共有メモリのスロットを含む）
+CHILD_WORKING_FRAMES = 10
+
+# 解像度違いの版・サムネイルに渡すフレームのバッファ（renditions.BUFFER_FRAMES）と、
+# 解像度違いの版1つあたりの縮小・エンコード用の配列の数（その版の大きさ）
+RENDITION_BUFFER_FRAMES = 4
+RENDITION_WORKING_FRAMES = 2
+
+# 融合処理（--backend fused）で合成するプロセスが余分に使うメモリ
+# （Numba の実行環境・コンパイル済みのカーネルと、緑判定のテーブル 2MB。解像度によらない）
+FUSED_BYTES = 96 * 1024**2
+
+# 既定値（上限がなければこのまま使う）
+DEFAULT_BUFFER_FRAMES = 8
+DEFAULT_CACHE_ENTRIES = 8
+
+# 上限が厳しいときの最小値
+MIN_BUFFER_FRAMES = 2
+MIN_CACHE_ENTRIES = 1
+
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_memory_size(text):
+    """
+    "2G"、"512M"、"1.5GB" のような文字列をバイト数に変換
+
+    Returns:
+        int: バイト数
+    """
+    text = text.strip().upper().removesuffix("B").removesuffix("I")
+    unit = text[-1] if text and text[-1] in _UNITS else ""
+    value = float(text[: len(text) - len(unit)])
+    if value <= 0:
+        raise ValueError(f"メモリ上限は正の値で指定してください: {text}")
+    return int(value * _UNITS[unit])
+
+
+def format_size(size):
+    """バイト数を表示用の文字列に変換（例: "1.2GB"）"""
+    if size >= 1024**3:
+        return f"{size / 1024**3:.1f}GB"
+    return f"{size / 1024**2:.0f}MB"
+
+
+def frame_bytes(width, height):
+    """BGR 1フレームのバイト数"""
+    return width * height * 3
+
+
+def estimate_job_bytes(
+    width,
+    height,
+    buffer_frames=DEFAULT_BUFFER_FRAMES,
+    cache_entries=DEFAULT_CACHE_ENTRIES,
+    frame_processes=1,
+    renditions=(),
+    thumbnails=False,
+    fused=False,
+):
+    """
+    動画1本を処理するプロセス（--frame-processes の子プロセスを含む）の使用メモリの見積もり
+
+    Args:
+        width: 動画の幅
+        height: 動画の高さ
+        buffer_frames: 動画背景の先読みフレーム数
+        cache_entries: 背景キャッシュの数（最大でこの数の背景画像を保持）
+        frame_processes: 1本の動画を合成するプロセス数（--frame-processes）
+        renditions: 解像度違いの版の高さのリスト（--renditions）
+        thumbnails: サムネイルも保存する（--thumbnail-interval）
+        fused: 融合処理（--backend fused）で合成する
+
+    Returns:
+        int: バイト数
+    """
+    frames = WORKING_FRAMES + buffer_frames + cache_entries
+    compositor = FUSED_BYTES if fused else 0
+    children = 0
+    if frame_processes > 1:
+        # 入力・出力のスロット（shared_frames.composite_shared）と背景、合成プロセス
+        # （合成器を作るのは子プロセスだけ）
+        frames += 2 * (frame_processes * SLOTS_PER_PROCESS + 2) + 1
+        children = frame_processes * (
+            BASE_BYTES + compositor + CHILD_WORKING_FRAMES * frame_bytes(width, height)
+        )
+        compositor = 0
+    ladder = 0
+    smaller = [target for target in renditions if target < height]
+    if smaller or thumbnails:
+        frames += RENDITION_BUFFER_FRAMES
+        for target in smaller:
+            ladder += RENDITION_WORKING_FRAMES * frame_bytes(
+                round(width * target / height), target
+            )
+    return (
+        BASE_BYTES
+        + compositor
+        + frames * frame_bytes(width, height)
+        + children
+        + ladder
+    )
+
+
+class MemoryPlan(NamedTuple):
+    """
+    メモリ上限に合わせた設定
+
+    Attributes:
+        max_bytes: メモリ上限（None なら上限なし）
+        workers: 同時に処理する動画数
+        buffer_frames: 動画背景の先読みフレーム数
+        cache_entries: 背景キャッシュの数
+        job_bytes: 1本あたりの使用メモリの見積もり
+    """
+
+    max_bytes: object
+    workers: int
+    buffer_frames: int
+    cache_entries: int
+    job_bytes: int
+
+
+def plan_memory(
+    max_bytes,
+    width,
+    height,
+    workers=1,
+    frame_processes=1,
+    renditions=(),
+    thumbnails=False,
+    fused=False,
+):
+    """
+    メモリ上限に収まる並列数・バッファ数を決める
+
+    先に先読み・キャッシュを最小まで減らし、それでも収まらなければワーカー数を減らす
+    （並列数を保つ方が処理時間への影響が小さいため）。
+
+    Args:
+        max_bytes: メモリ上限（バイト、None なら上限なし）
+        width: 処理する動画のうち最大の幅
+        height: 処理する動画のうち最大の高さ
+        workers: 希望するワーカー数
+        frame_processes: 1本の動画を合成するプロセス数（--frame-processes）
+        renditions: 解像度違いの版の高さのリスト（--renditions）
+        thumbnails: サムネイルも保存する（--thumbnail-interval）
+        fused: 融合処理（--backend fused）で合成する
+
+    Returns:
+        MemoryPlan: 1ワーカーでも上限を超える場合も workers=1 の設定を返す
+                    （job_bytes > max_bytes で判定できる）
+    """
+    buffer_frames = DEFAULT_BUFFER_FRAMES
+    cache_entries = DEFAULT_CACHE_ENTRIES
+
+    def job_bytes():
+        return estimate_job_bytes(
+            width,
+            height,
+            buffer_frames,
+            cache_entries,
+            frame_processes,
+            renditions,
+            thumbnails,
+            fused,
+        )
+
+    if max_bytes is None:
+        return MemoryPlan(None, workers, buffer_frames, cache_entries, job_bytes())
+
+    # 親プロセス（動画を振り分けるだけ）の分も含める
+    def total_bytes(count):
+        parent = BASE_BYTES if count > 1 else 0
+        return parent + count * job_bytes()
+
+    while total_bytes(workers) > max_bytes and buffer_frames > MIN_BUFFER_FRAMES:
+        buffer_frames = max(MIN_BUFFER_FRAMES, buffer_frames // 2)
+    while total_bytes(workers) > max_bytes and cache_entries > MIN_CACHE_ENTRIES:
+        cache_entries = max(MIN_CACHE_ENTRIES, cache_entries // 2)
+    while workers > 1 and total_bytes(workers) > max_bytes:
+        workers -= 1
+
+    return MemoryPlan(max_bytes, workers, buffer_frames, cache_entries, job_bytes())
+
+
+def reset_peak_rss():
+    """
+    このプロセスのピークRSSを現在のRSSに戻す（Linux のみ）
+
+    プロセスプールのワーカーは複数の動画を処理するので、動画ごとのピークを
+    測るために処理の前に呼ぶ。
+
+    Returns:
+        bool: リセットできたらTrue（できなければ peak_rss() はプロセス開始からのピーク）
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss(pid="self"):
+    """
+    プロセスのピークRSS（バイト）
+
+    Args:
+        pid: プロセスID（デフォルト: このプロセス）
+
+    Returns:
+        int: バイト数、取得できなければ None
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # /proc がない環境（macOS）: プロセス開始からのピーク（このプロセスのみ）
+    if resource is None or pid != "self":
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
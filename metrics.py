@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+処理状況のメトリクス（Prometheus のテキスト形式）
+
+スケジューラの下で run.py / remove_greenback.py を動かすと、進捗は print の出力しか見えない。
+処理したフレーム数・段ごとの処理時間・fps・キューの長さ・失敗数・出力バイト数を
+カウンタ・ゲージ・ヒストグラムとして集計し、次のどちらか（または両方）で公開する。
+
+    --metrics-port PORT  ローカルの HTTP（127.0.0.1:PORT/metrics）で公開
+    --metrics-file PATH  node_exporter の textfile collector 用のファイル（.prom）を
+                         一定間隔で書き換える（書き込み途中を読まれないよう置き換えで更新）
+
+集計は親プロセスの Registry で行う。プロセスプールのワーカーでは connect() で
+送り先のキューを設定し、値の増分を約1秒ごとにまとめて親に送る。
+どちらも設定しなければ inc() / observe() などは何もしない。
+"""
+
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from pathlib import Path
+
+# ワーカーから親に増分を送る間隔（秒）
+FLUSH_INTERVAL = 1.0
+
+# textfile collector 用のファイルを書き換える間隔（秒）
+WRITE_INTERVAL = 5.0
+
+# 1フレームの処理時間のヒストグラムの区切り（秒）
+FRAME_BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+
+# 1本の処理時間のヒストグラムの区切り（秒）
+VIDEO_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# 名前 → (種類, 説明, ヒストグラムの区切り)
+METRICS = {
+    "greenback_frames_total": ("counter", "処理したフレーム数", None),
+    "greenback_stage_seconds_total": ("counter", "段ごとの処理時間の合計（秒）", None),
+    "greenback_frame_seconds": ("histogram", "1フレームの処理時間（秒）", FRAME_BUCKETS),
+    "greenback_video_seconds": ("histogram", "動画1本の処理時間（秒）", VIDEO_BUCKETS),
+    "greenback_videos_total": ("counter", "処理した動画数（結果別）", None),
+    "greenback_failures_total": ("counter", "失敗した動画数（段階別）", None),
+    "greenback_output_bytes_total": ("counter", "出力したバイト数", None),
+    "greenback_queue_depth": ("gauge", "キューの長さ", None),
+    "greenback_fps": ("gauge", "全体の処理速度（直近の間隔のフレーム/秒）", None),
+}
+
+# 現在の送り先（Registry、ワーカーでは _QueueSink、無効なら None）
+_sink = None
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+def _format_value(value):
+    """値の文字列（float は桁を落とさないよう repr、無限大・NaN は Prometheus の表記）"""
+    if not isinstance(value, float):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(value)
+
+
+class Registry:
+    """メトリクスの値を保持し、Prometheus のテキスト形式で出力する"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {name: {} for name in METRICS}
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series = self.values[name]
+            key = _key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.values[name][_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        with self.lock:
+            series = self.values[name]
+            key = _key(labels)
+            if key not in series:
+                series[key] = [[0] * len(buckets), 0.0, 0]
+            counts, _, _ = state = series[key]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def apply(self, batch):
+        """ワーカーから送られた増分（_QueueSink.flush の内容）を反映"""
+        counters, gauges, observations = batch
+        for (name, key), value in counters.items():
+            self.inc(name, value, **dict(key))
+        for (name, key), value in gauges.items():
+            self.set_gauge(name, value, **dict(key))
+        for name, key, value in observations:
+            self.observe(name, value, **dict(key))
+
+    def total(self, name):
+        """全ラベルの合計（カウンタ）"""
+        with self.lock:
+            return sum(self.values[name].values())
+
+    def render(self):
+        """Prometheus のテキスト形式"""
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, buckets) in METRICS.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(self.values[name].items()):
+                    if kind != "histogram":
+                        labels = _format_labels(key)
+                        lines.append(f"{name}{labels} {_format_value(value)}")
+                        continue
+                    counts, total, count = value
+                    for bound, bucket_count in zip(buckets, counts):
+                        labels = _format_labels(key, [("le", _format_value(bound))])
+                        lines.append(f"{name}_bucket{labels} {bucket_count}")
+                    labels = _format_labels(key, [("le", "+Inf")])
+                    lines.append(f"{name}_bucket{labels} {count}")
+                    total = _format_value(float(total))
+                    lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class _QueueSink:
+    """ワーカー側: 増分をためて一定間隔で親プロセスのキューに送る"""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.counters = {}
+        self.gauges = {}
+        self.observations = []
+        self.last_flush = time.monotonic()
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            key = (name, _key(labels))
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _key(labels))] = value
+        self._maybe_flush()
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            self.observations.append((name, _key(labels), value))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            batch = (self.counters, self.gauges, self.observations)
+            self._reset()
+        if any(batch):
+            self.queue.put(batch)
+
+
+def inc(name, value=1, **labels):
+    """カウンタを増やす（メトリクスが無効なら何もしない）"""
+    if _sink is not None:
+        _sink.inc(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    """ゲージを設定（メトリクスが無効なら何もしない）"""
+    if _sink is not None:
+        _sink.set_gauge(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """ヒストグラムに値を追加（メトリクスが無効なら何もしない）"""
+    if _sink is not None:
+        _sink.observe(name, value, **labels)
+
+
+def flush():
+    """ワーカーでためている増分を親に送る（動画1本の処理の終わりに呼ぶ）"""
+    if isinstance(_sink, _QueueSink):
+        _sink.flush()
+
+
+def connect(metrics_queue):
+    """
+    プロセスプールのワーカーで、増分の送り先を親プロセスのキューにする
+
+    Args:
+        metrics_queue: Exporter.queue（None ならメトリクスは無効のまま）
+    """
+    global _sink
+    if metrics_queue is not None:
+        _sink = _QueueSink(metrics_queue)
+
+
+def path_bytes(path):
+    """ファイルのサイズ、フォルダなら中のファイルの合計（なければ0）"""
+    path = Path(path)
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+class StageTimer:
+    """
+    フレーム処理のループの段ごとの時間とフレーム数を集計する
+
+    段が終わるごとに lap(段の名前) を呼ぶと、前回の lap() からの時間をその段の時間にする。
+    1フレーム終わるごとに frame() を呼ぶ。値は FLUSH_INTERVAL ごと（と flush() の
+    呼び出し時）にまとめてメトリクスに反映し、watch() で登録したキューの長さもそのときに読む。
+    メトリクスが無効なら何もしない。
+    """
+
+    def __init__(self):
+        self.enabled = _sink is not None
+        self.seconds = {}
+        self.frames = 0
+        self.queues = {}
+        self.last_lap = self.last_frame = self.last_flush = time.perf_counter()
+
+    def lap(self, name):
+        """前回の lap() からの時間を段 name の時間として加算"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.seconds[name] = self.seconds.get(name, 0.0) + now - self.last_lap
+        self.last_lap = now
+
+    def watch(self, name, depth):
+        """キューの長さ depth() を greenback_queue_depth{queue=name} として反映"""
+        self.queues[name] = depth
+
+    def frame(self):
+        """1フレームの処理が終わった"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        observe("greenback_frame_seconds", now - self.last_frame)
+        self.last_frame = now
+        self.frames += 1
+        if now - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if not self.enabled:
+            return
+        if self.frames:
+            inc("greenback_frames_total", self.frames)
+        for name, seconds in self.seconds.items():
+            inc("greenback_stage_seconds_total", seconds, stage=name)
+        for name, depth in self.queues.items():
+            set_gauge("greenback_queue_depth", depth(), queue=name)
+        self.frames = 0
+        self.seconds = {}
+        self.last_flush = time.perf_counter()
+
+
+class Exporter:
+    """
+    親プロセスでメトリクスを集計して公開する
+
+    Args:
+        port: HTTP で公開するポート（None なら公開しない）
+        path: textfile collector 用のファイル（None なら書かない）
+        interval: ファイルを書き換える間隔（秒）
+    """
+
+    def __init__(self, port=None, path=None, interval=WRITE_INTERVAL):
+        global _sink
+        self.registry = Registry()
+        self.path = Path(path) if path else None
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.fps_state = (0, time.monotonic())
+        self.fps_lock = threading.Lock()
+        _sink = self.registry
+
+        # ワーカーからの増分を受け取るキュー（spawn のプロセスプールに initargs で渡す）
+        self.queue = get_context("spawn").Queue()
+        self.threads = [threading.Thread(target=self._receive, daemon=True)]
+
+        self.server = None
+        if port is not None:
+            exporter = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = exporter.render().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass  # アクセスログで進捗表示を乱さない
+
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+            self.threads.append(
+                threading.Thread(target=self.server.serve_forever, daemon=True)
+            )
+        if self.path is not None:
+            self.threads.append(threading.Thread(target=self._write_loop, daemon=True))
+
+        for thread in self.threads:
+            thread.start()
+
+    def _receive(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            self.registry.apply(batch)
+
+    def _update_fps(self):
+        """前回の更新からのフレーム数の増分で fps を更新"""
+        with self.fps_lock:
+            frames = self.registry.total("greenback_frames_total")
+            now = time.monotonic()
+            previous_frames, previous_time = self.fps_state
+            if now - previous_time >= FLUSH_INTERVAL:
+                fps = (frames - previous_frames) / (now - previous_time)
+                self.registry.set_gauge("greenback_fps", round(fps, 3))
+                self.fps_state = (frames, now)
+
+    def render(self):
+        self._update_fps()
+        return self.registry.render()
+
+    def write(self):
+        """textfile collector 用のファイルを書き換える（置き換えで更新）"""
+        temp = self.path.with_name(self.path.name + ".tmp")
+        temp.write_text(self.render(), encoding="utf-8")
+        os.replace(temp, self.path)
+
+    def _write_loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"  ! メトリクスのファイルを書き込めません: {e}")
+
+    def close(self):
+        """残りの増分を反映し、ファイルを最後に1回書いて終了"""
+        global _sink
+        self.queue.put(None)
+        self.threads[0].join()
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.path is not None:
+            self.write()
+        _sink = None
+
+
+def start(port=None, path=None, interval=WRITE_INTERVAL):
+    """
+    メトリクスの集計・公開を始める
+
+    Returns:
+        Exporter（port も path も指定されなければ None）
+    """
+    if port is None and path is None:
+        return None
+    return Exporter(port, path, interval)
+
+
+def add_metrics_arguments(parser):
+    """メトリクスの共通引数を argparse に追加"""
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="メトリクスを http://127.0.0.1:PORT/metrics で公開（Prometheus形式）",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="メトリクスを書き出すファイル（node_exporter の textfile collector 用 .prom）",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=WRITE_INTERVAL,
+        help=f"--metrics-file を書き換える間隔（秒、デフォルト: {WRITE_INTERVAL:g}）",
+    )
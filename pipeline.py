@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+"""
+段（ステージ）を組み合わせたフレーム処理のパイプライン
+
+run.change_background と remove_greenback_cv.change_background はどちらも
+「デコード → 緑色検出 → 人物の抽出・スケール → 輝度調整 → 合成 → 書き出し」を
+フレームごとに繰り返す。ここではその各段を同じ形の部品にし、
+ループ（背景の切り替え・静止フレームの再利用・段ごとの時間の集計）を1つにまとめる。
+
+    入力      FrameSource           デコード（範囲指定の終了位置で止める）
+    背景      StaticBackground      背景画像（video_background.VideoBackground も同じ形）
+    key       KeyStage              緑色検出 → 人物部分が255のマスク
+    transform ScaleStage            人物を抽出して配置の大きさにスケール
+              TrackStage            人物の矩形の範囲だけ抽出・スケール
+    brightness BrightnessStage      人物の輝度を背景に合わせる
+    composite BlendStage            人物を合成先（canvas）に重ねる
+    （融合）  MaskCopyStage         等倍・2値マスクの transform〜composite
+              CompositorStage       key〜composite（fused / strips の合成器）
+    出力      write() を持つもの    cv2.VideoWriter・FFmpegWriter・RenditionLadder など
+
+    - 段は process(data) で FrameData の値を読み書きする。名前（name）ごとに
+      受け渡す値が決まっているので、同じ名前の段は差し替えられる
+    - 隣り合う段は融合の規則（段の名前の並び → 1つの段を作る関数）で1つにまとめられる
+    - 合成先は動画全体で使い回し、前のフレームで合成した領域（dirty）のうち
+      今回書き換えない部分だけを背景に戻す
+    - 段ごとの時間は Pipeline.seconds に集計し、metrics.StageTimer にも同じ名前で渡す
+    - run_shared() は shared_frames.composite_shared で複数のプロセスに合成を分ける
+      （子プロセスでも同じ段を組み立てる）
+"""
+
+import math
+import time
+from functools import partial
+
+import cv2
+import numpy as np
+
+import metrics
+from shared_frames import composite_shared
+from strips import apply_brightness, blend_person, brightness_ratios
+
+
+def adjust_brightness(person_img, person_mask, bg_img, bg_mask, bg_hsv_mean=None):
+    """
+    人物の輝度を背景に合わせて調整
+
+    Args:
+        person_img: 人物画像（BGR）
+        person_mask: 人物のマスク
+        bg_img: 背景画像（BGR）
+        bg_mask: 背景のマスク
+        bg_hsv_mean: 計算済みの背景の平均HSV値（指定時は bg_img/bg_mask を使わない）
+
+    Returns:
+        調整後の人物画像
+    """
+    # BGR → HSV変換
+    person_hsv = cv2.cvtColor(person_img, cv2.COLOR_BGR2HSV).astype(np.float32)
+
+    # HSVで平均を計算
+    person_hsv_mean = cv2.mean(person_hsv, mask=person_mask)
+    if bg_hsv_mean is None:
+        bg_hsv = cv2.cvtColor(bg_img, cv2.COLOR_BGR2HSV).astype(np.float32)
+        bg_hsv_mean = cv2.mean(bg_hsv, mask=bg_mask)
+
+    # V（明度）・S（彩度）を背景の平均に近づける
+    ratios = brightness_ratios(person_hsv_mean, bg_hsv_mean)
+    return apply_brightness(person_hsv, ratios)
+
+
+def _align_span(start, end, size, scaled_size, max_step=64):
+    """
+    元画像の範囲 [start, end) をスケール後の範囲に変換
+
+    全体をリサイズしてから切り出した結果と画素単位で一致するよう、
+    拡大縮小の比率の整数倍の位置に範囲を広げる。
+    単純な整数比でない場合（例: 720→503）はこの軸を切り出さない。
+
+    Returns:
+        tuple: (元画像の開始, 終了, スケール後の開始, 終了)
+    """
+    g = math.gcd(size, scaled_size)
+    step_src, step_dst = size // g, scaled_size // g
+    if step_dst > max_step:
+        return 0, size, 0, scaled_size
+
+    s0 = start // step_src * step_dst
+    s1 = min(scaled_size, -(-end // step_src) * step_dst)
+    return s0 * step_src // step_dst, s1 * step_src // step_dst, s0, s1
+
+
+def scale_region(frame, mask_inv, box, scaled_size):
+    """
+    box の範囲だけ人物を抽出してスケール
+
+    フレーム全体をスケールしてから切り出した場合と同じ結果になる。
+
+    Returns:
+        tuple: (スケール後の人物, スケール後のマスク, スケール後の範囲 (sx0, sy0, sx1, sy1))
+    """
+    height, width = frame.shape[:2]
+    scaled_width, scaled_height = scaled_size
+    x0, x1, sx0, sx1 = _align_span(box[0], box[2], width, scaled_width)
+    y0, y1, sy0, sy1 = _align_span(box[1], box[3], height, scaled_height)
+    region = (sx0, sy0, sx1, sy1)
+    dsize = (sx1 - sx0, sy1 - sy0)
+    if dsize[0] <= 0 or dsize[1] <= 0:
+        return None, None, region
+
+    # 人物部分を抽出してスケール
+    person_src = frame[y0:y1, x0:x1]
+    mask_src = mask_inv[y0:y1, x0:x1]
+    person = cv2.bitwise_and(person_src, person_src, mask=mask_src)
+    return cv2.resize(person, dsize), cv2.resize(mask_src, dsize), region
+
+
+def layout_rect(layout):
+    """配置（run.compute_layout() の戻り値）の合成先の領域 (y0, y1, x0, x1)"""
+    scaled_width, scaled_height, x_offset, y_offset = layout
+    return y_offset, y_offset + scaled_height, x_offset, x_offset + scaled_width
+
+
+class FrameData:
+    """
+    1フレーム分の段の間で受け渡す値
+
+    Attributes:
+        frame: 入力フレーム（BGR）
+        background: 出力サイズの背景画像
+        bg_hsv_mean: 背景の平均HSV値（None なら輝度マッチングなし）
+        canvas: 合成先（dirty の外は背景と同じ）
+        dirty: canvas のうち前のフレームの人物が残っている領域 (y0, y1, x0, x1)
+        background_changed: 前のフレームと背景が変わった
+        mask_inv: 人物部分が255のマスク（key）
+        person: スケール後の人物（transform・brightness）
+        person_mask: スケール後のマスク（transform）
+        rect: 人物を合成する領域 (y0, y1, x0, x1)（transform、None なら合成しない）
+    """
+
+    def __init__(
+        self, frame, background, bg_hsv_mean, canvas, dirty=None, changed=False
+    ):
+        self.frame = frame
+        self.background = background
+        self.bg_hsv_mean = bg_hsv_mean
+        self.canvas = canvas
+        self.dirty = dirty
+        self.background_changed = changed
+        self.mask_inv = None
+        self.person = None
+        self.person_mask = None
+        self.rect = None
+
+    def restore(self, rect):
+        """rect を書き換える前に、rect 以外に残っている前のフレームの人物を背景に戻す"""
+        if self.dirty is not None and self.dirty != rect:
+            y0, y1, x0, x1 = self.dirty
+            self.canvas[y0:y1, x0:x1] = self.background[y0:y1, x0:x1]
+        self.dirty = None
+
+
+class Stage:
+    """段の共通の形（name の値を読み書きする process と、後始末の close）"""
+
+    name = None
+
+    def process(self, data):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class KeyStage(Stage):
+    """
+    緑色検出
+
+    Args:
+        key: key(frame) -> 緑色部分が255のマスク（keyers.make_keyer）
+    """
+
+    name = "key"
+
+    def __init__(self, key):
+        self.key = key
+
+    def process(self, data):
+        data.mask_inv = cv2.bitwise_not(self.key(data.frame))
+
+
+class ScaleStage(Stage):
+    """
+    人物を抽出して配置の大きさにスケール（等倍ならスケールしない）
+
+    Args:
+        layout: run.compute_layout() の戻り値
+    """
+
+    name = "transform"
+
+    def __init__(self, layout):
+        self.size = tuple(layout[:2])
+        self.rect = layout_rect(layout)
+
+    def process(self, data):
+        frame, mask_inv = data.frame, data.mask_inv
+
+        # 人物部分を抽出
+        person = cv2.bitwise_and(frame, frame, mask=mask_inv)
+
+        # 人物をスケール
+        if frame.shape[1::-1] != self.size:
+            person = cv2.resize(person, self.size)
+            mask_inv = cv2.resize(mask_inv, self.size)
+        data.person, data.person_mask, data.rect = person, mask_inv, self.rect
+
+
+class TrackStage(Stage):
+    """
+    人物の矩形を追跡し、その範囲だけ抽出・スケール
+
+    Args:
+        layout: run.compute_layout() の戻り値
+        tracker: tracking.SubjectTracker
+    """
+
+    name = "transform"
+
+    def __init__(self, layout, tracker):
+        self.layout = layout
+        self.tracker = tracker
+
+    def process(self, data):
+        box = self.tracker.update(data.mask_inv)
+        if box is None:
+            return
+        scaled_width, scaled_height, x_offset, y_offset = self.layout
+        person, mask_inv, (sx0, sy0, sx1, sy1) = scale_region(
+            data.frame, data.mask_inv, box, (scaled_width, scaled_height)
+        )
+        if person is None:
+            return
+        data.person, data.person_mask = person, mask_inv
+        data.rect = (y_offset + sy0, y_offset + sy1, x_offset + sx0, x_offset + sx1)
+
+
+class BrightnessStage(Stage):
+    """人物の輝度を背景に合わせる（背景の平均HSV値がなければ何もしない）"""
+
+    name = "brightness"
+
+    def process(self, data):
+        if data.bg_hsv_mean is not None and data.person is not None:
+            data.person = adjust_brightness(
+                data.person, data.person_mask, None, None, data.bg_hsv_mean
+            )
+
+
+class BlendStage(Stage):
+    """
+    人物を合成先に重ねる
+
+    Args:
+        soft: マスクを不透明度として扱いアルファブレンドする（半透明キーヤー用）
+    """
+
+    name = "composite"
+
+    def __init__(self, soft=False):
+        self.soft = soft
+
+    def process(self, data):
+        data.restore(data.rect)
+        if data.rect is None:
+            return
+        y0, y1, x0, x1 = data.rect
+        # 背景の同じ領域と重ねるので、canvas に前のフレームの人物が残っていてもよい
+        data.canvas[y0:y1, x0:x1] = blend_person(
+            data.person, data.person_mask, data.background[y0:y1, x0:x1], self.soft
+        )
+
+
+class MaskCopyStage(Stage):
+    """
+    人物を等倍のまま合成先にコピーする段（transform〜composite を融合した段）
+
+    人物をスケールせず（配置がフレーム全体）、マスクが0か255だけ（半透明でない）なら、
+    人物の抽出と blend_person の合成は、背景の上にマスクの画素だけ入力フレームを
+    コピーするのと同じ結果になる（cv2.copyTo の1回で済む）。
+    """
+
+    name = "copy"
+
+    def process(self, data):
+        if not data.background_changed:
+            # 前のフレームの人物を消す
+            np.copyto(data.canvas, data.background)
+        cv2.copyTo(data.frame, data.mask_inv, data.canvas)
+        height, width = data.frame.shape[:2]
+        data.rect = (0, height, 0, width)
+        data.dirty = None
+
+
+class CompositorStage(Stage):
+    """
+    緑色検出〜合成を1度に処理する段（key〜composite を融合した段）
+
+    Args:
+        compositor: composite(frame, bg_img, canvas) で配置領域を書き換えるもの
+                    （fused.FusedCompositor・strips.StripCompositor）
+        layout: run.compute_layout() の戻り値
+        name: 段の名前（メトリクスの stage）
+    """
+
+    def __init__(self, compositor, layout, name):
+        self.compositor = compositor
+        self.rect = layout_rect(layout)
+        self.name = name
+
+    def process(self, data):
+        if data.background_changed:
+            self.compositor.bg_hsv_mean = data.bg_hsv_mean
+        data.restore(self.rect)
+        self.compositor.composite(data.frame, data.background, data.canvas)
+        data.rect = self.rect
+
+    def close(self):
+        close = getattr(self.compositor, "close", None)
+        if close is not None:
+            close()
+
+
+def fuse(stages, fusions):
+    """
+    隣り合う段を融合した段に置き換える
+
+    Args:
+        stages: 段のリスト
+        fusions: [(段の名前のタプル, factory(段のリスト) -> 段)]
+                 factory が None を返したら置き換えない（例: Numba がない）
+
+    Returns:
+        list: 段のリスト
+    """
+    stages = list(stages)
+    for names, factory in fusions:
+        names = tuple(names)
+        for index in range(len(stages) - len(names) + 1):
+            run = stages[index : index + len(names)]
+            if tuple(stage.name for stage in run) != names:
+                continue
+            stage = factory(run)
+            if stage is not None:
+                for replaced in run:
+                    replaced.close()
+                stages[index : index + len(names)] = [stage]
+            break
+    return stages
+
+
+class FrameSource:
+    """
+    入力フレーム
+
+    Args:
+        cap: cv2.VideoCapture または image_sequence.SequenceReader（シーク済み）
+        limit: 読むフレーム数（None なら最後まで）
+    """
+
+    def __init__(self, cap, limit=None):
+        self.cap = cap
+        self.limit = limit
+        self.count = 0
+
+    def read(self, dst=None):
+        """次のフレーム（dst を指定するとそこにデコード）、なければ None"""
+        if self.limit is not None and self.count >= self.limit:
+            return None
+        self.count += 1
+        ret, frame = self.cap.read() if dst is None else self.cap.read(dst)
+        return frame if ret else None
+
+    def release(self):
+        self.cap.release()
+
+
+class StaticBackground:
+    """
+    全フレームで同じ背景画像
+
+    Args:
+        image: 出力サイズの背景画像
+        hsv_mean: 背景の平均HSV値（None なら輝度マッチングなし）
+    """
+
+    # フレームごとに背景が変わるか（video_background.VideoBackground は True）
+    varying = False
+
+    def __init__(self, image, hsv_mean=None):
+        self.image = image
+        self.hsv_mean = hsv_mean
+
+    def next(self):
+        return self.image, self.hsv_mean
+
+    def close(self):
+        pass
+
+
+def _shared_step(make_pipeline, dirty, bg_hsv_mean):
+    """composite_shared の子プロセスで段を組み立てて1フレームの合成処理を返す"""
+    pipeline = make_pipeline()
+
+    def step(frame, bg_img, canvas):
+        # スロットの出力枠には、前にそのスロットで合成した人物が配置領域に残っている
+        pipeline.process(FrameData(frame, bg_img, bg_hsv_mean, canvas, dirty))
+
+    return step
+
+
+class Pipeline:
+    """
+    段を順に適用してフレームを合成し、出力に書き出す
+
+    Args:
+        stages: 段のリスト（前から順に処理する）
+        fusions: 融合の規則（fuse() を参照）
+        timer: metrics.StageTimer（None なら新しく作る）
+
+    Attributes:
+        seconds: 段の名前 → 合計の時間（秒）。"decode"・"write" は入力・出力の時間
+        frames: 書き出したフレーム数
+        child_peaks: run_shared() の子プロセスのピークRSS（バイト）のリスト
+    """
+
+    def __init__(self, stages=(), fusions=(), timer=None):
+        self.stages = fuse(stages, fusions)
+        self.timer = timer if timer is not None else metrics.StageTimer()
+        self.seconds = {}
+        self.frames = 0
+        self.child_peaks = []
+        self.last_lap = time.perf_counter()
+
+    @property
+    def names(self):
+        """段の名前のリスト（融合後）"""
+        return [stage.name for stage in self.stages]
+
+    def lap(self, name):
+        """前回の lap() からの時間を段 name の時間として加算"""
+        now = time.perf_counter()
+        self.seconds[name] = self.seconds.get(name, 0.0) + now - self.last_lap
+        self.last_lap = now
+        self.timer.lap(name)
+
+    def process(self, data):
+        """1フレームに全ての段を適用（合成結果は data.canvas）"""
+        for stage in self.stages:
+            stage.process(data)
+            self.lap(stage.name)
+
+    def _write(self, sinks, frame):
+        for sink in sinks:
+            sink.write(frame)
+        self.frames += 1
+        self.lap("write")
+        self.timer.frame()
+
+    def run(self, source, background, sinks, dedup=None, progress=None):
+        """
+        入力の全フレームを合成して書き出す
+
+        Args:
+            source: FrameSource
+            background: StaticBackground または video_background.VideoBackground
+            sinks: write(frame) を持つ出力のリスト（frame は呼び出しの間だけ有効）
+            dedup: FrameDeduplicator（前のフレームと同じなら前の合成結果を書き出す、
+                   背景が変わる場合は使わない）
+            progress: progress(フレーム数) 進捗表示（None なら表示しない）
+
+        Returns:
+            int: 書き出したフレーム数
+        """
+        if background.varying:
+            dedup = None
+        canvas = None
+        dirty = None
+        self.last_lap = time.perf_counter()
+        count = 0
+        while True:
+            frame = source.read()
+            self.lap("decode")
+            if frame is None:
+                break
+            count += 1
+
+            # 背景が変わったら合成先を背景で初期化し直す
+            changed = canvas is None or background.varying
+            if changed:
+                bg_img, bg_hsv_mean = background.next()
+                if canvas is None:
+                    canvas = bg_img.copy()
+                else:
+                    np.copyto(canvas, bg_img)
+                dirty = None
+
+            if progress is not None:
+                progress(count)
+
+            if dedup is not None and dedup.is_repeat(frame):
+                # 前のフレームと同じ: 前の合成結果（canvas のまま）をもう一度書き出す
+                self._write(sinks, canvas)
+                continue
+
+            data = FrameData(frame, bg_img, bg_hsv_mean, canvas, dirty, changed)
+            self.process(data)
+            dirty = data.rect if data.dirty is None else data.dirty
+            self._write(sinks, canvas)
+        return count
+
+    def run_shared(
+        self,
+        make_pipeline,
+        source,
+        background,
+        sinks,
+        processes,
+        extent,
+        threads=1,
+        dedup=None,
+        progress=None,
+    ):
+        """
+        共有メモリのフレームリングで複数のプロセスに合成を分ける
+
+        段は子プロセスで make_pipeline() が組み立てる（この Pipeline の段は使わない）。
+        段ごとの時間は、子プロセスの合成を待った時間を "composite" として集計する。
+
+        Args:
+            make_pipeline: 子プロセスで Pipeline を作る関数（pickle できること）
+            source: FrameSource
+            background: StaticBackground（背景が変わる場合は使えない）
+            sinks: write(frame) を持つ出力のリスト
+            processes: 合成するプロセス数
+            extent: 段が書き換える可能性のある領域 (y0, y1, x0, x1)
+            threads: 1プロセスあたりの OpenCV / Numba のスレッド数
+            dedup: FrameDeduplicator
+            progress: progress(フレーム数) 進捗表示
+
+        Returns:
+            int: 書き出したフレーム数
+        """
+        bg_img, bg_hsv_mean = background.next()
+        self.last_lap = time.perf_counter()
+
+        def read(dst):
+            ok = source.read(dst) is not None
+            self.lap("decode")
+            return ok
+
+        def write(frame):
+            # 子プロセスの合成を待った時間
+            self.lap("composite")
+            self._write(sinks, frame)
+            if progress is not None:
+                progress(self.frames)
+
+        step = partial(_shared_step, make_pipeline, extent, bg_hsv_mean)
+        return composite_shared(
+            read, write, bg_img, step, processes, threads, dedup, peaks=self.child_peaks
+        )
+
+    def close(self):
+        """段の後始末（スレッドの終了など）"""
+        for stage in self.stages:
+            stage.close()
@@ -5,24 +5,160 @@
 使用方法:
     uv run python remove_greenback.py
 
+    # 他の処理と同時に動かす場合（ffmpegのスレッド数をコア数/2に抑える）
+    uv run python remove_greenback.py --jobs 2
+
+    # 4本のffmpegを同時に実行（各ffmpegはコア数/4スレッド）
+    uv run python remove_greenback.py --workers 4
+
+    # 短い動画が多い場合: 8本ずつ1つのffmpegでまとめて処理
+    uv run python remove_greenback.py --batch-size 8
+
+    # 実時間の2倍速を保てる中で最も高圧縮なx264プリセットを自動選択
+    uv run python remove_greenback.py --speed-target 2x
+
+    # 処理状況を Prometheus 形式で公開（http://127.0.0.1:9200/metrics）
+    uv run python remove_greenback.py --metrics-port 9200
+
 処理内容:
     - output_10fps_1080p/ 内の全動画を検出
+    - ffprobeで各動画の解像度・フレームレートを取得し、背景画像を合わせる
     - グリーンバックを01.pngに置き換え
     - output_with_background/ に出力
 """
 
+import argparse
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
 from pathlib import Path
 import ffmpeg
 
+import metrics
+from autotune import add_autotune_arguments, tuned_threads
+from concurrency import add_thread_arguments, describe, ffmpeg_thread_args, plan_threads
+from encoding import X264_PRESETS, PresetTuner, parse_speed_target, record_encoding
+from media_files import add_base_dir_argument
+
 
 def get_script_dir():
     """スクリプトのディレクトリを取得（相対パスの基準）"""
     return Path(__file__).parent.absolute()
 
 
-def remove_greenback(input_video, background_image, output_video, similarity=0.3, blend=0.1):
+def probe_video(input_video):
+    """
+    ffprobeで動画の解像度・フレームレート・長さを取得
+
+    Args:
+        input_video: 入力動画パス
+
+    Returns:
+        tuple: (幅, 高さ, フレームレート, 長さ)
+               フレームレートは "30000/1001" のような文字列、長さは秒（取得できなければ 0.0）
+    """
+    info = ffmpeg.probe(str(input_video), select_streams='v:0')
+    stream = info['streams'][0]
+
+    # r_frame_rate が取れない（0/0）場合は平均フレームレート
+    fps = stream.get('r_frame_rate', '0/0')
+    if fps.startswith('0'):
+        fps = stream.get('avg_frame_rate', '10/1')
+
+    try:
+        duration = float(info['format']['duration'])
+    except (KeyError, ValueError):
+        duration = 0.0
+
+    return int(stream['width']), int(stream['height']), fps, duration
+
+
+def probe_videos(video_files, workers):
+    """
+    全動画を並列に ffprobe で調べる（1本につき1回）
+
+    Returns:
+        dict: 動画パス → probe_video() の戻り値
+              調べられなかった動画は None（エラーは動画ごとの処理で表示する）
+    """
+    def probe(video_file):
+        try:
+            return probe_video(video_file)
+        except (ffmpeg.Error, OSError, LookupError, ValueError):
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(video_files, executor.map(probe, video_files)))
+
+
+def make_background(background_image, width, height, fps):
+    """
+    背景画像のストリームを作成
+
+    動画と同じサイズに1回だけリサイズし、
+    loopフィルタでその1フレームを動画のフレームレートで繰り返す
+    """
+    return (
+        ffmpeg.input(str(background_image), framerate=fps)
+        .filter('scale', width, height)
+        .filter('loop', loop=-1, size=1, start=0)
+    )
+
+
+def key_over(background, video, similarity=0.3, blend=0.1):
+    """
+    動画のグリーン部分を透過して背景の上に重ねる
+
+    Args:
+        background: 背景のストリーム
+        video: 入力動画のストリーム
+        similarity: 緑色の類似度
+        blend: エッジのブレンド量
+
+    Returns:
+        合成後のストリーム
+    """
+    # chromakeyフィルタでグリーン部分を透過
+    # 人物以外の緑色背景が透明になる
+    keyed = video.filter(
+        'chromakey',
+        color='0x00FF00',  # 緑色（16進数）
+        similarity=similarity,
+        blend=blend,
+        yuv=1  # YUVカラースペースで処理（より正確）
+    )
+
+    # 背景画像の上に、透過処理した動画（人物）を重ねる
+    # これで人物は残り、緑背景だけが01.pngに置き換わる
+    return ffmpeg.overlay(
+        background,
+        keyed,
+        x=0,
+        y=0,
+        shortest=1
+    )
+
+
+def encode(stream, output_video, fps, threads=None, preset='medium'):
+    """出力設定（H.264、yuv420p、入力と同じフレームレート）"""
+    return ffmpeg.output(
+        stream,
+        str(output_video),
+        vcodec='libx264',
+        pix_fmt='yuv420p',
+        r=fps,
+        preset=preset,
+        crf=23,  # 品質（18-28推奨、低いほど高品質）
+        **{'b:v': '3M'},  # ビットレート3Mbps
+        **ffmpeg_thread_args(threads)
+    )
+
+
+def remove_greenback(input_video, background_image, output_video, similarity=0.3, blend=0.1,
+                     threads=None, preset='medium', video_info=None):
     """
     グリーンバック動画の背景を画像に置き換える
     人物を残したまま、緑色の背景部分だけを01.pngに置き換える
@@ -33,52 +169,18 @@ def remove_greenback(input_video, background_image, output_video, similarity=0.3
         output_video: 出力動画パス
         similarity: 緑色の類似度（0.0-1.0、高いほど広範囲の緑を透過）デフォルト0.3
         blend: エッジのブレンド量（0.0-1.0、高いほど滑らか）デフォルト0.1
+        threads: ffmpegのスレッド数（Noneならffmpegの自動設定）
+        preset: x264のプリセット
+        video_info: probe_video() の戻り値（None ならここで調べる）
     """
     try:
-        print(f"Processing: {input_video.name}")
-
-        # 入力動画を読み込み
-        video = ffmpeg.input(str(input_video))
-
-        # 背景画像を読み込み（ループ指定で動画の長さに合わせる）
-        # scaleフィルタで動画と同じサイズにリサイズ
-        background = (
-            ffmpeg.input(str(background_image), loop=1)
-            .filter('scale', 1920, 1080)
-            .filter('fps', fps=10)
-        )
-
-        # chromakeyフィルタでグリーン部分を透過
-        # 人物以外の緑色背景が透明になる
-        keyed = video.filter(
-            'chromakey',
-            color='0x00FF00',  # 緑色（16進数）
-            similarity=similarity,
-            blend=blend,
-            yuv=1  # YUVカラースペースで処理（より正確）
-        )
-
-        # 背景画像の上に、透過処理した動画（人物）を重ねる
-        # これで人物は残り、緑背景だけが01.pngに置き換わる
-        output = ffmpeg.overlay(
-            background,
-            keyed,
-            x=0,
-            y=0,
-            shortest=1
-        )
-
-        # 出力設定
-        output = ffmpeg.output(
-            output,
-            str(output_video),
-            vcodec='libx264',
-            pix_fmt='yuv420p',
-            r=10,
-            preset='medium',
-            crf=23,  # 品質（18-28推奨、低いほど高品質）
-            **{'b:v': '3M'}  # ビットレート3Mbps
-        )
+        # 入力動画の解像度・フレームレート
+        width, height, fps, _ = video_info or probe_video(input_video)
+        print(f"Processing: {input_video.name} ({width}x{height} @ {fps}fps)")
+
+        background = make_background(background_image, width, height, fps)
+        output = key_over(background, ffmpeg.input(str(input_video)), similarity, blend)
+        output = encode(output, output_video, fps, threads, preset)
 
         # 既存ファイルを上書き
         output = ffmpeg.overwrite_output(output)
@@ -99,9 +201,178 @@ def remove_greenback(input_video, background_image, output_video, similarity=0.3
     return True
 
 
+def remove_greenback_batch(input_videos, background_image, output_videos, video_format,
+                           similarity=0.3, blend=0.1, threads=None, preset='medium'):
+    """
+    同じ解像度・フレームレートの複数の動画を1つのffmpegでまとめて処理する
+
+    背景画像のデコードとリサイズは1回だけ行い、splitフィルタで各動画の
+    chromakey/overlay に分配する。出力は動画ごとに別ファイル。
+    短い動画が多いときに、ffmpegの起動と背景の準備にかかる時間を減らせる。
+
+    Args:
+        input_videos: 入力動画パスのリスト
+        background_image: 背景画像パス
+        output_videos: 出力動画パスのリスト（input_videos と同じ順）
+        video_format: (幅, 高さ, フレームレート)（全動画で共通）
+        similarity: 緑色の類似度
+        blend: エッジのブレンド量
+        threads: ffmpegのスレッド数（Noneならffmpegの自動設定）
+        preset: x264のプリセット
+
+    Returns:
+        list: 動画ごとの成否（1つのffmpegで処理するので全て同じ値）
+    """
+    names = ', '.join(video.name for video in input_videos)
+    try:
+        width, height, fps = video_format
+        print(f"Processing batch ({width}x{height} @ {fps}fps): {names}")
+
+        # 背景は1回だけ読み込み・リサイズして、動画の数だけ分配
+        background = make_background(background_image, width, height, fps)
+        backgrounds = background.filter_multi_output('split', len(input_videos))
+
+        outputs = []
+        for i, (input_video, output_video) in enumerate(zip(input_videos, output_videos)):
+            video = ffmpeg.input(str(input_video))
+            composited = key_over(backgrounds[i], video, similarity, blend)
+            outputs.append(encode(composited, output_video, fps, threads, preset))
+
+        output = ffmpeg.overwrite_output(ffmpeg.merge_outputs(*outputs))
+        ffmpeg.run(output, quiet=True)
+
+        for output_video in output_videos:
+            print(f"✓ Completed: {output_video.name}")
+
+    except ffmpeg.Error as e:
+        print(f"✗ Error processing batch: {names}")
+        print(e.stderr.decode() if e.stderr else str(e))
+        return [False] * len(input_videos)
+    except Exception as e:
+        print(f"✗ Error processing batch: {names}: {e}")
+        return [False] * len(input_videos)
+
+    return [True] * len(input_videos)
+
+
+def measure_speed(input_video, background_image, seconds, threads=None, preset=None,
+                  video_info=None):
+    """
+    動画の先頭 seconds 秒を処理して速度を計測（出力は捨てる）
+
+    Args:
+        preset: x264のプリセット（None ならエンコードせずデコード〜合成だけを計測）
+        video_info: probe_video() の戻り値（None ならここで調べる）
+
+    Returns:
+        float: 実時間に対する倍率
+    """
+    width, height, fps, duration = video_info or probe_video(input_video)
+    seconds = min(seconds, duration) if duration > 0 else seconds
+
+    background = make_background(background_image, width, height, fps)
+    output = key_over(background, ffmpeg.input(str(input_video), t=seconds))
+    if preset is None:
+        output = ffmpeg.output(output, '-', format='null', **ffmpeg_thread_args(threads))
+    else:
+        output = ffmpeg.output(output, '-', format='null', vcodec='libx264',
+                               pix_fmt='yuv420p', preset=preset, crf=23,
+                               **ffmpeg_thread_args(threads))
+
+    start = time.perf_counter()
+    ffmpeg.run(output, quiet=True)
+    return seconds / (time.perf_counter() - start)
+
+
+def calibrate_preset(tuner, input_video, background_image, seconds, threads=None,
+                     video_info=None):
+    """
+    最初の動画の先頭 seconds 秒で、速度目標を満たすx264プリセットを選ぶ
+    """
+    try:
+        video_info = video_info or probe_video(input_video)
+        stage_speed = measure_speed(input_video, background_image, seconds, threads,
+                                    video_info=video_info)
+        results = tuner.calibrate(
+            lambda preset: measure_speed(input_video, background_image, seconds,
+                                         threads, preset, video_info),
+            stage_speed)
+    except ffmpeg.Error as e:
+        print(f"! Preset calibration failed, using {tuner.preset}:")
+        print(e.stderr.decode() if e.stderr else str(e))
+        return
+    except OSError as e:
+        print(f"! Preset calibration failed, using {tuner.preset}: {e}")
+        return
+
+    print(f"Decode+key: {stage_speed:.2f}x")
+    print("Presets: " + ', '.join(f"{preset} {speed:.2f}x" for preset, speed in results.items()))
+    print(f"x264 preset: {tuner.preset} (target {tuner.target}x)")
+
+
+def make_batches(video_files, infos, batch_size):
+    """
+    解像度・フレームレートが同じ動画を batch_size 本ずつにまとめる
+
+    Args:
+        infos: probe_videos() の戻り値
+
+    Returns:
+        list: (video_format, [動画パス, ...]) のリスト
+              ffprobeに失敗した動画は video_format=None で1本ずつ
+    """
+    groups = {}
+    batches = []
+    for video_file in video_files:
+        if infos[video_file] is None:
+            # 1本ずつ処理してエラー内容を表示させる
+            batches.append((None, [video_file]))
+            continue
+        groups.setdefault(infos[video_file][:3], []).append(video_file)
+
+    for video_format, files in groups.items():
+        for i in range(0, len(files), batch_size):
+            batches.append((video_format, files[i:i + batch_size]))
+    return batches
+
+
 def main():
-    # スクリプトのディレクトリを基準にする
-    base_dir = get_script_dir()
+    parser = argparse.ArgumentParser(description='グリーンバック背景置換（ffmpeg chromakey）')
+    add_thread_arguments(parser, workers=True)
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1,
+        help='1つのffmpegでまとめて処理する動画数（デフォルト: 1 = 1本ずつ）'
+    )
+    parser.add_argument(
+        '--preset',
+        choices=X264_PRESETS,
+        default='medium',
+        help='x264のプリセット（--speed-target 指定時は最初に試すプリセット）'
+    )
+    parser.add_argument(
+        '--speed-target',
+        metavar='TARGET',
+        type=parse_speed_target,
+        help='処理速度の目標 realtime, 2x など。満たす中で最も高圧縮なx264プリセットを自動選択'
+    )
+    parser.add_argument(
+        '--probe-seconds',
+        type=float,
+        default=3.0,
+        help='プリセットの計測に使う先頭の秒数（デフォルト: 3）'
+    )
+    add_autotune_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    add_base_dir_argument(parser, get_script_dir())
+    args = parser.parse_args()
+
+    # スレッド数の割り当て（ffmpegを workers 本同時に実行）
+    plan = plan_threads(args.jobs, args.workers, args.cores)
+
+    # --base-dir（デフォルトはスクリプトのディレクトリ）を基準にする
+    base_dir = args.base_dir.absolute()
 
     # 入力・出力ディレクトリ、背景画像のパス（相対パス）
     input_dir = base_dir / "output_10fps_1080p"
@@ -135,23 +406,123 @@ def main():
     # ソート
     video_files = sorted(video_files)
 
+    # 全動画の解像度・フレームレート・長さ（以降の処理はこの結果を使う）
+    infos = probe_videos(video_files, plan.workers * plan.threads)
+
+    # autotune のプロファイルで最も速かったスレッド数（最初の動画の解像度で選ぶ）
+    # 調べられなければ plan のまま（エラーは動画ごとの処理で表示する）
+    first = infos[video_files[0]]
+    if not args.no_autotune and args.cores is None and first is not None:
+        plan = tuned_threads(args, plan, 'ffmpeg', first[0], first[1])
+
     print(f"\nFound {len(video_files)} video file(s)")
     print(f"Background image: {background_image.name}")
+    print(f"Threads: {describe(plan)}")
+
+    # メトリクスの公開（--metrics-port / --metrics-file）
+    try:
+        exporter = metrics.start(args.metrics_port, args.metrics_file, args.metrics_interval)
+    except OSError as e:
+        print(f"Error: Cannot export metrics: {e}")
+        sys.exit(1)
+
+    # 速度目標を満たすx264プリセットを最初の動画の先頭数秒で選ぶ
+    tuner = None
+    if args.speed_target:
+        tuner = PresetTuner(args.speed_target, args.preset)
+        calibrate_preset(tuner, video_files[0], background_image, args.probe_seconds,
+                         plan.threads, first)
     print("-" * 60)
 
     # 処理
-    success_count = 0
-    failed_count = 0
-
-    for video_file in video_files:
+    # ffmpegは別プロセスなので、スレッドで起動して終了を待つだけでプロセスプールと同じく並列になる
+    # （stderr と終了コードは remove_greenback の中で ffmpeg.Error として受け取る）
+    def get_output_path(video_file):
         # 出力ファイル名（_greenscreenを_with_bgに置き換え）
         output_name = video_file.stem.replace('_greenscreen', '_with_bg') + '.mp4'
-        output_path = output_dir / output_name
-
-        if remove_greenback(video_file, background_image, output_path):
-            success_count += 1
+        return output_dir / output_name
+
+    # 待ち・実行中の動画数（メトリクスのキューの長さ）
+    queue_lock = threading.Lock()
+    queue_depth = {'pending_videos': len(video_files), 'running_videos': 0}
+
+    def update_queue_depth(started=0, finished=0):
+        with queue_lock:
+            queue_depth['pending_videos'] -= started
+            queue_depth['running_videos'] += started - finished
+            for name, depth in queue_depth.items():
+                metrics.set_gauge('greenback_queue_depth', depth, queue=name)
+
+    def record_metrics(files, results, elapsed):
+        # ffmpegの中の段は見えないので、1回のffmpegの時間をまとめて ffmpeg の段とする
+        metrics.inc('greenback_stage_seconds_total', elapsed, stage='ffmpeg')
+        metrics.observe('greenback_video_seconds', elapsed)
+        for video_file, success in zip(files, results):
+            metrics.inc('greenback_videos_total', result='success' if success else 'failure')
+            if not success:
+                metrics.inc('greenback_failures_total', stage='process')
+                continue
+            output_video = get_output_path(video_file)
+            metrics.inc('greenback_output_bytes_total', metrics.path_bytes(output_video))
+            # フレーム数は最初に調べた長さ × フレームレートから求める
+            if infos[video_file] is None:
+                continue
+            _, _, fps, duration = infos[video_file]
+            try:
+                metrics.inc('greenback_frames_total', round(duration * Fraction(fps)))
+            except (ValueError, ZeroDivisionError):
+                pass
+
+    def run_tuned(files, run):
+        # 開始時点のプリセットで処理し、実際の速度でプリセットを調整して記録する
+        preset = tuner.preset if tuner else args.preset
+        update_queue_depth(started=len(files))
+        start = time.perf_counter()
+        results = run(preset)
+        elapsed = time.perf_counter() - start
+        update_queue_depth(finished=len(files))
+
+        # 長さが分からない動画は 0 秒として扱う
+        durations = [infos[f][3] if infos[f] else 0.0 for f in files]
+        if exporter is not None:
+            record_metrics(files, results, elapsed)
+        duration = sum(durations)
+        speed = duration / elapsed if elapsed > 0 else 0.0
+        if tuner and all(results):
+            if tuner.update(speed) != preset:
+                print(f"  x264 preset: {preset} -> {tuner.preset} ({speed:.2f}x)")
+        for video_file, success in zip(files, results):
+            if success:
+                record_encoding(output_dir / 'encoding_log.csv', get_output_path(video_file),
+                                encoder='libx264', preset=preset, crf=23,
+                                target=tuner.target if tuner else '', speed=f"{speed:.3f}")
+        return results
+
+    def process(video_file):
+        return run_tuned([video_file], lambda preset: [
+            remove_greenback(video_file, background_image, get_output_path(video_file),
+                             threads=plan.threads, preset=preset,
+                             video_info=infos[video_file])])
+
+    def process_batch(batch):
+        video_format, files = batch
+        if video_format is None or len(files) == 1:
+            return process(files[0])
+        # 1つのffmpegでエンコーダが len(files) 個動くので、スレッド数を分け合う
+        return run_tuned(files, lambda preset: remove_greenback_batch(
+            files, background_image, [get_output_path(f) for f in files], video_format,
+            threads=max(1, plan.threads // len(files)), preset=preset))
+
+    with ThreadPoolExecutor(max_workers=plan.workers) as executor:
+        if args.batch_size > 1:
+            batches = make_batches(video_files, infos, args.batch_size)
+            batch_results = executor.map(process_batch, batches)
         else:
-            failed_count += 1
+            batch_results = executor.map(process, video_files)
+        results = [result for batch in batch_results for result in batch]
+
+    success_count = results.count(True)
+    failed_count = results.count(False)
 
     # 結果表示
     print("-" * 60)
@@ -160,6 +531,9 @@ def main():
     print(f"Failed: {failed_count}")
     print(f"Output directory: {output_dir}")
 
+    if exporter is not None:
+        exporter.close()
+
 
 if __name__ == "__main__":
     main()
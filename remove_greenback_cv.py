@@ -6,23 +6,92 @@ HSV色空間で緑色を検出し、人物を残して背景だけを置き換
 使用方法:
     uv run python remove_greenback_cv.py
 
+    # 他の処理と同時に動かす場合（OpenCVのスレッド数をコア数/2に抑える）
+    uv run python remove_greenback_cv.py --jobs 2
+
 処理内容:
     - output_10fps_1080p/ 内の全動画を検出
     - 緑色背景を01.pngに置き換え（人物は残す）
     - output_with_background/ に出力
 """
 
+import argparse
 import cv2
 import numpy as np
+from functools import partial
 from pathlib import Path
 import sys
 
+from autotune import add_autotune_arguments, tuned_threads
+from concurrency import add_thread_arguments, apply_thread_plan, describe, plan_threads
+from keyers import hsv_mask
+from media_files import add_base_dir_argument
+from pipeline import (BlendStage, FrameSource, KeyStage, MaskCopyStage, Pipeline,
+                      ScaleStage, StaticBackground)
+
 
 def get_script_dir():
     """スクリプトのディレクトリを取得（相対パスの基準）"""
     return Path(__file__).parent.absolute()
 
 
+def replace_background(frame, bg_img, lower_green, upper_green):
+    """
+    1フレームの緑色部分を背景画像に置き換える
+
+    Args:
+        frame: 入力フレーム（BGR）
+        bg_img: フレームと同じサイズの背景画像
+        lower_green: 緑色検出の下限値 (H, S, V) のnumpy配列
+        upper_green: 緑色検出の上限値 (H, S, V) のnumpy配列
+
+    Returns:
+        tuple: (合成後のフレーム, 緑色部分が255のマスク)
+    """
+    # 6. 画像をHSV色空間に変換
+    # (RGBよりHSVの方が「特定の色」を抜き出しやすいため)
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+
+    # 7. 指定した緑色の範囲だけを「白」、それ以外を「黒」にしたマスク画像を作成
+    mask = cv2.inRange(hsv, lower_green, upper_green)
+
+    # 8. マスクを反転（人物部分を白にする）
+    mask_inv = cv2.bitwise_not(mask)
+
+    # 9. 合成処理
+    # 背景画像から、マスクが「白（元が緑）」の部分だけを切り抜く
+    bg_part = cv2.bitwise_and(bg_img, bg_img, mask=mask)
+
+    # 元動画から、マスクが「黒（人物）」の部分だけを切り抜く
+    fg_part = cv2.bitwise_and(frame, frame, mask=mask_inv)
+
+    # 2つを足し合わせる（人物 + 新しい背景）
+    return cv2.add(bg_part, fg_part), mask
+
+
+def make_pipeline(frame_size, lower_green, upper_green, fuse_copy=True):
+    """
+    replace_background と同じ処理の段を組み立てる
+
+    緑色検出 → 人物を抽出（等倍なのでスケールしない）→ 背景に重ねる
+
+    Args:
+        frame_size: 動画の (幅, 高さ)
+        lower_green: 緑色検出の下限値 (H, S, V)
+        upper_green: 緑色検出の上限値 (H, S, V)
+        fuse_copy: 抽出〜合成をマスクの画素のコピー1回にまとめる
+                   （マスクは0か255だけなので結果は同じ）
+
+    Returns:
+        pipeline.Pipeline
+    """
+    layout = (*frame_size, 0, 0)
+    key = partial(hsv_mask, lower_green=np.array(lower_green),
+                  upper_green=np.array(upper_green))
+    fusions = [(('transform', 'composite'), lambda _: MaskCopyStage())] if fuse_copy else []
+    return Pipeline([KeyStage(key), ScaleStage(layout), BlendStage()], fusions)
+
+
 def change_background(video_path, bg_image_path, output_path,
                       lower_green=(35, 80, 80), upper_green=(85, 255, 255)):
     """
@@ -43,7 +112,9 @@ def change_background(video_path, bg_image_path, output_path,
         print(f"Processing: {video_path.name}")
 
         # 1. 動画と背景画像の読み込み
-        cap = cv2.VideoCapture(str(video_path))
+        # デコーダのスレッド数も OpenCV の設定に合わせる
+        cap = cv2.VideoCapture(str(video_path), cv2.CAP_ANY,
+                               [cv2.CAP_PROP_N_THREADS, cv2.getNumThreads()])
         bg_img_origin = cv2.imread(str(bg_image_path))
 
         # 動画が正しく開けたか確認
@@ -73,49 +144,18 @@ def change_background(video_path, bg_image_path, output_path,
             cap.release()
             return False
 
-        # 5. フレームごとに処理
-        frame_count = 0
-        lower_green_array = np.array(lower_green)
-        upper_green_array = np.array(upper_green)
-
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            frame_count += 1
+        # 5. 処理の段（replace_background と同じ処理）
+        pipeline = make_pipeline((width, height), lower_green, upper_green)
 
+        def progress(frame_count):
             # 進捗表示（10フレームごと）
             if frame_count % 10 == 0 or frame_count == 1:
-                progress = (frame_count / total_frames) * 100
-                print(f"  Progress: {frame_count}/{total_frames} frames ({progress:.1f}%)", end='\r')
-
-            # --- ここから画像処理 ---
-
-            # 6. 画像をHSV色空間に変換
-            # (RGBよりHSVの方が「特定の色」を抜き出しやすいため)
-            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+                percent = (frame_count / total_frames) * 100
+                print(f"  Progress: {frame_count}/{total_frames} frames ({percent:.1f}%)", end='\r')
 
-            # 7. 指定した緑色の範囲だけを「白」、それ以外を「黒」にしたマスク画像を作成
-            mask = cv2.inRange(hsv, lower_green_array, upper_green_array)
-
-            # 8. マスクを反転（人物部分を白にする）
-            mask_inv = cv2.bitwise_not(mask)
-
-            # 9. 合成処理
-            # 背景画像から、マスクが「白（元が緑）」の部分だけを切り抜く
-            bg_part = cv2.bitwise_and(bg_img, bg_img, mask=mask)
-
-            # 元動画から、マスクが「黒（人物）」の部分だけを切り抜く
-            fg_part = cv2.bitwise_and(frame, frame, mask=mask_inv)
-
-            # 2つを足し合わせる（人物 + 新しい背景）
-            final_frame = cv2.add(bg_part, fg_part)
-
-            # --- ここまで画像処理 ---
-
-            # 書き出し
-            out.write(final_frame)
+        # 6-9. フレームごとに緑色検出と合成、書き出し
+        pipeline.run(FrameSource(cap), StaticBackground(bg_img), [out],
+                     progress=progress)
 
         # 終了処理
         cap.release()
@@ -130,8 +170,18 @@ def change_background(video_path, bg_image_path, output_path,
 
 
 def main():
-    # スクリプトのディレクトリを基準にする
-    base_dir = get_script_dir()
+    parser = argparse.ArgumentParser(description='グリーンバック背景置換（OpenCV HSV）')
+    add_thread_arguments(parser)
+    add_autotune_arguments(parser)
+    add_base_dir_argument(parser, get_script_dir())
+    args = parser.parse_args()
+
+    # スレッド数の割り当て
+    plan = plan_threads(args.jobs, cores=args.cores)
+    apply_thread_plan(plan)
+
+    # --base-dir（デフォルトはスクリプトのディレクトリ）を基準にする
+    base_dir = args.base_dir.absolute()
 
     # 入力・出力ディレクトリ、背景画像のパス（相対パス）
     input_dir = base_dir / "output_10fps_1080p"
@@ -165,8 +215,18 @@ def main():
     # ソート
     video_files = sorted(video_files)
 
+    # autotune のプロファイルで最も速かったスレッド数（最初の動画の解像度で選ぶ）
+    cap = cv2.VideoCapture(str(video_files[0]))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    if width and height:
+        plan = tuned_threads(args, plan, 'cv', width, height)
+        apply_thread_plan(plan)
+
     print(f"\nFound {len(video_files)} video file(s)")
     print(f"Background image: {background_image.name}")
+    print(f"Threads: {describe(plan)}")
     print("\nHSV Green Detection Parameters:")
     print("  Lower: (H:35, S:80, V:80)")
     print("  Upper: (H:85, S:255, V:255)")
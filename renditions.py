@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+合成したフレームから、解像度違いの出力（ラダー）とサムネイルを同時に作る
+
+1080p・720p・480p の版やサムネイルが必要な場合、これまでは出力した
+_output.mp4 を convert_videos.convert_video でもう一度デコード・縮小・エンコードしていた。
+ここでは合成済みのフレームをそのまま使い、縮小とエンコードを別スレッドで並行して行う。
+
+    - 合成側はフレームを固定数のバッファ（リングバッファ）に1回コピーするだけ
+    - 解像度ごと・サムネイルごとのスレッドが同じバッファから縮小・エンコードし、
+      全員が使い終わったらバッファを空きに戻す
+    - cv2.resize / 動画の書き出しは GIL を解放するので、合成と並行して動く
+"""
+
+import queue
+import threading
+from functools import partial
+
+import cv2
+import numpy as np
+
+from encoding import FFmpegWriter
+
+# 合成側と縮小・エンコード側の間のバッファのフレーム数
+BUFFER_FRAMES = 4
+
+# サムネイルの JPEG 品質
+THUMBNAIL_QUALITY = 90
+
+
+def parse_rendition(text):
+    """
+    "720p"、"720" のような文字列を出力の高さに変換
+
+    Returns:
+        int: 高さ（画素）
+    """
+    text = text.strip().lower().removesuffix("p")
+    height = int(text)
+    if height <= 0:
+        raise ValueError(f"解像度は正の値で指定してください: {text}")
+    return height
+
+
+def rendition_size(width, height, target_height):
+    """
+    縦横比を保って target_height に縮小したときの (幅, 高さ)（どちらも偶数）
+    """
+    scaled_width = round(width * target_height / height / 2) * 2
+    return max(2, scaled_width), max(2, target_height // 2 * 2)
+
+
+def rendition_path(output_path, target_height):
+    """解像度違いの出力のパス（例: v0_output_720p.mp4）"""
+    return output_path.with_name(f"{output_path.stem}_{target_height}p.mp4")
+
+
+def thumbnail_dir(output_path):
+    """サムネイルの保存先（例: v0_output_thumbs/）"""
+    return output_path.with_name(f"{output_path.stem}_thumbs")
+
+
+class RenditionLadder:
+    """
+    合成済みのフレームを解像度違いの動画とサムネイルに書き出す
+
+    write() で渡したフレームはバッファにコピーするので、呼び出し側はすぐに書き換えてよい。
+
+    Args:
+        output_path: 元の解像度の出力パス（解像度違い・サムネイルのパスの基準）
+        frame_size: 合成済みのフレームの (width, height)
+        fps: フレームレート
+        heights: 出力する高さのリスト（元の高さ以上のものは作らない）
+        thumbnail_interval: サムネイルの間隔（秒、None なら作らない）
+        encoder: "mp4v"（OpenCV）または "x264"（ffmpeg）
+        preset: x264のプリセット
+        crf: x264の品質
+        threads: ffmpegのスレッド数（解像度ごと）
+        audio_source: 音声をコピーする元の動画パス（x264のとき）
+        audio_range: 音声の (開始秒, 長さ秒)（FFmpegWriter と同じ）
+        buffer_frames: バッファのフレーム数
+    """
+
+    def __init__(
+        self,
+        output_path,
+        frame_size,
+        fps,
+        heights=(),
+        thumbnail_interval=None,
+        encoder="mp4v",
+        preset="medium",
+        crf=23,
+        threads=None,
+        audio_source=None,
+        buffer_frames=BUFFER_FRAMES,
+        audio_range=None,
+    ):
+        width, height = frame_size
+        self.slots = [
+            np.empty((height, width, 3), dtype=np.uint8) for _ in range(buffer_frames)
+        ]
+        self.free = queue.Queue()
+        for index in range(buffer_frames):
+            self.free.put(index)
+        self.users = [0] * buffer_frames  # スロットごとの使用中のスレッド数
+        self.lock = threading.Lock()
+        self.frame_index = 0
+        self.errors = []
+        self.paths = []
+
+        consumers = []
+        for target in sorted(set(heights), reverse=True):
+            if target >= height:
+                continue
+            size = rendition_size(width, height, target)
+            path = rendition_path(output_path, target)
+            if encoder == "x264":
+                writer = FFmpegWriter(
+                    path,
+                    *size,
+                    fps,
+                    preset,
+                    crf,
+                    threads,
+                    audio_source=audio_source,
+                    audio_range=audio_range,
+                )
+            else:
+                fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+                writer = cv2.VideoWriter(str(path), fourcc, fps, size)
+            self.paths.append(path)
+            consumers.append(partial(self._encode, writer, size))
+
+        if thumbnail_interval is not None:
+            every = max(1, round(thumbnail_interval * (fps if fps > 0 else 30.0)))
+            directory = thumbnail_dir(output_path)
+            directory.mkdir(parents=True, exist_ok=True)
+            self.paths.append(directory)
+            consumers.append(partial(self._thumbnail, directory, every))
+
+        self.queues = []
+        self.threads = []
+        for target in consumers:
+            tasks = queue.Queue()
+            thread = threading.Thread(target=target, args=(tasks,), daemon=True)
+            thread.start()
+            self.queues.append(tasks)
+            self.threads.append(thread)
+
+    def _release(self, slot):
+        """スロットを使い終わった（全員が使い終わったら空きに戻す）"""
+        with self.lock:
+            self.users[slot] -= 1
+            if self.users[slot] == 0:
+                self.free.put(slot)
+
+    def _encode(self, writer, size, tasks):
+        """解像度ごとのスレッド: 縮小してエンコード"""
+        scaled = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        slot = None
+        try:
+            if not writer.isOpened():
+                raise RuntimeError("出力ファイルが作成できません")
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                slot, _ = task
+                cv2.resize(
+                    self.slots[slot], size, dst=scaled, interpolation=cv2.INTER_AREA
+                )
+                self._release(slot)
+                slot = None
+                writer.write(scaled)
+        except Exception as e:
+            self.errors.append(e)
+            if slot is not None:
+                self._release(slot)
+            self._drain(tasks)
+        finally:
+            if isinstance(writer, FFmpegWriter):
+                if not writer.release() and not self.errors:
+                    self.errors.append(
+                        RuntimeError(writer.error.decode(errors="replace"))
+                    )
+            else:
+                writer.release()
+
+    def _thumbnail(self, directory, every, tasks):
+        """サムネイルのスレッド: every フレームごとに JPEG で保存"""
+        params = [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY]
+        slot = None
+        try:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                slot, index = task
+                if index % every == 0:
+                    path = directory / f"{index:06d}.jpg"
+                    if not cv2.imwrite(str(path), self.slots[slot], params):
+                        raise RuntimeError(f"サムネイルを保存できません: {path}")
+                self._release(slot)
+                slot = None
+        except Exception as e:
+            self.errors.append(e)
+            if slot is not None:
+                self._release(slot)
+            self._drain(tasks)
+
+    def _drain(self, tasks):
+        """エラー後も合成側が止まらないよう、残りのフレームを受け取って捨てる"""
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            self._release(task[0])
+
+    def write(self, frame):
+        """合成済みのフレームを渡す（バッファに空きがなければ待つ）"""
+        if not self.queues:
+            return
+        slot = self.free.get()
+        np.copyto(self.slots[slot], frame)
+        self.users[slot] = len(self.queues)
+        for tasks in self.queues:
+            tasks.put((slot, self.frame_index))
+        self.frame_index += 1
+
+    def close(self):
+        """
+        残りのフレームを書き出して終了
+
+        Returns:
+            bool: 全ての出力に成功したらTrue（エラー内容は self.errors）
+        """
+        for tasks in self.queues:
+            tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.queues = []
+        return not self.errors
+
@@ -13,6 +13,12 @@
     # パラメータを調整して実行
     uv run python run.py --lower 30 60 60 --upper 90 255 255
 
+    # 監視モード（green/に追加された動画を順次処理）
+    uv run python run.py --bg 1 --watch
+
+    # 3本を同時に動かす場合（スレッド数をコア数/3に抑える）
+    uv run python run.py --bg 1 --jobs 3
+
 ディレクトリ構造:
     bg/          背景画像（2枚まで対応）
     green/       グリーンバック動画
@@ -20,12 +26,84 @@
 """
 
 import argparse
+import multiprocessing
+import os
+import shutil
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
 from pathlib import Path
 
 import cv2
 import numpy as np
 
+import fused
+import metrics
+from assets import AssetCache, file_digest
+from autotune import (
+    DEFAULT_SIZE,
+    add_autotune_arguments,
+    describe_run,
+    limit_threads,
+    load_profile,
+)
+from cost_model import (
+    calibrate,
+    order_longest_first,
+    predict_total_seconds,
+    probe_video_file,
+    probe_videos,
+)
+from concurrency import add_thread_arguments, apply_thread_plan, describe, plan_threads
+from dedup import FrameDeduplicator
+from frame_range import format_position, frame_range, parse_position, seek
+from encoding import (
+    X264_PRESETS,
+    FFmpegWriter,
+    PresetTuner,
+    measure_encode_speed,
+    parse_speed_target,
+    read_first_frames,
+    record_encoding,
+)
+from image_sequence import DEFAULT_SEQUENCE_FPS, SequenceWriter, open_video
+from keyers import KEYERS, is_soft_keyer, make_keyer, ycbcr_table
+from media_files import (
+    add_base_dir_argument,
+    get_background_images,
+    get_video_files,
+    is_video_background,
+    sequence_files,
+)
+from memory import (
+    DEFAULT_BUFFER_FRAMES,
+    DEFAULT_CACHE_ENTRIES,
+    format_size,
+    parse_memory_size,
+    peak_rss,
+    plan_memory,
+    reset_peak_rss,
+)
+from pipeline import (
+    BlendStage,
+    BrightnessStage,
+    CompositorStage,
+    FrameSource,
+    KeyStage,
+    Pipeline,
+    ScaleStage,
+    StaticBackground,
+    TrackStage,
+    adjust_brightness,
+    layout_rect,
+    scale_region,
+)
+from renditions import RenditionLadder, parse_rendition
+from strips import StripCompositor, blend_person
+from tracking import SubjectTracker
+from video_background import VideoBackground
+
 
 def get_script_dir():
     """スクリプトのディレクトリを取得"""
@@ -67,7 +145,7 @@ def setup_directories(base_dir):
 
         print("\n次の手順を実行してください：")
         if "bg" in missing_dirs:
-            print(f"  1. bg/ フォルダに背景画像（PNG/JPG）を配置")
+            print(f"  1. bg/ フォルダに背景画像（PNG/JPG）または背景動画を配置")
         if "green" in missing_dirs:
             print(f"  2. green/ フォルダにグリーンバック動画を配置")
         print(f"  3. このスクリプトを再実行")
@@ -77,22 +155,6 @@ def setup_directories(base_dir):
     return bg_dir, green_dir, output_dir, True
 
 
-def get_background_images(bg_dir):
-    """
-    bg/フォルダから背景画像を取得
-
-    Returns:
-        list: 背景画像のパスリスト
-    """
-    extensions = ["*.png", "*.jpg", "*.jpeg", "*.PNG", "*.JPG", "*.JPEG"]
-    bg_images = []
-
-    for ext in extensions:
-        bg_images.extend(bg_dir.glob(ext))
-
-    return sorted(bg_images)
-
-
 def select_background(bg_images, bg_index=None):
     """
     背景画像を選択
@@ -106,7 +168,7 @@ def select_background(bg_images, bg_index=None):
     """
     if not bg_images:
         print("エラー: bg/ フォルダに画像ファイルが見つかりません")
-        print("対応形式: PNG, JPG, JPEG")
+        print("対応形式: PNG, JPG, JPEG（動画背景: MP4, MOV, AVI, MKV）")
         sys.exit(1)
 
     if len(bg_images) == 1:
@@ -141,76 +203,444 @@ def select_background(bg_images, bg_index=None):
             sys.exit(0)
 
 
-def get_video_files(green_dir):
+def get_output_path(output_dir, video_file, sequence_output=False):
+    """
+    入力動画に対応する出力パスを取得
+
+    Args:
+        sequence_output: 連番PNGで出力する（出力先はフォルダ）
+
+    Returns:
+        Path: output/<動画名>_output.mp4（連番PNGなら output/<動画名>_output/）
+    """
+    if sequence_output:
+        return output_dir / (video_file.stem + "_output")
+    return output_dir / (video_file.stem + "_output.mp4")
+
+
+def partial_path(output_path):
+    """書き込み中の出力パス（最後まで書けたら output_path に置き換える）"""
+    return output_path.with_name(f"{output_path.stem}.partial{output_path.suffix}")
+
+
+def remove_output(path):
+    """出力（動画ファイル・連番PNGのフォルダ）があれば削除"""
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    elif path.exists():
+        path.unlink()
+
+
+def commit_output(partial, output_path):
+    """
+    書き終えた出力を output_path に置き換える
+
+    途中で失敗・中断した出力が入力より新しい完成品として残らないよう、
+    出力は partial_path() に書き、成功したときだけここで置き換える。
+    """
+    if partial.is_dir():
+        # フォルダは空でないと置き換えられないので、前回の出力を消しておく
+        remove_output(output_path)
+    os.replace(partial, output_path)
+
+
+def input_signature(video_file):
     """
-    green/フォルダから動画ファイルを取得
+    コピーが終わったかの判定に使う入力の状態
+
+    連番画像のフォルダは、中のフレームを書き込んでもフォルダ自体のサイズ・更新時刻が
+    変わらないので、フレーム数と最も新しいフレームのサイズ・更新時刻を使う。
 
     Returns:
-        list: 動画ファイルのパスリスト
+        tuple: 動画ファイルは (サイズ, 更新時刻)、
+               連番画像は (フレーム数, 最も新しいフレームのサイズ, 更新時刻)
+               （どちらも最後が更新時刻）
+
+    Raises:
+        FileNotFoundError: 調べている間に削除・移動された
     """
-    extensions = [
-        "*.mp4",
-        "*.mov",
-        "*.avi",
-        "*.mkv",
-        "*.MP4",
-        "*.MOV",
-        "*.AVI",
-        "*.MKV",
-    ]
-    video_files = []
+    if video_file.is_dir():
+        frames = [path.stat() for path in sequence_files(video_file)]
+        if not frames:
+            return (0, 0, 0.0)
+        newest = max(frames, key=lambda stat: stat.st_mtime)
+        return (len(frames), newest.st_size, newest.st_mtime)
+    stat = video_file.stat()
+    return (stat.st_size, stat.st_mtime)
 
-    for ext in extensions:
-        video_files.extend(green_dir.glob(ext))
 
-    return sorted(video_files)
+def is_up_to_date(video_file, output_path):
+    """
+    出力ファイルが入力（連番画像なら最も新しいフレーム）より新しければTrue（処理済み）
+    """
+    if not output_path.exists():
+        return False
+    return output_path.stat().st_mtime >= input_signature(video_file)[-1]
 
 
-def adjust_brightness(person_img, person_mask, bg_img, bg_mask):
+def watch_videos(
+    green_dir,
+    output_dir,
+    process,
+    poll_interval=2.0,
+    stable_time=5.0,
+    sequence_output=False,
+):
     """
-    人物の輝度を背景に合わせて調整
+    green/フォルダを監視し、コピーが完了した動画から順次処理する
+
+    ファイルサイズと更新時刻（連番画像はフレーム数と最も新しいフレームのサイズ・
+    更新時刻）が stable_time 秒間変化しなければコピー完了とみなして process を呼び出す。失敗した動画は、
+    ファイルが変わる（再コピーされる）まで再試行しない。
+    Ctrl+C で終了するまで監視を続ける。
 
     Args:
-        person_img: 人物画像（BGR）
-        person_mask: 人物のマスク
-        bg_img: 背景画像（BGR）
-        bg_mask: 背景のマスク
+        green_dir: 監視するフォルダ
+        output_dir: 出力先フォルダ
+        process: process(video_file, output_path) -> bool の処理関数
+        poll_interval: ポーリング間隔（秒）
+        stable_time: サイズが安定したとみなすまでの時間（秒）
+        sequence_output: 連番PNGで出力する
 
     Returns:
-        調整後の人物画像
+        tuple: (success_count, failed_count)
     """
-    # BGR → HSV変換
-    person_hsv = cv2.cvtColor(person_img, cv2.COLOR_BGR2HSV).astype(np.float32)
+    success_count = 0
+    failed_count = 0
+
+    # path -> (input_signature(), 最後に変化を検出した時刻)
+    pending = {}
+    # path -> 処理済みの input_signature()
+    done = {}
+    # path -> 失敗したときの input_signature()（ファイルが変わるまで再試行しない）
+    failed = {}
+
+    print(f"監視中: {green_dir}（Ctrl+Cで終了）")
+
+    try:
+        while True:
+            now = time.monotonic()
+            video_files = get_video_files(green_dir)
+
+            for video_file in video_files:
+                try:
+                    signature = input_signature(video_file)
+                except FileNotFoundError:
+                    # 監視中に削除・移動された
+                    pending.pop(video_file, None)
+                    continue
+                if signature in (done.get(video_file), failed.get(video_file)):
+                    continue
+
+                previous = pending.get(video_file)
+                if previous is None or previous[0] != signature:
+                    pending[video_file] = (signature, now)
+                    continue
+
+                if now - previous[1] < stable_time:
+                    continue
+
+                # サイズが安定したので処理開始
+                del pending[video_file]
+                failed.pop(video_file, None)
+
+                output_path = get_output_path(output_dir, video_file, sequence_output)
+                if is_up_to_date(video_file, output_path):
+                    done[video_file] = signature
+                    continue
+
+                if process(video_file, output_path):
+                    success_count += 1
+                    done[video_file] = signature
+                else:
+                    failed_count += 1
+                    failed[video_file] = signature
+
+            # 消えたファイルは状態から除外
+            existing = set(video_files)
+            for path in list(pending):
+                if path not in existing:
+                    del pending[path]
+            for states in (done, failed):
+                for path in list(states):
+                    if path not in existing:
+                        del states[path]
+
+            time.sleep(poll_interval)
+
+    except KeyboardInterrupt:
+        print("\n監視を終了しました")
+
+    return success_count, failed_count
+
+
+def compute_layout(width, height, scale, y_position):
+    """
+    人物の配置を計算
+
+    Returns:
+        tuple: (scaled_width, scaled_height, x_offset, y_offset)
+    """
+    # スケール後のサイズを計算
+    scaled_width = int(width * scale)
+    scaled_height = int(height * scale)
+
+    # 配置位置を計算（中央揃え、Y位置は指定値）
+    x_offset = (width - scaled_width) // 2
+    y_offset = int((height - scaled_height) * y_position)
+
+    return scaled_width, scaled_height, x_offset, y_offset
+
+
+def compute_bg_hsv_mean(bg_img, layout):
+    """
+    人物が配置される領域以外の背景の平均HSV値を計算
+
+    背景画像と配置だけで決まるので、動画ごとに1回計算すればよい。
+
+    Returns:
+        tuple: 平均HSV値
+    """
+    height, width = bg_img.shape[:2]
+    scaled_width, scaled_height, x_offset, y_offset = layout
+
+    # 背景のマスクを作成（人物が配置される領域以外）
+    bg_mask = np.ones((height, width), dtype=np.uint8) * 255
+    bg_mask[
+        y_offset : y_offset + scaled_height,
+        x_offset : x_offset + scaled_width,
+    ] = 0
+
     bg_hsv = cv2.cvtColor(bg_img, cv2.COLOR_BGR2HSV).astype(np.float32)
+    return cv2.mean(bg_hsv, mask=bg_mask)
+
+
+# 準備済み背景のキャッシュ（ディスクの保存先ごと、プロセス内で共有）
+_asset_caches = {}
+
+
+def get_asset_cache(cache_dir=None, maxsize=DEFAULT_CACHE_ENTRIES):
+    """保存先ディレクトリに対応するアセットキャッシュ（None ならメモリのみ）"""
+    if cache_dir not in _asset_caches:
+        _asset_caches[cache_dir] = AssetCache(maxsize, cache_dir)
+    cache = _asset_caches[cache_dir]
+    cache.maxsize = maxsize  # 次に追加したときに超えた分を捨てる
+    return cache
+
+
+def prepare_background(bg_image_path, width, height, layout, cache=None):
+    """
+    動画サイズにリサイズした背景画像と平均HSV値を準備（キャッシュあり）
+
+    画像ファイルの内容・解像度・人物の配置が同じなら、
+    読み込み・リサイズ・統計値の計算は1回だけ行う。
+
+    Args:
+        bg_image_path: 背景画像パス
+        width: 動画の幅
+        height: 動画の高さ
+        layout: compute_layout() の戻り値
+        cache: AssetCache（None ならメモリのみの既定のキャッシュ）
+
+    Returns:
+        tuple: (リサイズ済み背景画像, 平均HSV値)、画像が読めなければ (None, None)
+               背景画像は読み取り専用（書き換える場合はコピーする）
+    """
+    if cache is None:
+        cache = get_asset_cache()
 
-    # 人物領域と背景領域の平均HSV値を計算
-    person_mean = cv2.mean(person_img, mask=person_mask)[:3]
-    bg_mean = cv2.mean(bg_img, mask=bg_mask)[:3]
+    def create():
+        bg_img_origin = cv2.imread(str(bg_image_path))
+        if bg_img_origin is None:
+            raise ValueError(f"背景画像が開けません: {bg_image_path}")
+        bg_img = cv2.resize(bg_img_origin, (width, height))
+        return {
+            "image": bg_img,
+            "hsv_mean": np.array(compute_bg_hsv_mean(bg_img, layout)),
+        }
+
+    try:
+        key = ("background", file_digest(bg_image_path), width, height, tuple(layout))
+        asset = cache.get(key, create)
+    except (OSError, ValueError):
+        return None, None
+
+    return asset["image"], tuple(asset["hsv_mean"].tolist())
+
+
+def composite_frame(
+    frame, mask_inv, bg_img, layout, bg_hsv_mean=None, box=None, canvas=None, soft=False
+):
+    """
+    1フレーム分の人物を背景に合成
+
+    Args:
+        frame: 入力フレーム（BGR）
+        mask_inv: 人物部分が255のマスク
+        bg_img: 出力サイズにリサイズ済みの背景画像
+        layout: compute_layout() の戻り値
+        bg_hsv_mean: 背景の平均HSV値（指定時は輝度マッチングを行う）
+        box: 人物の矩形 (x0, y0, x1, y1)。指定時はこの範囲だけ合成する
+        canvas: 合成先の画像（省略時は背景画像のコピー）
+        soft: マスクを不透明度として扱いアルファブレンドする（半透明キーヤー用）
 
-    # HSVで平均を計算
-    person_hsv_mean = cv2.mean(person_hsv, mask=person_mask)
-    bg_hsv_mean = cv2.mean(bg_hsv, mask=bg_mask)
+    Returns:
+        tuple: (合成後のフレーム, 書き換えた領域 (y0, y1, x0, x1))
+    """
+    scaled_width, scaled_height, x_offset, y_offset = layout
 
-    # V（明度）の調整比率を計算
-    if person_hsv_mean[2] > 0:
-        brightness_ratio = bg_hsv_mean[2] / person_hsv_mean[2]
+    if canvas is None:
+        # 背景画像をコピー
+        canvas = bg_img.copy()
+
+    if box is None:
+        sx0, sy0, sx1, sy1 = 0, 0, scaled_width, scaled_height
+
+        # 人物部分を抽出
+        person = cv2.bitwise_and(frame, frame, mask=mask_inv)
+
+        # 人物をスケール
+        person_scaled = cv2.resize(person, (scaled_width, scaled_height))
+        mask_inv_scaled = cv2.resize(mask_inv, (scaled_width, scaled_height))
     else:
-        brightness_ratio = 1.0
+        # 人物の矩形の範囲だけ抽出・スケール
+        person_scaled, mask_inv_scaled, (sx0, sy0, sx1, sy1) = scale_region(
+            frame, mask_inv, box, (scaled_width, scaled_height)
+        )
+
+    rect = (y_offset + sy0, y_offset + sy1, x_offset + sx0, x_offset + sx1)
+    if person_scaled is None:
+        return canvas, rect
+
+    # 輝度マッチング
+    if bg_hsv_mean is not None:
+        person_scaled = adjust_brightness(
+            person_scaled, mask_inv_scaled, bg_img, None, bg_hsv_mean
+        )
+
+    # 人物を配置する領域を抽出して合成
+    roi = canvas[rect[0] : rect[1], rect[2] : rect[3]]
+    canvas[rect[0] : rect[1], rect[2] : rect[3]] = blend_person(
+        person_scaled, mask_inv_scaled, roi, soft
+    )
 
-    # 人物のV値を調整（0-255の範囲を維持）
-    person_hsv[:, :, 2] = np.clip(person_hsv[:, :, 2] * brightness_ratio, 0, 255)
+    return canvas, rect
+
+
+def make_compositor(
+    backend,
+    frame_size,
+    layout,
+    keyer,
+    lower_green,
+    upper_green,
+    similarity,
+    blend,
+    bg_hsv_mean,
+    soft,
+    threads=1,
+):
+    """
+    融合処理・帯単位の処理の合成器を作成
+
+    Args:
+        backend: 処理方式（"opencv"、"fused"、"strips"）
+        threads: 帯単位の処理のスレッド数
+
+    Returns:
+        FusedCompositor / StripCompositor（通常の処理、または Numba がなければ None）
+    """
+    if backend == "fused" and fused.FUSED_AVAILABLE:
+        return fused.FusedCompositor(
+            frame_size,
+            layout,
+            fused.KEY_HSV if keyer == "hsv" else fused.KEY_LUT,
+            lower_green,
+            upper_green,
+            ycbcr_table(similarity, blend) if keyer == "ycbcr" else None,
+            bg_hsv_mean,
+            soft,
+        )
+    if backend == "strips":
+        return StripCompositor(
+            frame_size,
+            layout,
+            make_keyer(keyer, lower_green, upper_green, similarity, blend),
+            bg_hsv_mean,
+            soft,
+            threads,
+        )
+    return None
+
+
+def make_pipeline(
+    frame_size,
+    layout,
+    keyer,
+    lower_green,
+    upper_green,
+    similarity,
+    blend,
+    mask_downscale,
+    bg_hsv_mean,
+    soft,
+    backend,
+    track_subject=False,
+    timer=None,
+    threads=None,
+):
+    """
+    合成処理のパイプラインを組み立てる（composite_shared の子プロセスでも呼ぶ）
 
-    # S（彩度）も軽く調整（色温度のマッチング）
-    if person_hsv_mean[1] > 0:
-        saturation_ratio = bg_hsv_mean[1] / person_hsv_mean[1]
-        # 彩度は控えめに調整（0.7倍の影響）
-        saturation_ratio = 1.0 + (saturation_ratio - 1.0) * 0.3
-        person_hsv[:, :, 1] = np.clip(person_hsv[:, :, 1] * saturation_ratio, 0, 255)
+    緑色検出 → 人物の抽出・スケール（または矩形追跡）→ 輝度調整 → 合成 の段を並べ、
+    backend が "fused" / "strips" なら4つの段を1つの合成器の段に融合する。
 
-    # HSV → BGR変換
-    adjusted = cv2.cvtColor(person_hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
+    Args:
+        backend: 処理方式（"opencv"、"fused"、"strips"）
+        track_subject: 人物の矩形を追跡し、その範囲だけ合成する（opencv のみ）
+        timer: metrics.StageTimer
+        threads: 帯単位の処理のスレッド数（None なら現在の OpenCV のスレッド数）
 
-    return adjusted
+    Returns:
+        pipeline.Pipeline
+    """
+    key = make_keyer(keyer, lower_green, upper_green, similarity, blend, mask_downscale)
+    if track_subject:
+        transform = TrackStage(layout, SubjectTracker(*frame_size))
+    else:
+        transform = ScaleStage(layout)
+    stages = [KeyStage(key), transform, BrightnessStage(), BlendStage(soft)]
+
+    def compositor_stage(_):
+        compositor = make_compositor(
+            backend,
+            frame_size,
+            layout,
+            keyer,
+            lower_green,
+            upper_green,
+            similarity,
+            blend,
+            bg_hsv_mean,
+            soft,
+            threads or cv2.getNumThreads(),
+        )
+        if compositor is None:
+            return None
+        return CompositorStage(compositor, layout, backend)
+
+    fusions = [(("key", "transform", "brightness", "composite"), compositor_stage)]
+    return Pipeline(stages, fusions, timer)
+
+
+def print_progress(frame_count, total_frames):
+    """進捗表示（10フレームごと）"""
+    if frame_count % 10 == 0 or frame_count == 1:
+        progress = (frame_count / total_frames) * 100 if total_frames > 0 else 0.0
+        print(
+            f"  Progress: {frame_count}/{total_frames} frames ({progress:.1f}%)",
+            end="\r",
+        )
 
 
 def change_background(
@@ -222,147 +652,678 @@ def change_background(
     scale=0.7,
     y_position=0.2,
     brightness_match=True,
+    mask_downscale=1,
+    track_subject=False,
+    keyer="hsv",
+    similarity=0.3,
+    blend=0.1,
+    backend="opencv",
+    asset_cache_dir=None,
+    encoder="mp4v",
+    preset="medium",
+    crf=23,
+    dedup_tolerance=0,
+    bg_buffer_frames=DEFAULT_BUFFER_FRAMES,
+    asset_cache_size=DEFAULT_CACHE_ENTRIES,
+    keep_audio=False,
+    frame_processes=1,
+    renditions=(),
+    thumbnail_interval=None,
+    sequence_fps=DEFAULT_SEQUENCE_FPS,
+    start=None,
+    end=None,
+    threads=None,
+    stats=None,
 ):
     """
     グリーンバック動画の背景を画像に置き換える
 
     Args:
-        video_path: 入力動画パス
-        bg_image_path: 背景画像パス
-        output_path: 出力動画パス
+        video_path: 入力動画パス（連番画像のフォルダも可）
+        bg_image_path: 背景画像パス（動画ならループ再生する）
+        output_path: 出力動画パス（encoder="png" なら出力先フォルダ）
         lower_green: 緑色検出の下限値 (H, S, V)
         upper_green: 緑色検出の上限値 (H, S, V)
         scale: 人物のサイズ倍率（デフォルト0.7）
         y_position: 人物の縦位置（0.0=上端, 1.0=下端, デフォルト0.2）
         brightness_match: 輝度マッチングを有効化（デフォルトTrue）
+        mask_downscale: マスクを推定する縮小率（1=全解像度, 4, 8）
+        track_subject: 人物の矩形を追跡し、その範囲だけ合成する
+        keyer: 緑色検出の方式（"hsv" または "ycbcr"）
+        similarity: YCbCrキーヤーの類似度（0.0-1.0）
+        blend: YCbCrキーヤーのエッジのブレンド量（0.0-1.0）
+        backend: 処理方式（"opencv"、"fused": Numba で1パスに融合した処理、
+                 "strips": キャッシュに収まる帯に分けて並列に処理）
+        asset_cache_dir: 準備済み背景をディスクに保存するディレクトリ（None ならメモリのみ）
+        encoder: 出力のエンコーダ（"mp4v": OpenCV、"x264": ffmpeg の libx264、
+                 "png": 連番PNG）
+        preset: x264のプリセット（encoder="x264" のとき）
+        crf: x264の品質（encoder="x264" のとき、18-28推奨、低いほど高品質）
+        dedup_tolerance: 前のフレームとの差がこれ以下なら前の合成結果を再利用
+                         （0 = 完全一致のみ、None = 再利用しない）
+        bg_buffer_frames: 動画背景の先読みフレーム数
+        asset_cache_size: メモリに保持する準備済み背景の数
+        keep_audio: 元の動画の音声をコピーして出力に入れる（x264で出力する）
+        frame_processes: 1本の動画を合成するプロセス数（2以上で共有メモリの
+                         フレームリングを使う。動画背景・人物矩形追跡では無効）
+        renditions: 合わせて出力する解像度違いの版の高さのリスト（例: [720, 480]）
+        thumbnail_interval: サムネイル（JPEG）を保存する間隔（秒、None なら保存しない）
+        sequence_fps: 入力が連番画像の場合のフレームレート
+        start: 処理を始める位置（frame_range.parse_position() の戻り値、None なら先頭）
+        end: 処理を終える位置（含まない、None なら最後まで）
+        threads: この動画に使うスレッド数（ThreadPlan のスレッド数、None なら
+                 現在の OpenCV のスレッド数）。デコーダ・エンコーダ・書き出し・
+                 合成のスレッドをこの数に合わせる
+        stats: 指定すると処理したフレーム数（"frames"）、再利用したフレーム数
+               （"reused"）、出力したバイト数（"bytes"）、--frame-processes の
+               子プロセスのピークRSSの合計（"child_peak_rss"）を書き込む辞書
 
     Returns:
         bool: 成功したらTrue
     """
+    source = None
+    background = None
+    pipeline = None
+    out = None
+    ladder = None
+    # 出力は書き込み中の名前に書き、成功したら output_path に置き換える
+    writing = partial_path(output_path)
+    threads = threads or cv2.getNumThreads()
+    # 帯単位の処理で変えた OpenCV のスレッド数（終わったら戻す）
+    cv_threads = None
+    # 段ごとの時間・フレーム数（--metrics-port / --metrics-file のとき）
+    timer = metrics.StageTimer()
     try:
         print(f"Processing: {video_path.name}")
 
-        cap = cv2.VideoCapture(str(video_path))
-        bg_img_origin = cv2.imread(str(bg_image_path))
+        # デコーダ（連番画像の先読み）のスレッド数も割り当てに合わせる
+        cap = open_video(video_path, sequence_fps, threads)
 
         if not cap.isOpened():
             print(f"  ✗ Error: 動画ファイルが開けません")
             return False
 
-        if bg_img_origin is None:
-            print(f"  ✗ Error: 背景画像が開けません")
-            return False
-
         # 動画情報取得
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         fps = cap.get(cv2.CAP_PROP_FPS)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
-        # 背景画像をリサイズ
-        bg_img = cv2.resize(bg_img_origin, (width, height))
-
-        # スケール後のサイズを計算
-        scaled_width = int(width * scale)
-        scaled_height = int(height * scale)
-
-        # 配置位置を計算（中央揃え、Y位置は指定値）
-        x_offset = (width - scaled_width) // 2
-        y_offset = int((height - scaled_height) * y_position)
-
-        # 出力設定
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-        out = cv2.VideoWriter(str(output_path), fourcc, fps, (width, height))
+        # 範囲指定: 開始位置まで入力側でシークし、終了位置でデコードをやめる
+        first, stop = frame_range(start, end, fps, total_frames)
+        if not seek(cap, first):
+            print(f"  ✗ Error: 開始位置（{first}フレーム目）まで移動できません")
+            cap.release()
+            return False
+        limit = stop - first if stop is not None else None
+        if total_frames > 0:
+            total_frames = (stop or total_frames) - first
+        source = FrameSource(cap, limit)
+        # 音声も同じ範囲だけコピーする
+        audio_range = None
+        if (start is not None or end is not None) and fps > 0:
+            audio_range = (first / fps, limit / fps if limit is not None else None)
+
+        # 人物の配置を計算
+        layout = compute_layout(width, height, scale, y_position)
+
+        if is_video_background(bg_image_path):
+            # 動画背景: 別スレッドでデコード・リサイズ・平均値の計算を先読みする
+            bg_stats = partial(compute_bg_hsv_mean, layout=layout)
+            background = VideoBackground(
+                bg_image_path,
+                width,
+                height,
+                fps,
+                bg_stats if brightness_match else None,
+                bg_buffer_frames,
+            )
+        else:
+            # リサイズ済みの背景画像と輝度マッチング用の平均値（同じ組み合わせは1回だけ準備）
+            bg_img, bg_hsv_mean = prepare_background(
+                bg_image_path,
+                width,
+                height,
+                layout,
+                get_asset_cache(asset_cache_dir, asset_cache_size),
+            )
+
+            if bg_img is None:
+                print(f"  ✗ Error: 背景画像が開けません")
+                cap.release()
+                return False
+
+            if not brightness_match:
+                bg_hsv_mean = None
+            background = StaticBackground(bg_img, bg_hsv_mean)
+
+        # 融合処理（Numba がなければ通常の処理）・帯単位の処理
+        if backend == "fused" and not fused.FUSED_AVAILABLE:
+            print("  ! Numba がインストールされていないため通常の処理を使います")
+        elif backend != "opencv" and (track_subject or mask_downscale > 1):
+            print(f"  ! {backend} では --track-subject / --mask-downscale は無効です")
+
+        # 複数プロセスで合成（動画背景はフレームごとに背景が変わるので使わない）
+        shared = frame_processes > 1 and not background.varying
+        if frame_processes > 1 and background.varying:
+            print("  ! 動画背景では --frame-processes は無効です")
+        # 合成するプロセス1つあたりのスレッド数と、その中の OpenCV / Numba のスレッド数
+        # （帯単位の処理は帯をスレッドで並列に処理するので、OpenCV の内部のスレッドは
+        # 1つにする。帯のスレッドの中でさらにスレッドを使うとコアを取り合う）
+        compositor_threads = max(1, threads // frame_processes) if shared else threads
+        process_threads = 1 if backend == "strips" else compositor_threads
+
+        # 緑色検出〜合成の段（子プロセスでも同じものを組み立てられるよう partial にする）
+        make = partial(
+            make_pipeline,
+            (width, height),
+            layout,
+            keyer,
+            lower_green,
+            upper_green,
+            similarity,
+            blend,
+            mask_downscale,
+            background.next()[1] if not background.varying else None,
+            is_soft_keyer(keyer, blend),
+            backend,
+            threads=compositor_threads,
+        )
+
+        if shared:
+            if track_subject and backend == "opencv":
+                print("  ! --frame-processes では --track-subject は無効です")
+            pipeline = Pipeline(timer=timer)
+        else:
+            # 1つのプロセスで合成（--track-subject では人物の矩形の範囲だけ合成する）
+            if process_threads != cv2.getNumThreads():
+                cv_threads = cv2.getNumThreads()
+                cv2.setNumThreads(process_threads)
+            pipeline = make(track_subject, timer)
+
+        # 静止したフレームは前の合成結果を再利用（動画背景ではフレームごとに背景が変わるので無効）
+        dedup = None
+        if dedup_tolerance is not None and not background.varying:
+            dedup = FrameDeduplicator(dedup_tolerance)
+
+        # 出力設定（音声は映像と同じ ffmpeg でコピーする）
+        if keep_audio and video_path.is_dir():
+            print("  ! 連番画像には音声がないため --keep-audio は無効です")
+            keep_audio = False
+        if keep_audio:
+            encoder = "x264"
+        # 前回中断した出力（連番PNGなら古いフレーム）が残っていれば消す
+        remove_output(writing)
+        if encoder == "png":
+            # 連番PNG（エンコード・保存は別スレッドで並列）
+            out = SequenceWriter(writing, threads)
+        elif encoder == "x264":
+            out = FFmpegWriter(
+                writing,
+                width,
+                height,
+                fps,
+                preset,
+                crf,
+                threads,
+                audio_source=video_path if keep_audio else None,
+                audio_range=audio_range,
+            )
+        else:
+            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+            out = cv2.VideoWriter(str(writing), fourcc, fps, (width, height))
 
         if not out.isOpened():
             print(f"  ✗ Error: 出力ファイルが作成できません")
-            cap.release()
+            source.release()
+            background.close()
+            pipeline.close()
+            remove_output(writing)
             return False
 
+        # 解像度違いの版・サムネイル（合成済みのフレームを別スレッドで縮小・エンコード）
+        if renditions or thumbnail_interval is not None:
+            ladder = RenditionLadder(
+                output_path,
+                (width, height),
+                fps,
+                renditions,
+                thumbnail_interval,
+                encoder,
+                preset,
+                crf,
+                threads,
+                video_path if keep_audio else None,
+                audio_range=audio_range,
+            )
+
+        sinks = [out] if ladder is None else [out, ladder]
+        if background.varying:
+            timer.watch("background_prefetch", background.filled.qsize)
+        if ladder is not None:
+            timer.watch(
+                "renditions", lambda: len(ladder.slots) - ladder.free.qsize()
+            )
+
         # フレーム処理
-        frame_count = 0
-        lower_green_array = np.array(lower_green)
-        upper_green_array = np.array(upper_green)
+        progress = partial(print_progress, total_frames=total_frames)
+        if shared:
+            # 共有メモリのスロットに直接デコードし、スロット番号だけを子プロセスに渡す
+            frame_count = pipeline.run_shared(
+                make,
+                source,
+                background,
+                sinks,
+                frame_processes,
+                layout_rect(layout),
+                process_threads,
+                dedup,
+                progress,
+            )
+        else:
+            frame_count = pipeline.run(source, background, sinks, dedup, progress)
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            frame_count += 1
-
-            # 進捗表示
-            if frame_count % 10 == 0 or frame_count == 1:
-                progress = (frame_count / total_frames) * 100
-                print(
-                    f"  Progress: {frame_count}/{total_frames} frames ({progress:.1f}%)",
-                    end="\r",
-                )
+        source.release()
+        background.close()
+        pipeline.close()
 
-            # HSV変換
-            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        timer.flush()
 
-            # 緑色検出マスク
-            mask = cv2.inRange(hsv, lower_green_array, upper_green_array)
-            mask_inv = cv2.bitwise_not(mask)
+        released, out = out, None
+        if encoder in ("x264", "png"):
+            if not released.release():
+                print(f"\n  ✗ Error: エンコードに失敗しました")
+                print(released.error.decode(errors="replace"))
+                remove_output(writing)
+                return False
+        else:
+            released.release()
 
-            # 人物部分を抽出
-            person = cv2.bitwise_and(frame, frame, mask=mask_inv)
+        if ladder is not None and not ladder.close():
+            print(f"\n  ✗ Error: 解像度違いの版・サムネイルの出力に失敗しました")
+            for error in ladder.errors:
+                print(f"    {error}")
+            remove_output(writing)
+            return False
+        commit_output(writing, output_path)
+
+        # 書き出しの終了待ち（エンコーダ・連番PNG・解像度違いの版の残り）
+        timer.lap("write")
+        timer.flush()
+
+        reused = dedup.reused if dedup is not None else 0
+        if stats is not None:
+            stats["frames"] = frame_count
+            stats["reused"] = reused
+            outputs = [output_path, *(ladder.paths if ladder is not None else [])]
+            stats["bytes"] = sum(metrics.path_bytes(path) for path in outputs)
+            stats["child_peak_rss"] = sum(pipeline.child_peaks)
+
+        if reused:
+            print(
+                f"\n  ✓ Completed: {output_path.name}"
+                f"（静止フレームの再利用: {reused}/{frame_count}）"
+            )
+        else:
+            print(f"\n  ✓ Completed: {output_path.name}")
+        if ladder is not None and ladder.paths:
+            print(f"    + {', '.join(path.name for path in ladder.paths)}")
+        return True
 
-            # 人物をスケール
-            person_scaled = cv2.resize(person, (scaled_width, scaled_height))
-            mask_inv_scaled = cv2.resize(mask_inv, (scaled_width, scaled_height))
+    except Exception as e:
+        print(f"\n  ✗ Error: {e}")
+        timer.flush()
+        if source is not None:
+            source.release()
+        if background is not None:
+            background.close()
+        if pipeline is not None:
+            pipeline.close()
+        if ladder is not None:
+            ladder.close()
+        # 途中までの出力は残さない（次の実行で処理済みと判定されないように）
+        if out is not None:
+            out.release()
+        remove_output(writing)
+        return False
 
-            # 輝度マッチング
-            if brightness_match:
-                # 背景のマスクを作成（人物が配置される領域以外）
-                bg_mask = np.ones((height, width), dtype=np.uint8) * 255
-                bg_mask[
-                    y_offset : y_offset + scaled_height,
-                    x_offset : x_offset + scaled_width,
-                ] = 0
+    finally:
+        if cv_threads is not None:
+            cv2.setNumThreads(cv_threads)
 
-                person_scaled = adjust_brightness(
-                    person_scaled, mask_inv_scaled, bg_img, bg_mask
-                )
 
-            # 背景画像をコピー
-            final_frame = bg_img.copy()
+def process_video(video_path, bg_image_path, output_path, **options):
+    """
+    change_background を実行して統計も返す（プロセスプールのワーカーからも呼ぶ）
 
-            # 人物を配置する領域を抽出
-            roi = final_frame[
-                y_offset : y_offset + scaled_height, x_offset : x_offset + scaled_width
-            ]
+    Returns:
+        tuple: (成否, {"frames": フレーム数, "reused": 再利用したフレーム数,
+                       "bytes": 出力したバイト数（解像度違いの版・サムネイルを含む）,
+                       "peak_rss": この動画の処理中のピークRSS（バイト、--frame-processes の
+                                   子プロセスを含む、不明なら None）})
+    """
+    # ワーカーは複数の動画を処理するので、動画ごとのピークを測れるよう戻す
+    reset_peak_rss()
+    stats = {"frames": 0, "reused": 0, "bytes": 0}
+    start = time.perf_counter()
+    success = change_background(
+        video_path, bg_image_path, output_path, stats=stats, **options
+    )
+    stats["peak_rss"] = peak_rss()
+    if stats["peak_rss"] is not None:
+        # --frame-processes の子プロセスの分も足す（共有メモリは重複して数えるので多め）
+        stats["peak_rss"] += stats.get("child_peak_rss", 0)
+        print(f"  ピークメモリ: {format_size(stats['peak_rss'])}（{video_path.name}）")
+
+    metrics.observe("greenback_video_seconds", time.perf_counter() - start)
+    metrics.inc("greenback_videos_total", result="success" if success else "failure")
+    if success:
+        metrics.inc("greenback_output_bytes_total", stats["bytes"])
+    else:
+        metrics.inc("greenback_failures_total", stage="process")
+    metrics.flush()
+    return success, stats
 
-            # マスクを3チャンネルに変換
-            mask_inv_scaled_3ch = cv2.cvtColor(mask_inv_scaled, cv2.COLOR_GRAY2BGR)
 
-            # 人物部分を合成（アルファブレンディング風に）
-            # マスクで人物以外を黒くする
-            person_area = cv2.bitwise_and(person_scaled, mask_inv_scaled_3ch)
+def schedule_videos(video_files, args, plan):
+    """
+    動画を調べて処理時間を見積もり、長い順に並べ替える
 
-            # ROIから人物領域を除去
-            mask_scaled = cv2.bitwise_not(mask_inv_scaled)
-            mask_scaled_3ch = cv2.cvtColor(mask_scaled, cv2.COLOR_GRAY2BGR)
-            bg_area = cv2.bitwise_and(roi, mask_scaled_3ch)
+    このマシンでの処理速度は、最も解像度の大きい動画の先頭数フレームを
+    同じキーヤー・配置の設定で処理して計測する（エンコードの時間は含まない目安）。
 
-            # 合成
-            combined = cv2.add(person_area, bg_area)
-            final_frame[
-                y_offset : y_offset + scaled_height, x_offset : x_offset + scaled_width
-            ] = combined
+    Args:
+        video_files: 動画ファイルのリスト
+        args: コマンドライン引数（キーヤー・配置の設定）
+        plan: スレッド数の割り当て（動画を調べる並列数と、全体の時間の予測に使う）
 
-            out.write(final_frame)
+    Returns:
+        tuple: (処理する動画の VideoInfo のリスト, 読めなかった動画の数,
+                1画素あたりの処理時間（計測できなければ None）)
+    """
+    print("動画を確認中...")
+    # このインスタンスに割り当てたコア数（--jobs / --cores）の分だけ並列に調べる
+    infos, errors = probe_videos(
+        video_files, workers=plan.workers * plan.threads, sequence_fps=args.sequence_fps
+    )
 
-        cap.release()
-        out.release()
+    # --start / --end: 範囲のフレーム数で見積もる（範囲が動画の外ならここで失敗とする）
+    if args.start is not None or args.end is not None:
+        clipped = []
+        for info in infos:
+            try:
+                first, stop = frame_range(args.start, args.end, info.fps, info.frames)
+            except ValueError as e:
+                errors.append((info.path, e))
+                continue
+            # フレーム数が不明（0）で終了位置もなければ不明のまま
+            clipped.append(info._replace(frames=max(0, (stop or info.frames) - first)))
+        infos = clipped
+
+    for video_file, error in errors:
+        print(f"  ✗ {video_file.name}: {error}")
+
+    if not infos:
+        return [], len(errors), None
+
+    # 最も大きい動画で1画素あたりの処理時間を計測
+    largest = max(infos, key=lambda info: info.width * info.height)
+    layout = compute_layout(largest.width, largest.height, args.scale, args.y_position)
+    bg_img = np.full((largest.height, largest.width, 3), 128, dtype=np.uint8)
+    bg_hsv_mean = None if args.no_brightness_match else compute_bg_hsv_mean(bg_img, layout)
+    key = make_keyer(
+        args.keyer,
+        tuple(args.lower),
+        tuple(args.upper),
+        args.similarity,
+        args.blend,
+        args.mask_downscale,
+    )
+    soft = is_soft_keyer(args.keyer, args.blend)
+
+    def step(frame):
+        mask_inv = cv2.bitwise_not(key(frame))
+        composite_frame(frame, mask_inv, bg_img, layout, bg_hsv_mean, soft=soft)
+
+    seconds_per_pixel = calibrate(largest, step)
+    if seconds_per_pixel is None:
+        # 計測できなければ画素数の順にだけ並べる
+        return order_longest_first(infos, 1.0), len(errors), None
+
+    infos = order_longest_first(infos, seconds_per_pixel)
+    total = predict_total_seconds(infos, seconds_per_pixel, plan.workers)
+    frame_ms = seconds_per_pixel * largest.width * largest.height * 1000
+    total_text = f"{total / 60:.1f}分" if total >= 60 else f"{total:.0f}秒"
+    print(
+        f"予測処理時間: 約{total_text}"
+        f"（{len(infos)}本、{largest.width}x{largest.height}で {frame_ms:.1f}ms/frame）"
+    )
+    return infos, len(errors), seconds_per_pixel
 
-        print(f"\n  ✓ Completed: {output_path.name}")
-        return True
 
-    except Exception as e:
-        print(f"\n  ✗ Error: {e}")
-        return False
+def apply_autotune(profile, args, settings, plan, width, height):
+    """
+    autotune のプロファイルで、解像度が最も近い計測結果の最も速い設定を使う
+
+    処理方式・マスク推定・人物矩形追跡・合成プロセス数を args と settings に設定し、
+    --cores を指定しなければスレッド数を計測で最も速かった数に抑える。
+    合成プロセス数は1本ずつ処理する場合（--workers 1）だけ使う。
+
+    Args:
+        profile: autotune.load_profile() の戻り値
+        args: コマンドライン引数
+        settings: process_video() に渡す設定
+        plan: スレッド数の割り当て
+        width: 動画の幅
+        height: 動画の高さ
+
+    Returns:
+        ThreadPlan: スレッド数の割り当て
+    """
+    size, tuned = profile.lookup("run", width, height)
+    if tuned is None:
+        return plan
+    if args.cores is None:
+        plan = limit_threads(plan, tuned)
+        apply_thread_plan(plan)
+    args.backend = tuned["backend"]
+    args.mask_downscale = tuned["mask_downscale"]
+    args.track_subject = tuned["track_subject"]
+    args.frame_processes = (
+        min(tuned["frame_processes"], plan.threads) if plan.workers == 1 else 1
+    )
+    for name in ("backend", "mask_downscale", "track_subject", "frame_processes"):
+        settings[name] = getattr(args, name)
+    print(f"autotune（{size} の計測結果）: {describe_run(tuned)} → {describe(plan)}")
+    return plan
+
+
+def apply_memory_limit(args, settings, plan, width, height):
+    """
+    メモリ上限（--max-memory）に収まるワーカー数・先読み・キャッシュの数を決める
+
+    合成プロセス（--frame-processes）・解像度違いの版・サムネイル・融合処理の分も
+    見積もりに含める。
+
+    Args:
+        args: コマンドライン引数
+        settings: process_video() に渡す設定（先読み・キャッシュの数を設定する）
+        plan: スレッド数の割り当て
+        width: 処理する動画のうち最大の幅
+        height: 処理する動画のうち最大の高さ
+
+    Returns:
+        ThreadPlan: ワーカー数を減らした場合は割り当て直したもの
+    """
+    memory = plan_memory(
+        args.max_memory,
+        width,
+        height,
+        plan.workers,
+        settings["frame_processes"],
+        args.renditions,
+        args.thumbnail_interval is not None,
+        settings["backend"] == "fused" and fused.FUSED_AVAILABLE,
+    )
+    if memory.workers != plan.workers:
+        # autotune でスレッド数を抑えていれば、割り当て直しても超えないようにする
+        planned = plan_threads(args.jobs, plan.workers, args.cores)
+        capped = plan.threads < planned.threads
+        replanned = plan_threads(args.jobs, memory.workers, args.cores)
+        if capped:
+            replanned = replanned._replace(threads=min(replanned.threads, plan.threads))
+        plan = replanned
+        apply_thread_plan(plan)
+    settings["bg_buffer_frames"] = memory.buffer_frames
+    settings["asset_cache_size"] = memory.cache_entries
+    print(
+        f"メモリ上限: {format_size(memory.max_bytes)}"
+        f"（1本あたり約 {format_size(memory.job_bytes)}、"
+        f"{width}x{height}）→ {describe(plan)}、"
+        f"背景の先読み {memory.buffer_frames}フレーム"
+    )
+    if memory.job_bytes > memory.max_bytes:
+        print("  ! 1本ずつ処理しても上限を超える見込みです")
+    return plan
+
+
+def calibrate_preset(tuner, info, seconds_per_pixel, crf=23, threads=None, seconds=3):
+    """
+    最初の動画の先頭 seconds 秒で、速度目標を満たすx264プリセットを選ぶ
+
+    デコード〜合成の速度（schedule_videos の計測）と、各プリセットでの
+    エンコードの速度を計り、遅い方を全体の速度とみなす。
+    """
+    fps = info.fps if info.fps > 0 else 30.0
+    frames = read_first_frames(info.path, max(1, int(fps * seconds)))
+    if not frames:
+        return
+
+    stage_speed = None
+    if seconds_per_pixel:
+        stage_speed = 1.0 / (seconds_per_pixel * info.width * info.height * fps)
+
+    try:
+        results = tuner.calibrate(
+            lambda preset: measure_encode_speed(frames, fps, preset, crf, threads),
+            stage_speed,
+        )
+    except RuntimeError as e:
+        print(f"  ! プリセットの計測に失敗しました（{tuner.preset} を使います）: {e}")
+        return
+
+    measured = ", ".join(f"{preset} {speed:.2f}x" for preset, speed in results.items())
+    print(f"プリセット計測: {measured}")
+    if stage_speed is not None and stage_speed < tuner.target:
+        print(
+            f"  ! デコード〜合成だけで {stage_speed:.2f}x のため、"
+            f"目標 {tuner.target}x には届きません"
+        )
+    print(f"x264プリセット: {tuner.preset}（目標 {tuner.target}x）")
+
+
+def init_worker(plan, metrics_queue=None):
+    """プロセスプールのワーカーの初期化（スレッド数とメトリクスの送り先）"""
+    apply_thread_plan(plan)
+    metrics.connect(metrics_queue)
+
+
+def run_batch(
+    infos, bg_image, output_dir, settings, plan, tuner=None, metrics_queue=None
+):
+    """
+    動画を順に（plan.workers > 1 なら並列に）処理
+
+    tuner を指定すると、動画ごとに実際の処理速度でx264プリセットを調整する。
+    x264で出力した場合は、動画ごとのエンコード設定を output/encoding_log.csv に記録する。
+    metrics_queue（metrics.Exporter.queue）を指定すると、ワーカーのメトリクスを親に集める。
+
+    Returns:
+        list: 動画ごとの (成否, 統計)（process_video の戻り値）
+    """
+    log_path = output_dir / "encoding_log.csv"
+
+    def finish(info, options, elapsed, result):
+        success, _ = result
+        # 実際の速度（動画の長さ / 処理時間）
+        duration = info.frames / info.fps if info.fps > 0 else 0.0
+        speed = duration / elapsed if elapsed > 0 else 0.0
+        # フレーム数が不明な動画は速度が分からないのでプリセットを変えない
+        if tuner is not None and success and duration > 0:
+            previous = options["preset"]
+            if tuner.update(speed) != previous:
+                print(f"  x264プリセット: {previous} → {tuner.preset}（{speed:.2f}x）")
+        if options["encoder"] == "x264" and success:
+            record_encoding(
+                log_path,
+                get_output_path(output_dir, info.path),
+                encoder="libx264",
+                preset=options["preset"],
+                crf=options["crf"],
+                target=tuner.target if tuner is not None else "",
+                speed=f"{speed:.3f}",
+            )
+        return result
+
+    def options_for_next():
+        # スレッド数はワーカー1つ分の割り当て（デコーダ・エンコーダ・合成のスレッド）
+        options = {**settings, "threads": plan.threads}
+        if tuner is not None:
+            options["preset"] = tuner.preset
+        return options
+
+    def update_queue_depth(pending, running):
+        metrics.set_gauge("greenback_queue_depth", pending, queue="pending_videos")
+        metrics.set_gauge("greenback_queue_depth", running, queue="running_videos")
+
+    if plan.workers <= 1:
+        results = []
+        for index, info in enumerate(infos):
+            update_queue_depth(len(infos) - index - 1, 1)
+            options = options_for_next()
+            start = time.perf_counter()
+            output_path = get_output_path(
+                output_dir, info.path, options["encoder"] == "png"
+            )
+            result = process_video(info.path, bg_image, output_path, **options)
+            results.append(finish(info, options, time.perf_counter() - start, result))
+        update_queue_depth(0, 0)
+        return results
+
+    # 動画ごとに別プロセスで並列処理（各ワーカーは plan.threads スレッド）
+    # OpenCV のスレッドプールを fork すると終了時に固まるので spawn で起動
+    # プリセットを途中で変えられるよう、空いたワーカーの分だけ順に投入する
+    results = {}
+    pending = list(infos)
+    running = {}
+    with ProcessPoolExecutor(
+        max_workers=plan.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(plan, metrics_queue),
+    ) as executor:
+        while pending or running:
+            while pending and len(running) < plan.workers:
+                info = pending.pop(0)
+                options = options_for_next()
+                future = executor.submit(
+                    process_video,
+                    info.path,
+                    bg_image,
+                    get_output_path(output_dir, info.path, options["encoder"] == "png"),
+                    **options,
+                )
+                running[future] = (info, options, time.perf_counter())
+
+            update_queue_depth(len(pending), len(running))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                info, options, start = running.pop(future)
+                elapsed = time.perf_counter() - start
+                results[info.path] = finish(info, options, elapsed, future.result())
+
+    update_queue_depth(0, 0)
+    return [results[info.path] for info in infos]
 
 
 def main():
@@ -376,6 +1337,15 @@ def main():
   uv run python run.py --scale 0.5 --y-position 0.1 # 人物を小さく上部に配置
   uv run python run.py --no-brightness-match        # 輝度マッチング無効
   uv run python run.py --lower 30 60 60             # パラメータを調整
+  uv run python run.py --keyer ycbcr --similarity 0.3 --blend 0.1  # 色差キーヤー
+  uv run python run.py --bg 1 --watch               # green/を監視して順次処理
+  uv run python run.py --bg 1 --jobs 2              # 2本同時に動かす前提でスレッド数を調整
+  uv run python run.py --bg 1 --workers 4           # 4本の動画を並列に処理
+  uv run python run.py --bg 1 --frame-processes 4   # 1本の動画を4プロセスで合成
+  uv run python run.py --bg 1 --no-autotune        # autotune のプロファイルを使わない
+  uv run python run.py --bg 1 --renditions 720p 480p --thumbnail-interval 5
+                                                    # 解像度違いの版とサムネイルも出力
+  uv run python run.py --bg 1 --start 1:30 --end 1:50  # 1分30秒〜1分50秒だけ処理
         """,
     )
 
@@ -399,6 +1369,27 @@ def main():
         help="緑色検出の上限値 (H:0-179, S:0-255, V:0-255)",
     )
 
+    parser.add_argument(
+        "--keyer",
+        choices=KEYERS,
+        default="hsv",
+        help="緑色検出の方式 hsv=HSV範囲判定, ycbcr=色差距離（デフォルト: hsv）",
+    )
+
+    parser.add_argument(
+        "--similarity",
+        type=float,
+        default=0.3,
+        help="ycbcrキーヤーの緑色の類似度 0.0-1.0（デフォルト: 0.3）",
+    )
+
+    parser.add_argument(
+        "--blend",
+        type=float,
+        default=0.1,
+        help="ycbcrキーヤーのエッジのブレンド量 0.0-1.0（デフォルト: 0.1）",
+    )
+
     parser.add_argument(
         "--scale", type=float, default=0.7, help="人物のサイズ倍率（デフォルト: 0.7）"
     )
@@ -414,10 +1405,181 @@ def main():
         "--no-brightness-match", action="store_true", help="輝度マッチングを無効化"
     )
 
+    parser.add_argument(
+        "--backend",
+        choices=["opencv", "fused", "strips"],
+        default=None,
+        help="処理方式 opencv=通常, fused=Numbaで緑色検出〜合成を融合（要numba）, "
+        "strips=キャッシュに収まる帯に分けて並列処理（4K以上向け）"
+        "（デフォルト: autotune のプロファイル、なければ opencv）",
+    )
+
+    parser.add_argument(
+        "--mask-downscale",
+        type=int,
+        choices=[1, 4, 8],
+        default=None,
+        help="マスクを低解像度で推定し境界だけ全解像度で再判定（1=無効, 4, 8）",
+    )
+
+    parser.add_argument(
+        "--track-subject",
+        action="store_true",
+        help="人物の矩形を追跡し、その範囲だけリサイズ・輝度調整・合成する（高速化）",
+    )
+
+    parser.add_argument(
+        "--frame-processes",
+        type=int,
+        default=None,
+        metavar="N",
+        help="1本の動画をNプロセスで合成（共有メモリでフレームを受け渡す、デフォルト: 1）",
+    )
+
+    parser.add_argument(
+        "--start",
+        metavar="POS",
+        type=parse_position,
+        help="処理を始める位置 秒（12.5）、時刻（1:02.5）、フレーム番号（300f）",
+    )
+
+    parser.add_argument(
+        "--end",
+        metavar="POS",
+        type=parse_position,
+        help="処理を終える位置（この位置のフレームは含まない、書式は --start と同じ）",
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="green/フォルダを監視し、追加・更新された動画を順次処理",
+    )
+
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=2.0,
+        help="監視モードのポーリング間隔（秒、デフォルト: 2.0）",
+    )
+
+    parser.add_argument(
+        "--stable-time",
+        type=float,
+        default=5.0,
+        help="ファイルサイズが安定したとみなすまでの時間（秒、デフォルト: 5.0）",
+    )
+
+    parser.add_argument(
+        "--encoder",
+        choices=["mp4v", "x264", "png"],
+        default="mp4v",
+        help="出力のエンコーダ mp4v=OpenCV, x264=ffmpegのlibx264, "
+        "png=連番PNG（劣化なし、output/<動画名>_output/）（デフォルト: mp4v）",
+    )
+
+    parser.add_argument(
+        "--sequence-fps",
+        type=float,
+        default=DEFAULT_SEQUENCE_FPS,
+        help=f"入力が連番画像の場合のフレームレート（デフォルト: {DEFAULT_SEQUENCE_FPS:g}）",
+    )
+
+    parser.add_argument(
+        "--preset",
+        choices=X264_PRESETS,
+        default="medium",
+        help="x264のプリセット（--speed-target 指定時は最初に試すプリセット）",
+    )
+
+    parser.add_argument(
+        "--crf",
+        type=int,
+        default=23,
+        help="x264の品質 18-28推奨、低いほど高品質（デフォルト: 23）",
+    )
+
+    parser.add_argument(
+        "--keep-audio",
+        action="store_true",
+        help="元の動画の音声を再エンコードせずに出力に入れる（x264で出力）",
+    )
+
+    parser.add_argument(
+        "--renditions",
+        metavar="HEIGHT",
+        type=parse_rendition,
+        nargs="+",
+        default=[],
+        help="合わせて出力する解像度違いの版 例: 720p 480p（元の解像度より小さいもの）",
+    )
+
+    parser.add_argument(
+        "--thumbnail-interval",
+        metavar="SECONDS",
+        type=float,
+        help="サムネイル（JPEG）を保存する間隔（秒、先頭フレームから）",
+    )
+
+    parser.add_argument(
+        "--speed-target",
+        metavar="TARGET",
+        type=parse_speed_target,
+        help="処理速度の目標 realtime, 2x など。満たす中で最も高圧縮なx264プリセットを自動選択",
+    )
+
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="静止したフレームでも前の合成結果を再利用せず毎回合成する",
+    )
+
+    parser.add_argument(
+        "--dedup-tolerance",
+        type=int,
+        default=0,
+        help="前のフレームと同じとみなす画素値の差（デフォルト: 0 = 完全一致のみ）",
+    )
+
+    parser.add_argument(
+        "--max-memory",
+        metavar="SIZE",
+        type=parse_memory_size,
+        help="メモリ使用量の上限 例: 4G, 512M（ワーカー数・先読み数を自動で減らす）",
+    )
+
+    parser.add_argument(
+        "--asset-cache",
+        metavar="DIR",
+        help="リサイズ済みの背景画像と統計値を保存し、次回以降も再利用するディレクトリ",
+    )
+
+    add_thread_arguments(parser, workers=True)
+    add_autotune_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    add_base_dir_argument(parser, get_script_dir())
+
     args = parser.parse_args()
+    if args.encoder == "png" and (args.keep_audio or args.speed_target):
+        parser.error("--encoder png は --keep-audio / --speed-target と併用できません")
+
+    # 処理方式・マスク推定・人物矩形追跡・合成プロセス数を指定しなければ、
+    # autotune のプロファイル（autotune.py で計測した最も速い設定）を使う
+    profile = None
+    tuned_options = (args.backend, args.mask_downscale, args.frame_processes)
+    if not args.no_autotune and not args.track_subject:
+        if all(option is None for option in tuned_options):
+            profile = load_profile(args.autotune_profile)
+    args.backend = args.backend or "opencv"
+    args.mask_downscale = args.mask_downscale or 1
+    args.frame_processes = args.frame_processes or 1
+
+    # スレッド数の割り当て（監視モードは1本ずつ処理する）
+    plan = plan_threads(args.jobs, 1 if args.watch else args.workers, args.cores)
+    apply_thread_plan(plan)
 
     # ディレクトリセットアップ
-    base_dir = get_script_dir()
+    base_dir = args.base_dir.absolute()
     bg_dir, green_dir, output_dir, ready = setup_directories(base_dir)
 
     if not ready:
@@ -427,57 +1589,195 @@ def main():
     bg_images = get_background_images(bg_dir)
     bg_image = select_background(bg_images, args.bg)
 
-    # 動画ファイル取得
-    video_files = get_video_files(green_dir)
-
-    if not video_files:
-        print("\nエラー: green/ フォルダに動画ファイルが見つかりません")
-        print("対応形式: MP4, MOV, AVI, MKV")
+    # メトリクスの公開（--metrics-port / --metrics-file）
+    try:
+        exporter = metrics.start(
+            args.metrics_port, args.metrics_file, args.metrics_interval
+        )
+    except OSError as e:
+        print(f"エラー: メトリクスを公開できません: {e}")
         sys.exit(1)
 
-    # 処理開始
-    print("\n" + "=" * 60)
-    print(f"背景画像: {bg_image.name}")
-    print(f"動画数: {len(video_files)}")
-    print(f"HSV範囲: Lower{tuple(args.lower)} Upper{tuple(args.upper)}")
-    print(f"人物スケール: {args.scale}")
-    print(f"Y位置: {args.y_position}")
-    print(f"輝度マッチング: {'OFF' if args.no_brightness_match else 'ON'}")
-    print(f"出力先: {output_dir}")
-    print("=" * 60 + "\n")
-
     # パラメータ
     lower_green = tuple(args.lower)
     upper_green = tuple(args.upper)
     brightness_match = not args.no_brightness_match
 
-    # 処理
-    success_count = 0
-    failed_count = 0
+    # 速度目標の指定・音声のコピーはx264（ffmpeg）で出力する
+    encoder = "x264" if args.speed_target or args.keep_audio else args.encoder
+    settings = {
+        "lower_green": lower_green,
+        "upper_green": upper_green,
+        "scale": args.scale,
+        "y_position": args.y_position,
+        "brightness_match": brightness_match,
+        "mask_downscale": args.mask_downscale,
+        "track_subject": args.track_subject,
+        "keyer": args.keyer,
+        "similarity": args.similarity,
+        "blend": args.blend,
+        "backend": args.backend,
+        "asset_cache_dir": args.asset_cache,
+        "encoder": encoder,
+        "preset": args.preset,
+        "crf": args.crf,
+        "dedup_tolerance": None if args.no_dedup else args.dedup_tolerance,
+        "keep_audio": args.keep_audio,
+        "frame_processes": args.frame_processes,
+        "renditions": args.renditions,
+        "thumbnail_interval": args.thumbnail_interval,
+        "sequence_fps": args.sequence_fps,
+        "start": args.start,
+        "end": args.end,
+    }
+
+    # 全動画の合計フレーム数・再利用したフレーム数と、1本あたりのピークメモリの最大値
+    totals = {"frames": 0, "reused": 0, "peak_rss": None}
+
+    def add_stats(stats):
+        totals["frames"] += stats["frames"]
+        totals["reused"] += stats["reused"]
+        if stats["peak_rss"] is not None:
+            totals["peak_rss"] = max(totals["peak_rss"] or 0, stats["peak_rss"])
+
+    def process(video_file, output_path):
+        success, stats = process_video(
+            video_file, bg_image, output_path, threads=plan.threads, **settings
+        )
+        add_stats(stats)
+        return success
+
+    def print_settings(video_count_label):
+        print("\n" + "=" * 60)
+        print(f"背景画像: {bg_image.name}")
+        print(video_count_label)
+        if args.keyer == "ycbcr":
+            print(f"YCbCrキーヤー: similarity={args.similarity} blend={args.blend}")
+        else:
+            print(f"HSV範囲: Lower{tuple(args.lower)} Upper{tuple(args.upper)}")
+        print(f"人物スケール: {args.scale}")
+        print(f"Y位置: {args.y_position}")
+        print(f"輝度マッチング: {'OFF' if args.no_brightness_match else 'ON'}")
+        if args.mask_downscale > 1:
+            print(f"マスク推定: 1/{args.mask_downscale}解像度 + 境界再判定")
+        if args.track_subject:
+            print("人物矩形追跡: ON")
+        if args.backend != "opencv":
+            print(f"処理方式: {args.backend}")
+        if args.frame_processes > 1:
+            print(f"合成プロセス: 1本あたり {args.frame_processes}（共有メモリ）")
+        if encoder == "x264":
+            target = f"（速度目標 {args.speed_target}x）" if args.speed_target else ""
+            audio = "、音声をコピー" if args.keep_audio else ""
+            print(
+                f"エンコード: libx264 preset={args.preset} crf={args.crf}{target}{audio}"
+            )
+        if args.renditions:
+            print(f"解像度違いの版: {', '.join(f'{h}p' for h in args.renditions)}")
+        if args.thumbnail_interval is not None:
+            print(f"サムネイル: {args.thumbnail_interval}秒ごと")
+        if encoder == "png":
+            print("出力: 連番PNG")
+        if args.start is not None or args.end is not None:
+            first = format_position(args.start) if args.start else "先頭"
+            last = format_position(args.end) if args.end else "最後"
+            print(f"範囲: {first} 〜 {last}")
+        print(f"並列度: {describe(plan)}")
+        print(f"出力先: {output_dir}")
+        print("=" * 60 + "\n")
+
+    if args.watch:
+        # 監視モード（動画の解像度が分からないので、1080p に最も近い計測結果を使う）
+        if profile is not None:
+            plan = apply_autotune(profile, args, settings, plan, *DEFAULT_SIZE)
+        print_settings(f"監視間隔: {args.poll_interval}秒 / 安定判定: {args.stable_time}秒")
+
+        def process_watched(video_file, output_path):
+            # メモリ上限: 1本ずつ処理するので、動画ごとに解像度から先読み・キャッシュを決める
+            if args.max_memory is not None:
+                info, _ = probe_video_file(video_file, args.sequence_fps)
+                if info is not None:
+                    apply_memory_limit(args, settings, plan, info.width, info.height)
+            return process(video_file, output_path)
+
+        success_count, failed_count = watch_videos(
+            green_dir,
+            output_dir,
+            process_watched,
+            poll_interval=args.poll_interval,
+            stable_time=args.stable_time,
+            sequence_output=encoder == "png",
+        )
+    else:
+        # 動画ファイル取得
+        video_files = get_video_files(green_dir)
 
-    for video_file in video_files:
-        output_name = video_file.stem + "_output.mp4"
-        output_path = output_dir / output_name
+        if not video_files:
+            print("\nエラー: green/ フォルダに動画ファイルが見つかりません")
+            print("対応形式: MP4, MOV, AVI, MKV、連番画像（PNG/EXR/TIFF/JPEG）のフォルダ")
+            sys.exit(1)
 
-        if change_background(
-            video_file,
+        # 処理開始
+        print_settings(f"動画数: {len(video_files)}")
+
+        # 全動画を並列に調べ、見積もり時間の長いものから処理する
+        # （開けない・壊れた動画はここで失敗として数える）
+        infos, probe_failed, seconds_per_pixel = schedule_videos(
+            video_files, args, plan
+        )
+
+        # autotune: 最も解像度の大きい動画に最も近い計測結果を使う
+        if profile is not None and infos:
+            largest = max(infos, key=lambda info: info.width * info.height)
+            plan = apply_autotune(
+                profile, args, settings, plan, largest.width, largest.height
+            )
+
+        # メモリ上限に合わせてワーカー数・先読み・キャッシュの数を決める
+        # （合成プロセス数は autotune で決まるので、その後で見積もる）
+        if args.max_memory is not None and infos:
+            largest = max(infos, key=lambda info: info.width * info.height)
+            plan = apply_memory_limit(
+                args, settings, plan, largest.width, largest.height
+            )
+
+        # 速度目標を満たすx264プリセットを最初の動画の先頭数秒で選ぶ
+        tuner = None
+        if args.speed_target and infos:
+            tuner = PresetTuner(args.speed_target, args.preset)
+            calibrate_preset(tuner, infos[0], seconds_per_pixel, args.crf, plan.threads)
+
+        # 処理
+        results = run_batch(
+            infos,
             bg_image,
-            output_path,
-            lower_green,
-            upper_green,
-            args.scale,
-            args.y_position,
-            brightness_match,
-        ):
-            success_count += 1
-        else:
-            failed_count += 1
+            output_dir,
+            settings,
+            plan,
+            tuner,
+            exporter.queue if exporter is not None else None,
+        )
+
+        for _, stats in results:
+            add_stats(stats)
+        success_count = sum(1 for success, _ in results if success)
+        failed_count = len(results) - success_count + probe_failed
+        if probe_failed:
+            metrics.inc("greenback_videos_total", probe_failed, result="failure")
+            metrics.inc("greenback_failures_total", probe_failed, stage="probe")
+
+    if exporter is not None:
+        exporter.close()
 
     # 結果
     print("\n" + "=" * 60)
     print("処理完了！")
     print(f"成功: {success_count}")
     print(f"失敗: {failed_count}")
+    if totals["reused"]:
+        print(f"静止フレームの再利用: {totals['reused']}/{totals['frames']}フレーム")
+    if totals["peak_rss"] is not None:
+        print(f"ピークメモリ（1本あたり最大）: {format_size(totals['peak_rss'])}")
     print(f"出力先: {output_dir}")
     print("=" * 60)
 
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+共有メモリのフレームリングによる、1本の動画のマルチプロセス合成
+
+run.change_background は1本の動画を1つのプロセスで合成するので、OpenCV の処理の
+合間にある Python の処理（輝度調整の計算・スライス・進捗表示）が GIL で直列になり、
+スレッド数を増やしてもコア数ぶんには速くならない。かといってフレームを pickle で
+別プロセスに渡すと、1080p で1フレーム約6MBのコピーが往復で発生する。
+
+ここでは multiprocessing.shared_memory に固定数のフレーム枠（スロット）を確保し、
+読み込み・合成・書き出しの間ではスロット番号だけを受け渡す。
+
+    読み込み（親）: 空いたスロットの入力枠に直接デコード → 番号を作業キューへ
+    合成（子 × N）: 入力枠の人物を同じスロットの出力枠に合成 → 番号を完了キューへ
+    書き出し（親）: フレーム順に並べ直して出力枠を書き出し、スロットを空きに戻す
+
+    - 出力枠は最初に背景画像で埋めておくので、合成は人物の配置領域だけを書き換える
+    - 前のフレームと同じフレーム（FrameDeduplicator）は合成に回さず、
+      直前に書き出した出力枠をもう一度書き出す（そのため直前の1枠は空きに戻さず保持する）
+    - 子プロセスは spawn で起動する（OpenCV のスレッドプールを fork すると固まるため）
+"""
+
+import queue
+import traceback
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import cv2
+import numpy as np
+
+import fused
+
+# 1プロセスあたりのスロット数（合成中と、書き出し・読み込みを待つ分）
+SLOTS_PER_PROCESS = 2
+
+# 完了を待つ間に子プロセスの異常終了を確認する間隔（秒）
+POLL_INTERVAL = 1.0
+
+
+class SharedFrames:
+    """
+    共有メモリ上の同じ大きさのフレーム（uint8）の配列
+
+    Args:
+        count: フレーム数
+        shape: 1フレームの形 (高さ, 幅, 3)
+        name: 既存の共有メモリの名前（None なら新しく確保する）
+    """
+
+    def __init__(self, count, shape, name=None):
+        if name is None:
+            self.shm = SharedMemory(create=True, size=count * int(np.prod(shape)))
+        else:
+            self.shm = SharedMemory(name=name)
+        self.owner = name is None
+        self.array = np.ndarray((count, *shape), dtype=np.uint8, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __getitem__(self, index):
+        return self.array[index]
+
+    def close(self):
+        """割り当てを解除（確保したプロセスでは共有メモリも削除）"""
+        self.array = None
+        if self.owner:
+            self.shm.unlink()
+        try:
+            self.shm.close()
+        except BufferError:
+            # 合成処理がフレームの参照を保持している: プロセスの終了時に解放される
+            pass
+
+
+def _worker(make_step, names, slots, shape, threads, tasks, done):
+    """
+    子プロセス: 作業キューのスロットを合成して完了キューに返す
+
+    エラーは (None, トレースバック) として完了キューに返して終了する。
+    """
+    cv2.setNumThreads(threads)
+    fused.set_num_threads(threads)
+    frames = SharedFrames(slots, shape, names[0])
+    outputs = SharedFrames(slots, shape, names[1])
+    background = SharedFrames(1, shape, names[2])
+    try:
+        step = make_step()
+        while True:
+            slot = tasks.get()
+            if slot is None:
+                break
+            step(frames[slot], background[0], outputs[slot])
+            done.put((slot, None))
+    except Exception:
+        done.put((None, traceback.format_exc()))
+    finally:
+        for shared in (frames, outputs, background):
+            shared.close()
+
+
+def _wait_done(done, workers):
+    """合成が終わったスロットを1つ待つ（子プロセスが落ちたら RuntimeError）"""
+    while True:
+        try:
+            slot, error = done.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            if not all(worker.is_alive() for worker in workers):
+                raise RuntimeError("合成プロセスが異常終了しました")
+            continue
+        if error is not None:
+            raise RuntimeError(f"合成プロセスでエラーが発生しました\n{error}")
+        return slot
+
+
+def composite_shared(
+    read,
+    write,
+    background,
+    make_step,
+    processes,
+    threads=1,
+    dedup=None,
+    slots=None,
+    peaks=None,
+):
+    """
+    フレームを共有メモリのスロットに読み込み、複数のプロセスで合成して順に書き出す
+
+    Args:
+        read: read(dst) -> bool  次のフレームを dst（入力枠）にデコード、なければ False
+        write: write(frame)  合成済みのフレームを書き出す（frame は呼び出しの間だけ有効）
+        background: 背景画像（入力・出力と同じ大きさの BGR）
+        make_step: 子プロセスで呼んで合成処理を作る関数（pickle できること）
+                   make_step() -> step(frame, bg_img, canvas)  canvas の配置領域に合成する
+        processes: 合成するプロセス数
+        threads: 1プロセスあたりの OpenCV / Numba のスレッド数
+        dedup: FrameDeduplicator（前のフレームと同じなら合成しない、None なら毎回合成）
+        slots: スロット数（None なら processes × SLOTS_PER_PROCESS + 2）
+        peaks: 指定すると子プロセスのピークRSS（バイト）を終了前に追加するリスト
+
+    Returns:
+        int: 書き出したフレーム数
+    """
+    shape = background.shape
+    slots = max(2, slots or processes * SLOTS_PER_PROCESS + 2)
+
+    frames = SharedFrames(slots, shape)
+    outputs = SharedFrames(slots, shape)
+    bg = SharedFrames(1, shape)
+    np.copyto(bg[0], background)
+    outputs.array[:] = background
+
+    context = get_context("spawn")
+    tasks, done = context.Queue(), context.Queue()
+    names = (frames.name, outputs.name, bg.name)
+    workers = []
+    try:
+        for _ in range(processes):
+            worker = context.Process(
+                target=_worker,
+                args=(make_step, names, slots, shape, threads, tasks, done),
+                daemon=True,
+            )
+            worker.start()
+            workers.append(worker)
+
+        free = list(range(slots))
+        running = {}  # 合成中のスロット → フレーム番号
+        ready = {}  # フレーム番号 → 合成済みのスロット（None = 前のフレームと同じ）
+        last = None  # 直前に書き出したスロット
+        read_count = written = 0
+        finished = False
+
+        while True:
+            # 読み込み: 空いたスロットに直接デコードして合成に回す
+            while not finished and free:
+                slot = free[-1]
+                if not read(frames[slot]):
+                    finished = True
+                    break
+                # 同じフレームは、その前のフレームの出力枠を書き出す時点で last になっている
+                if dedup is not None and dedup.is_repeat(frames[slot]):
+                    ready[read_count] = None
+                else:
+                    free.pop()
+                    running[slot] = read_count
+                    tasks.put(slot)
+                read_count += 1
+
+            # 書き出し: フレーム順に
+            while written in ready:
+                slot = ready.pop(written)
+                if slot is None:
+                    write(outputs[last])
+                else:
+                    write(outputs[slot])
+                    if last is not None:
+                        free.append(last)
+                    last = slot
+                written += 1
+
+            if finished and written == read_count:
+                break
+
+            slot = _wait_done(done, workers)
+            ready[running.pop(slot)] = slot
+
+        if peaks is not None:
+            # memory.py がスロット数（SLOTS_PER_PROCESS）を使うので、ここで import する
+            from memory import peak_rss
+
+            for worker in workers:
+                peak = peak_rss(worker.pid)
+                if peak is not None:
+                    peaks.append(peak)
+        for _ in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join()
+        return written
+
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        for shared in (frames, outputs, bg):
+            shared.close()
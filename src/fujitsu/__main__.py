@@ -0,0 +1,7 @@
+"""python -m fujitsu で fujitsu コマンドを実行"""
+
+import sys
+
+from fujitsu.cli import main
+
+sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+fujitsu コマンド（各スクリプトをまとめた入口）
+
+    fujitsu run --bg 1            run.py と同じ（全動画を一括処理）
+    fujitsu test --bg 1           test_run.py と同じ（1動画でパラメータをテスト）
+    fujitsu ffmpeg --workers 4    remove_greenback.py と同じ（ffmpeg chromakey）
+    fujitsu cv                    remove_greenback_cv.py と同じ（OpenCV HSV）
+    fujitsu convert               convert_videos.py と同じ（H264・10fps に変換）
+    fujitsu verify / benchmark    verify.py / benchmark.py と同じ
+    fujitsu autotune              autotune.py と同じ（最も速い処理方式を計測して保存）
+    fujitsu list                  bg/・green/ の素材の一覧
+    fujitsu probe FILE ...        動画の解像度・フレームレート・長さ
+
+素材・出力のフォルダ（bg/・green/・output/ など）はカレントディレクトリを使う
+（--base-dir で指定できる。スクリプトを直接実行した場合はスクリプトのあるフォルダ）。
+
+各スクリプト（run.py など）はリポジトリ直下のモジュールなので、fujitsu コマンドは
+リポジトリを編集可能インストール（uv sync / pip install -e .）した場合だけ使える。
+
+各スクリプトは読み込み時に cv2 / numpy / ffmpeg を import するので、
+サブコマンドのモジュールは実行するときに初めて import する。
+fujitsu --help・list・probe は cv2 / numpy を読み込まないので、すぐに終わる
+（probe は ffprobe がない場合と連番画像のフォルダだけ OpenCV で調べる）。
+"""
+
+import argparse
+import importlib
+import sys
+from pathlib import Path
+
+try:
+    import media_files
+except ImportError:
+    # リポジトリ直下のモジュールが見つからない（編集可能インストールではない）
+    media_files = None
+
+# サブコマンド → (モジュール, 説明)。モジュールの main() に残りの引数を渡す
+SCRIPTS = {
+    "run": ("run", "グリーンバック動画の背景を一括で置き換える（run.py）"),
+    "test": ("test_run", "1つの動画でパラメータをテスト（test_run.py）"),
+    "ffmpeg": ("remove_greenback", "ffmpeg の chromakey で背景を置き換える"),
+    "cv": ("remove_greenback_cv", "OpenCV（HSV）で背景を置き換える"),
+    "convert": ("convert_videos", "動画を H264・mp4・10fps に変換"),
+    "verify": ("verify", "高速化した処理方式と従来の処理の一致を確認"),
+    "benchmark": ("benchmark", "処理速度・精度のベンチマーク"),
+    "autotune": ("autotune", "このマシンで最も速い処理方式を計測してプロファイルに保存"),
+}
+
+# 素材・出力のフォルダを --base-dir で受け取るサブコマンド
+BASE_DIR_SCRIPTS = {"run", "test", "ffmpeg", "cv"}
+
+
+def run_script(command, args):
+    """サブコマンドのモジュールを import して main() を実行"""
+    module_name, _ = SCRIPTS[command]
+    module = importlib.import_module(module_name)
+    # 素材・出力のフォルダはカレントディレクトリ（後ろで --base-dir を指定すればそちらを使う）
+    if command in BASE_DIR_SCRIPTS:
+        args = ["--base-dir", str(Path.cwd()), *args]
+    # 各スクリプトは sys.argv を argparse で解釈する（--help の表示名も合わせる）
+    sys.argv = [f"fujitsu {command}", *args]
+    return module.main()
+
+
+def list_media(base_dir):
+    """bg/・green/ の素材を表示"""
+    for name, find in (
+        ("bg", media_files.get_background_images),
+        ("green", media_files.get_video_files),
+    ):
+        directory = base_dir / name
+        if not directory.is_dir():
+            print(f"{name}/: なし（{directory}）")
+            continue
+        files = find(directory)
+        print(f"{name}/: {len(files)}件")
+        for index, path in enumerate(files, 1):
+            if path.is_dir():
+                count = len(media_files.sequence_files(path))
+                print(f"  {index}. {path.name}/（連番画像 {count}枚）")
+            else:
+                print(f"  {index}. {path.name}")
+    return 0
+
+
+def _fraction(text):
+    """"30000/1001" のようなフレームレートを数値に"""
+    numerator, _, denominator = text.partition("/")
+    denominator = float(denominator or 1)
+    return float(numerator) / denominator if denominator else 0.0
+
+
+def _probe_ffprobe(path):
+    """ffprobe で調べる（ffprobe がなければ FileNotFoundError）"""
+    import ffmpeg
+
+    try:
+        info = ffmpeg.probe(str(path), select_streams="v:0")
+        stream = info["streams"][0]
+    except ffmpeg.Error as e:
+        raise ValueError(e.stderr.decode(errors="replace").strip()) from None
+    except IndexError:
+        raise ValueError("映像がありません") from None
+    fps = _fraction(stream.get("avg_frame_rate") or "0/1")
+    duration = float(info["format"].get("duration", 0.0))
+    frames = int(stream.get("nb_frames") or round(duration * fps))
+    return int(stream["width"]), int(stream["height"]), fps, frames, duration
+
+
+def _probe_opencv(path):
+    """OpenCV で調べる（連番画像のフォルダも可、cv2 を読み込むので遅い）"""
+    from cost_model import probe_video_file
+
+    video, error = probe_video_file(path)
+    if video is None:
+        raise ValueError(error)
+    duration = video.frames / video.fps if video.fps > 0 else 0.0
+    return video.width, video.height, video.fps, video.frames, duration
+
+
+def probe_media(paths):
+    """
+    動画の解像度・フレームレート・フレーム数・長さを表示
+
+    ffprobe で調べる（ffprobe がない場合・連番画像のフォルダは OpenCV で調べる）。
+
+    Returns:
+        int: 終了コード（調べられない動画があれば1）
+    """
+    failed = 0
+    for path in map(Path, paths):
+        try:
+            if path.is_dir():
+                width, height, fps, frames, duration = _probe_opencv(path)
+            else:
+                try:
+                    width, height, fps, frames, duration = _probe_ffprobe(path)
+                except FileNotFoundError:
+                    # ffprobe がない
+                    width, height, fps, frames, duration = _probe_opencv(path)
+        except ValueError as e:
+            print(f"✗ {path}: {e}")
+            failed += 1
+            continue
+        print(
+            f"{path}: {width}x{height} {fps:.3f}fps {frames}フレーム {duration:.2f}秒"
+        )
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="fujitsu",
+        description="グリーンバック動画背景置換ツール",
+        epilog="各サブコマンドの引数は fujitsu <サブコマンド> --help で表示",
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="<サブコマンド>")
+    for command, (_, help_text) in SCRIPTS.items():
+        # 引数の解釈はスクリプト側で行う（--help もスクリプトに渡す）
+        subparsers.add_parser(command, help=help_text, add_help=False)
+
+    list_parser = subparsers.add_parser("list", help="bg/・green/ の素材の一覧")
+    list_parser.add_argument(
+        "--base-dir",
+        "--dir",
+        type=Path,
+        default=Path.cwd(),
+        help="bg/・green/ のあるフォルダ（デフォルト: カレントディレクトリ）",
+    )
+    probe_parser = subparsers.add_parser(
+        "probe", help="動画の解像度・フレームレート・長さを表示"
+    )
+    probe_parser.add_argument("paths", nargs="+", help="動画ファイル・連番画像のフォルダ")
+
+    if media_files is None:
+        print(
+            "fujitsu コマンドはリポジトリを編集可能インストール"
+            "（uv sync / pip install -e .）した場合だけ使えます",
+            file=sys.stderr,
+        )
+        return 1
+
+    argv = sys.argv[1:] if argv is None else argv
+    # サブコマンドより後ろの引数はスクリプトにそのまま渡す
+    if argv and argv[0] in SCRIPTS:
+        return run_script(argv[0], argv[1:])
+
+    args = parser.parse_args(argv)
+    if args.command == "list":
+        return list_media(args.base_dir.absolute())
+    if args.command == "probe":
+        return probe_media(args.paths)
+    parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+横長の帯（ストリップ）単位で緑色検出〜合成を行う処理
+
+run.change_background の通常の処理は、緑色検出・マスク反転・人物の抽出・縮小・
+合成の各段がそれぞれフレーム全体を読み書きする。4K（25MB）以上ではフレームが
+CPUキャッシュに収まらず、段ごとにメインメモリから読み直すことになる。
+
+ここではフレームを数十行ずつの帯に分け、1つの帯について全段を続けて処理する。
+帯の大きさは作業用の配列を含めて L2 キャッシュに収まる程度にし、
+帯どうしは独立なので複数スレッドで並列に処理する。
+
+    - 帯の境界は縮小の比率の整数倍の行に揃えるので、縮小の結果は
+      フレーム全体を縮小した場合とほぼ一致する（OpenCV は補間位置を単精度で
+      計算するため、4K 以上では一部の行の補間係数が1段ずれ、
+      マスクの境界の画素だけ差が出ることがある。benchmark.py strips で確認できる）
+    - 輝度マッチングは人物全体の平均値が必要なので、
+        1. 緑色検出〜縮小〜HSV変換と、帯ごとの平均値の集計
+        2. 輝度調整〜合成
+      の2段階に分ける（帯ごとの中間結果は1から2へ引き継ぐ）
+    - 拡大する場合や縮小の比率が単純でない場合は帯に分けられないので、1つの帯で処理する
+"""
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# 1つの帯の元フレームの大きさの目安（作業用の配列は合わせてこの数倍になる）
+STRIP_BYTES = 256 * 1024
+
+
+def brightness_ratios(person_hsv_mean, bg_hsv_mean):
+    """
+    輝度マッチングの V（明度）・S（彩度）の調整比率
+
+    Args:
+        person_hsv_mean: 人物の平均HSV値
+        bg_hsv_mean: 背景の平均HSV値
+
+    Returns:
+        tuple: (V の比率, S の比率) 調整しない成分は None
+    """
+    # V（明度）の調整比率を計算
+    if person_hsv_mean[2] > 0:
+        brightness_ratio = bg_hsv_mean[2] / person_hsv_mean[2]
+    else:
+        brightness_ratio = 1.0
+
+    # S（彩度）も軽く調整（色温度のマッチング）
+    saturation_ratio = None
+    if person_hsv_mean[1] > 0:
+        saturation_ratio = bg_hsv_mean[1] / person_hsv_mean[1]
+        # 彩度は控えめに調整（0.7倍の影響）
+        saturation_ratio = 1.0 + (saturation_ratio - 1.0) * 0.3
+
+    return brightness_ratio, saturation_ratio
+
+
+def apply_brightness(person_hsv, ratios):
+    """
+    HSV（float32）の人物画像に調整比率を掛けて BGR に戻す
+
+    Args:
+        person_hsv: 人物画像（HSV、float32、書き換える）
+        ratios: brightness_ratios() の戻り値
+
+    Returns:
+        調整後の人物画像（BGR）
+    """
+    brightness_ratio, saturation_ratio = ratios
+
+    # 人物のV値を調整（0-255の範囲を維持）
+    person_hsv[:, :, 2] = np.clip(person_hsv[:, :, 2] * brightness_ratio, 0, 255)
+    if saturation_ratio is not None:
+        person_hsv[:, :, 1] = np.clip(person_hsv[:, :, 1] * saturation_ratio, 0, 255)
+
+    # HSV → BGR変換
+    return cv2.cvtColor(person_hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
+
+
+def blend_person(person, mask_inv, bg_roi, soft=False):
+    """
+    人物をマスクで背景に重ねる（run.composite_frame と同じ演算）
+
+    Args:
+        person: 人物画像（BGR）
+        mask_inv: 人物部分が255のマスク
+        bg_roi: 同じ大きさの背景
+        soft: マスクを不透明度として扱いアルファブレンドする
+
+    Returns:
+        合成後の画像
+    """
+    # マスクを3チャンネルに変換
+    mask_inv_3ch = cv2.cvtColor(mask_inv, cv2.COLOR_GRAY2BGR)
+
+    if soft:
+        # アルファブレンド: 人物 * a + 背景 * (1 - a)（a = マスク / 255）
+        mask_3ch = cv2.bitwise_not(mask_inv_3ch)
+        person_area = cv2.multiply(person, mask_inv_3ch, scale=1 / 255)
+        bg_area = cv2.multiply(bg_roi, mask_3ch, scale=1 / 255)
+        return cv2.add(person_area, bg_area)
+
+    # マスクで人物以外を黒くし、背景から人物領域を除去して合成
+    person_area = cv2.bitwise_and(person, mask_inv_3ch)
+    mask_3ch = cv2.cvtColor(cv2.bitwise_not(mask_inv), cv2.COLOR_GRAY2BGR)
+    bg_area = cv2.bitwise_and(bg_roi, mask_3ch)
+    return cv2.add(person_area, bg_area)
+
+
+def split_rows(height, scaled_height, rows):
+    """
+    元フレームの行を、縮小後の行と対応が揃う帯に分ける
+
+    Args:
+        height: 元フレームの高さ
+        scaled_height: 縮小後の高さ
+        rows: 1つの帯の行数の目安
+
+    Returns:
+        list: [(元の開始行, 終了行, 縮小後の開始行, 終了行), ...]
+    """
+    g = math.gcd(height, scaled_height)
+    step_src, step_dst = height // g, scaled_height // g
+    if scaled_height > height or step_dst > 64:
+        # 拡大・比率が単純でない: 帯の境界で補間が変わるので分けない
+        return [(0, height, 0, scaled_height)]
+
+    rows = max(step_src, rows // step_src * step_src)
+    strips = []
+    for y0 in range(0, height, rows):
+        y1 = min(height, y0 + rows)
+        strips.append((y0, y1, y0 // step_src * step_dst, y1 // step_src * step_dst))
+    return strips
+
+
+class StripCompositor:
+    """
+    1本の動画分の帯の分け方とスレッドを保持し、フレームごとに合成する
+
+    FusedCompositor と同じく、canvas（背景画像で初期化済み）の配置領域だけを書き換える。
+
+    Args:
+        frame_size: 入力フレームの (width, height)
+        layout: run.compute_layout() の戻り値
+        key: 緑色検出 key(frame) -> マスク（画素ごとに独立した処理であること）
+        bg_hsv_mean: 背景の平均HSV値（None なら輝度マッチングなし）
+        soft: マスクを不透明度としてアルファブレンドする
+        threads: 並列に処理するスレッド数（run.py では ThreadPlan のスレッド数。
+                 帯ごとのスレッドの中で OpenCV がさらにスレッドを使うとコアを取り合うので、
+                 呼び出し側で OpenCV のスレッド数を1にしておく）
+        strip_bytes: 1つの帯の元フレームの大きさの目安
+    """
+
+    def __init__(
+        self,
+        frame_size,
+        layout,
+        key,
+        bg_hsv_mean=None,
+        soft=False,
+        threads=1,
+        strip_bytes=STRIP_BYTES,
+    ):
+        width, height = frame_size
+        scaled_width, scaled_height, self.x_offset, self.y_offset = layout
+        self.scaled_width = scaled_width
+        self.key = key
+        self.bg_hsv_mean = bg_hsv_mean
+        self.soft = soft
+        self.strips = split_rows(
+            height, scaled_height, max(1, strip_bytes // (width * 3))
+        )
+        self.executor = ThreadPoolExecutor(threads) if threads > 1 else None
+
+    def _map(self, func, items):
+        if self.executor is None:
+            return [func(item) for item in items]
+        return list(self.executor.map(func, items))
+
+    def _key_scale(self, frame, strip):
+        """帯の緑色検出〜人物の抽出〜縮小"""
+        y0, y1, s0, s1 = strip
+        src = frame[y0:y1]
+        mask_inv = cv2.bitwise_not(self.key(src))
+        person = cv2.bitwise_and(src, src, mask=mask_inv)
+        dsize = (self.scaled_width, s1 - s0)
+        return cv2.resize(person, dsize), cv2.resize(mask_inv, dsize)
+
+    def _blend(self, strip, person, mask_inv, bg_img, canvas):
+        """縮小済みの帯を canvas に合成"""
+        _, _, s0, s1 = strip
+        r0, r1 = self.y_offset + s0, self.y_offset + s1
+        c0, c1 = self.x_offset, self.x_offset + self.scaled_width
+        canvas[r0:r1, c0:c1] = blend_person(
+            person, mask_inv, bg_img[r0:r1, c0:c1], self.soft
+        )
+
+    def composite(self, frame, bg_img, canvas):
+        """
+        frame の人物を canvas の配置領域に合成
+
+        Returns:
+            canvas
+        """
+        if self.bg_hsv_mean is None:
+
+            def process(strip):
+                person, mask_inv = self._key_scale(frame, strip)
+                self._blend(strip, person, mask_inv, bg_img, canvas)
+
+            self._map(process, self.strips)
+            return canvas
+
+        # 1. 緑色検出〜HSV変換と、帯ごとの人物の平均値・画素数
+        def measure(strip):
+            person, mask_inv = self._key_scale(frame, strip)
+            person_hsv = cv2.cvtColor(person, cv2.COLOR_BGR2HSV).astype(np.float32)
+            count = cv2.countNonZero(mask_inv)
+            total = np.array(cv2.mean(person_hsv, mask_inv)) * count
+            return person_hsv, mask_inv, total, count
+
+        parts = self._map(measure, self.strips)
+        count = sum(part[3] for part in parts)
+        total = sum(part[2] for part in parts)
+        person_hsv_mean = total / count if count else np.zeros(4)
+        ratios = brightness_ratios(person_hsv_mean, self.bg_hsv_mean)
+
+        # 2. 輝度調整〜合成
+        def adjust(item):
+            strip, (person_hsv, mask_inv, _, _) = item
+            person = apply_brightness(person_hsv, ratios)
+            self._blend(strip, person, mask_inv, bg_img, canvas)
+
+        self._map(adjust, list(zip(self.strips, parts)))
+        return canvas
+
+    def close(self):
+        """スレッドを終了"""
+        if self.executor is not None:
+            self.executor.shutdown()
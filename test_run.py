@@ -35,6 +35,8 @@ from run import (
     get_video_files,
     change_background
 )
+from concurrency import add_thread_arguments, apply_thread_plan, plan_threads
+from media_files import add_base_dir_argument
 
 
 def main():
@@ -93,10 +95,16 @@ def main():
         help='輝度マッチングを無効化'
     )
 
+    add_thread_arguments(parser)
+    add_base_dir_argument(parser, get_script_dir())
+
     args = parser.parse_args()
 
+    # スレッド数の割り当て
+    apply_thread_plan(plan_threads(args.jobs, cores=args.cores))
+
     # ディレクトリセットアップ
-    base_dir = get_script_dir()
+    base_dir = args.base_dir.absolute()
     bg_dir, green_dir, output_dir, ready = setup_directories(base_dir)
 
     if not ready:
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+人物のバウンディングボックス検出と追跡
+
+マスクから人物の外接矩形を求め、フレーム間で滑らかに追跡します。
+合成処理（リサイズ・輝度マッチング・ブレンド）をこの矩形の中だけに
+限定するために使います。
+"""
+
+import cv2
+
+
+class SubjectTracker:
+    """
+    人物の外接矩形をフレーム間で追跡する
+
+    矩形が広がる方向には即座に追従し（人物が切れないように）、
+    狭まる方向にはゆっくり追従する（矩形のちらつきを抑える）。
+
+    Args:
+        width: フレーム幅
+        height: フレーム高さ
+        padding: 矩形の余白（フレームの短辺に対する割合）
+        shrink_rate: 1フレームで狭める割合（0.0-1.0）
+        detect_scale: 検出に使う縮小率（ノイズ除去と高速化のため）
+    """
+
+    def __init__(self, width, height, padding=0.03, shrink_rate=0.1, detect_scale=8):
+        self.width = width
+        self.height = height
+        self.padding = max(2, int(min(width, height) * padding))
+        self.shrink_rate = shrink_rate
+        self.detect_scale = detect_scale
+        self.box = None
+
+    def detect(self, person_mask):
+        """
+        マスクから人物の外接矩形を検出
+
+        Args:
+            person_mask: 人物部分が255のマスク
+
+        Returns:
+            tuple: (x0, y0, x1, y1) または人物がいなければNone
+        """
+        d = self.detect_scale
+        small = cv2.resize(
+            person_mask,
+            (max(1, self.width // d), max(1, self.height // d)),
+            interpolation=cv2.INTER_AREA,
+        )
+        # 1ブロックの1/4未満しか人物画素がないブロックはノイズとして無視
+        _, small = cv2.threshold(small, 63, 255, cv2.THRESH_BINARY)
+        x, y, w, h = cv2.boundingRect(small)
+        if w == 0 or h == 0:
+            return None
+
+        pad = self.padding
+        return (
+            max(0, x * d - pad),
+            max(0, y * d - pad),
+            min(self.width, (x + w) * d + pad),
+            min(self.height, (y + h) * d + pad),
+        )
+
+    def update(self, person_mask):
+        """
+        新しいフレームのマスクで矩形を更新
+
+        Returns:
+            tuple: 追跡中の矩形 (x0, y0, x1, y1)、人物がいなければNone
+        """
+        detected = self.detect(person_mask)
+        if detected is None or self.box is None:
+            self.box = detected
+            return self.box
+
+        def follow(current, target, grow_when_smaller):
+            # 広がる方向は即座に、狭まる方向は shrink_rate ずつ追従
+            if (target < current) == grow_when_smaller:
+                return target
+            return current + int((target - current) * self.shrink_rate)
+
+        x0, y0, x1, y1 = self.box
+        dx0, dy0, dx1, dy1 = detected
+        self.box = (
+            follow(x0, dx0, True),
+            follow(y0, dy0, True),
+            follow(x1, dx1, False),
+            follow(y1, dy1, False),
+        )
+        return self.box
@@ -0,0 +1,668 @@
+#!/usr/bin/env python3
+"""
+高速化した処理方式が従来の処理と同じ結果になるかを確認するスクリプト
+
+従来の処理（基準）と各処理方式で同じフレームを処理し、
+マスクを画素単位で、合成結果を PSNR / SSIM で比較して、
+速度比と誤差を1つの表にまとめる。許容範囲を超えた方式があれば終了コード1。
+
+基準:
+    run  run.change_background の通常の処理（人物 0.7倍・上部20%・輝度マッチングあり）
+    cv   remove_greenback_cv.change_background（人物 等倍・輝度マッチングなし）
+
+使用方法:
+    # 合成したクリップで全方式を確認
+    uv run python verify.py
+
+    # 手元の動画（先頭30フレーム）も確認
+    uv run python verify.py --videos green/sample.mp4 --frames 30
+
+    # 方式と許容範囲を指定
+    uv run python verify.py --backends strips fused --min-psnr 45 --min-ssim 0.995
+
+    # 音声のコピー（run.py --keep-audio）で映像と音声がずれないか確認（要ffmpeg）
+    uv run python verify.py --audio-sync
+
+    # 範囲指定（run.py --start / --end）のシークがフレーム単位で正確か確認
+    uv run python verify.py --seek --videos green/sample.mp4
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+import cv2
+import ffmpeg
+import numpy as np
+
+import fused
+from benchmark import (
+    LOWER_GREEN,
+    UPPER_GREEN,
+    make_background,
+    make_synthetic_frame,
+    parse_size,
+    read_all_frames,
+)
+from frame_range import format_position, frame_range, seek
+from keyers import make_keyer
+from pipeline import FrameData, layout_rect
+from remove_greenback_cv import replace_background
+from run import (
+    change_background,
+    composite_frame,
+    compute_bg_hsv_mean,
+    compute_layout,
+    make_pipeline,
+)
+from strips import StripCompositor
+from tracking import SubjectTracker
+
+# 基準ごとの人物の配置と輝度マッチング
+REFERENCES = {
+    "run": {"scale": 0.7, "y_position": 0.2, "brightness": True},
+    "cv": {"scale": 1.0, "y_position": 0.0, "brightness": False},
+}
+
+
+class Clip:
+    """
+    比較に使うフレームと背景
+
+    Args:
+        name: 表示名
+        frames: BGRフレームのリスト
+        bg_img: フレームと同じサイズの背景画像
+    """
+
+    def __init__(self, name, frames, bg_img):
+        self.name = name
+        self.frames = frames
+        self.bg_img = bg_img
+        self.height, self.width = frames[0].shape[:2]
+
+
+def synthetic_clip(size, frame_count):
+    """合成フレームのクリップ（フレームごとにノイズが変わる）"""
+    width, height = parse_size(size)
+    frames = [make_synthetic_frame(width, height, seed) for seed in range(frame_count)]
+    return Clip(f"synthetic {size}", frames, make_background(width, height))
+
+
+def video_clip(path, frame_count, bg_path=None):
+    """
+    手元の動画の先頭 frame_count フレームのクリップ
+
+    Returns:
+        Clip、読めなければ None
+    """
+    cap = cv2.VideoCapture(str(path))
+    frames = []
+    while len(frames) < frame_count:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        return None
+
+    height, width = frames[0].shape[:2]
+    bg_img = cv2.imread(str(bg_path)) if bg_path else None
+    if bg_img is None:
+        bg_img = make_background(width, height)
+    return Clip(str(path), frames, cv2.resize(bg_img, (width, height)))
+
+
+# --- 処理方式 ---
+# make_xxx(clip, config) -> step(frame) -> (人物部分が255のマスク または None, 合成結果)
+
+
+def make_reference_run(clip, config):
+    """run.change_background の通常の処理"""
+    key = make_keyer("hsv", LOWER_GREEN, UPPER_GREEN)
+
+    def step(frame):
+        mask_inv = cv2.bitwise_not(key(frame))
+        output, _ = composite_frame(
+            frame, mask_inv, clip.bg_img, config["layout"], config["bg_hsv_mean"]
+        )
+        return mask_inv, output
+
+    return step
+
+
+def make_reference_cv(clip, config):
+    """remove_greenback_cv.change_background の処理"""
+    lower = np.array(LOWER_GREEN)
+    upper = np.array(UPPER_GREEN)
+
+    def step(frame):
+        output, mask = replace_background(frame, clip.bg_img, lower, upper)
+        return cv2.bitwise_not(mask), output
+
+    return step
+
+
+def make_mask_downscale(downscale):
+    """低解像度マスク推定（--mask-downscale）"""
+
+    def make(clip, config):
+        key = make_keyer("hsv", LOWER_GREEN, UPPER_GREEN, downscale=downscale)
+
+        def step(frame):
+            mask_inv = cv2.bitwise_not(key(frame))
+            output, _ = composite_frame(
+                frame, mask_inv, clip.bg_img, config["layout"], config["bg_hsv_mean"]
+            )
+            return mask_inv, output
+
+        return step
+
+    return make
+
+
+def make_tracked(clip, config):
+    """人物矩形追跡（--track-subject）"""
+    key = make_keyer("hsv", LOWER_GREEN, UPPER_GREEN)
+    tracker = SubjectTracker(clip.width, clip.height)
+    canvas = clip.bg_img.copy()
+    state = {"rect": None}
+
+    def step(frame):
+        mask_inv = cv2.bitwise_not(key(frame))
+        box = tracker.update(mask_inv)
+        if state["rect"] is not None:
+            y0, y1, x0, x1 = state["rect"]
+            canvas[y0:y1, x0:x1] = clip.bg_img[y0:y1, x0:x1]
+            state["rect"] = None
+        if box is not None:
+            _, state["rect"] = composite_frame(
+                frame,
+                mask_inv,
+                clip.bg_img,
+                config["layout"],
+                config["bg_hsv_mean"],
+                box,
+                canvas,
+            )
+        return mask_inv, canvas
+
+    return step
+
+
+def make_strips(clip, config):
+    """帯単位の処理（--backend strips）"""
+    compositor = StripCompositor(
+        (clip.width, clip.height),
+        config["layout"],
+        make_keyer("hsv", LOWER_GREEN, UPPER_GREEN),
+        config["bg_hsv_mean"],
+        threads=cv2.getNumThreads(),
+    )
+    canvas = clip.bg_img.copy()
+    return lambda frame: (None, compositor.composite(frame, clip.bg_img, canvas))
+
+
+def make_fused(clip, config):
+    """Numba融合処理（--backend fused）"""
+    compositor = fused.FusedCompositor(
+        (clip.width, clip.height),
+        config["layout"],
+        fused.KEY_HSV,
+        LOWER_GREEN,
+        UPPER_GREEN,
+        bg_hsv_mean=config["bg_hsv_mean"],
+    )
+    canvas = clip.bg_img.copy()
+    return lambda frame: (None, compositor.composite(frame, clip.bg_img, canvas))
+
+
+def make_staged(clip, config):
+    """段を組み合わせたパイプライン（run.make_pipeline の通常の処理の段）"""
+    layout = config["layout"]
+    pipeline = make_pipeline(
+        (clip.width, clip.height),
+        layout,
+        "hsv",
+        LOWER_GREEN,
+        UPPER_GREEN,
+        0.3,
+        0.1,
+        1,
+        config["bg_hsv_mean"],
+        False,
+        "opencv",
+    )
+    canvas = clip.bg_img.copy()
+    dirty = layout_rect(layout)
+
+    def step(frame):
+        data = FrameData(frame, clip.bg_img, config["bg_hsv_mean"], canvas, dirty)
+        pipeline.process(data)
+        return data.mask_inv, canvas
+
+    return step
+
+
+BACKENDS = {
+    "pipeline": make_staged,
+    "mask-downscale-4": make_mask_downscale(4),
+    "mask-downscale-8": make_mask_downscale(8),
+    "track-subject": make_tracked,
+    "strips": make_strips,
+    "fused": make_fused,
+}
+
+REFERENCE_STEPS = {"run": make_reference_run, "cv": make_reference_cv}
+
+
+# --- 指標 ---
+
+
+def psnr(image, reference):
+    """PSNR（dB、一致していれば inf）"""
+    mse = np.mean((image.astype(np.float64) - reference) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255.0**2 / mse)
+
+
+def ssim(image, reference):
+    """
+    SSIM（グレースケール、11x11 ガウス窓、Wang et al. 2004 の定数）
+
+    Returns:
+        float: 0-1（一致していれば 1）
+    """
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    x = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    y = cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY).astype(np.float64)
+
+    def blur(img):
+        return cv2.GaussianBlur(img, (11, 11), 1.5)
+
+    mu_x, mu_y = blur(x), blur(y)
+    var_x = blur(x * x) - mu_x * mu_x
+    var_y = blur(y * y) - mu_y * mu_y
+    cov = blur(x * y) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / (
+        (mu_x * mu_x + mu_y * mu_y + c1) * (var_x + var_y + c2)
+    )
+    return float(ssim_map.mean())
+
+
+def run_steps(step, frames):
+    """
+    全フレームを処理
+
+    Returns:
+        tuple: (マスクのリスト, 合成結果のリスト, 1フレームあたりの秒数)
+    """
+    step(frames[0])  # ウォームアップ（JITコンパイル・スレッドの起動）
+    masks, outputs = [], []
+    start = time.perf_counter()
+    for frame in frames:
+        mask, output = step(frame)
+        # 合成先を使い回す方式があるのでコピーして保持
+        masks.append(None if mask is None else mask.copy())
+        outputs.append(output.copy())
+    return masks, outputs, (time.perf_counter() - start) / len(frames)
+
+
+def make_config(clip, reference):
+    """基準に合わせた人物の配置と背景の平均HSV値"""
+    config = dict(REFERENCES[reference])
+    config["layout"] = compute_layout(
+        clip.width, clip.height, config["scale"], config["y_position"]
+    )
+    config["bg_hsv_mean"] = (
+        compute_bg_hsv_mean(clip.bg_img, config["layout"])
+        if config["brightness"]
+        else None
+    )
+    return config
+
+
+def compare(clip, reference, backends, args):
+    """
+    基準と各処理方式を同じフレームで比較
+
+    Returns:
+        list: 方式ごとの (方式名, 結果) 先頭は基準自身（方式名 None）
+              結果は ms, speedup, mask_diff, psnr, ssim, ok の辞書
+    """
+    config = make_config(clip, reference)
+    ref_masks, ref_outputs, ref_sec = run_steps(
+        REFERENCE_STEPS[reference](clip, config), clip.frames
+    )
+
+    rows = []
+    for backend in [None] + backends:
+        if backend is None:
+            masks, outputs, sec = ref_masks, ref_outputs, ref_sec
+        else:
+            step = BACKENDS[backend](clip, config)
+            masks, outputs, sec = run_steps(step, clip.frames)
+
+        mask_diff = None
+        if masks[0] is not None:
+            differing = sum(
+                np.count_nonzero(mask != ref) for mask, ref in zip(masks, ref_masks)
+            )
+            mask_diff = differing / (len(masks) * clip.width * clip.height)
+
+        result = {
+            "ms": sec * 1000,
+            "speedup": ref_sec / sec,
+            "mask_diff": mask_diff,
+            "psnr": min(psnr(out, ref) for out, ref in zip(outputs, ref_outputs)),
+            "ssim": min(ssim(out, ref) for out, ref in zip(outputs, ref_outputs)),
+        }
+        result["ok"] = (
+            (mask_diff is None or mask_diff <= args.max_mask_diff)
+            and result["psnr"] >= args.min_psnr
+            and result["ssim"] >= args.min_ssim
+        )
+        rows.append((backend, result))
+    return rows
+
+
+# --- 音声の同期 ---
+
+AUDIO_RATE = 48000
+
+
+def write_tone_clip(path, width, height, fps, seconds, beep_at):
+    """
+    beep_at 秒のフレームで人物の中央が白く光り、同時に 1kHz の音が鳴る合成クリップ
+
+    映像は MJPEG、音声は AAC の mkv として保存する。
+    """
+    tmp = path.parent
+    frames = [make_synthetic_frame(width, height, seed) for seed in range(4)]
+    flash_index = round(beep_at * fps)
+    writer = cv2.VideoWriter(
+        str(tmp / "video.avi"), cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height)
+    )
+    for i in range(round(seconds * fps)):
+        frame = frames[i % len(frames)].copy()
+        if i == flash_index:
+            frame[height // 3 : height * 2 // 3, width * 2 // 5 : width * 3 // 5] = 255
+        writer.write(frame)
+    writer.release()
+
+    # 無音の中に 100ms だけ 1kHz の音
+    t = np.arange(round(seconds * AUDIO_RATE)) / AUDIO_RATE
+    tone = np.where(
+        (t >= beep_at) & (t < beep_at + 0.1), 0.8 * np.sin(2 * np.pi * 1000 * t), 0.0
+    )
+    with wave.open(str(tmp / "tone.wav"), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(AUDIO_RATE)
+        f.writeframes((tone * 32767).astype("<i2").tobytes())
+
+    video = ffmpeg.input(str(tmp / "video.avi"))
+    audio = ffmpeg.input(str(tmp / "tone.wav"))
+    ffmpeg.run(
+        ffmpeg.output(video, audio, str(path), vcodec="copy", acodec="aac"),
+        overwrite_output=True,
+        quiet=True,
+    )
+
+
+def flash_time(video_path, layout):
+    """出力動画で人物の中央が最も明るいフレームの時刻（秒）"""
+    scaled_width, scaled_height, x_offset, y_offset = layout
+    cy, cx = y_offset + scaled_height // 2, x_offset + scaled_width // 2
+    cap = cv2.VideoCapture(str(video_path))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    levels = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        levels.append(frame[cy - 8 : cy + 8, cx - 8 : cx + 8].mean())
+    cap.release()
+    return int(np.argmax(levels)) / fps
+
+
+def beep_time(video_path):
+    """出力動画の音声が最初に鳴る時刻（秒）"""
+    data, _ = (
+        ffmpeg.input(str(video_path))
+        .output("pipe:", format="s16le", ac=1, ar=AUDIO_RATE)
+        .run(capture_stdout=True, quiet=True)
+    )
+    samples = np.abs(np.frombuffer(data, dtype="<i2").astype(np.int32))
+    return int(np.argmax(samples > samples.max() // 2)) / AUDIO_RATE
+
+
+def check_audio_sync(args):
+    """
+    音声をコピーして出力した動画で、光るフレームと音の時刻がずれていないか確認
+
+    Returns:
+        bool: 音声がコピーされ、ずれが1フレーム以内ならTrue
+    """
+    fps = 25
+    width, height = parse_size(args.sizes[0] if args.sizes else "1280x720")
+    print(f"音声の同期: {width}x{height} @ {fps}fps、2秒目で光と音")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        source = tmp / "green.mkv"
+        bg_path = tmp / "bg.png"
+        output = tmp / "output.mp4"
+        try:
+            write_tone_clip(source, width, height, fps, seconds=4, beep_at=2.0)
+        except (ffmpeg.Error, OSError) as e:
+            print(f"✗ 合成クリップを作成できません（ffmpegが必要です）: {e}")
+            return False
+        cv2.imwrite(str(bg_path), make_background(width, height))
+
+        if not change_background(source, bg_path, output, keep_audio=True):
+            return False
+
+        streams = ffmpeg.probe(str(output))["streams"]
+        codecs = [s["codec_name"] for s in streams if s["codec_type"] == "audio"]
+        if codecs != ["aac"]:
+            print(f"✗ 音声がコピーされていません（音声: {codecs}）")
+            return False
+
+        layout = compute_layout(width, height, 0.7, 0.2)
+        drift = beep_time(output) - flash_time(output, layout)
+
+    ok = abs(drift) <= 1 / fps
+    mark = "✓" if ok else "✗"
+    print(f"{mark} 音と映像のずれ: {drift * 1000:+.1f}ms（許容: ±{1000 / fps:.0f}ms）")
+    return ok
+
+
+def write_numbered_clip(path, width, height, fps, frame_count):
+    """フレームごとに番号と色が変わる動画（mp4v、キーフレームの間のフレームを含む）"""
+    writer = cv2.VideoWriter(
+        str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height)
+    )
+    base = make_synthetic_frame(width, height)
+    for index in range(frame_count):
+        frame = base.copy()
+        frame[: height // 8, :] = (index * 7 % 256, index * 13 % 256, index % 256)
+        cv2.putText(
+            frame,
+            str(index),
+            (width // 20, height // 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            height / 300,
+            (255, 255, 255),
+            2,
+        )
+        writer.write(frame)
+    writer.release()
+
+
+def check_seek(args):
+    """
+    範囲指定の入力側のシークで、範囲の最初のフレームが先頭から順に読んだ場合と
+    一致するか、出力のフレーム数が範囲と一致するかを確認
+
+    Returns:
+        bool: 全ての位置で一致したらTrue
+    """
+    fps = 25
+    width, height = parse_size(args.sizes[0] if args.sizes else "1280x720")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        synthetic = tmp / "numbered.mp4"
+        write_numbered_clip(synthetic, width, height, fps, 10 * fps)
+        bg_path = tmp / "bg.png"
+        cv2.imwrite(str(bg_path), make_background(width, height))
+
+        ok = True
+        for path in [synthetic, *map(Path, args.videos)]:
+            frames = read_all_frames(path)
+            if not frames:
+                print(f"✗ 動画を読み込めません: {path}")
+                ok = False
+                continue
+            count = len(frames)
+            name = "synthetic" if path == synthetic else path.name
+            print(f"シーク: {name}（{count}フレーム）")
+
+            # 先頭付近・キーフレームの前後・中央・最後
+            positions = sorted({1, 11, 12, 13, count // 2, count * 3 // 4, count - 1})
+            for position in positions:
+                if not 0 < position < count:
+                    continue
+                cap = cv2.VideoCapture(str(path))
+                matched = seek(cap, position)
+                if matched:
+                    read, frame = cap.read()
+                    matched = read and np.array_equal(frame, frames[position])
+                cap.release()
+                ok &= matched
+                print(f"  {'✓' if matched else '✗'} {position}フレーム目")
+
+            # 時刻で指定した範囲（長さの 1/4〜3/4）を処理し、出力のフレーム数を確認
+            video_fps = cv2.VideoCapture(str(path)).get(cv2.CAP_PROP_FPS)
+            duration = count / video_fps
+            start, end = ("seconds", duration / 4), ("seconds", duration * 3 / 4)
+            first, stop = frame_range(start, end, video_fps, count)
+            output = tmp / "range.mp4"
+            if not change_background(path, bg_path, output, start=start, end=end):
+                ok = False
+                continue
+            written = len(read_all_frames(output))
+            matched = written == stop - first
+            ok &= matched
+            print(
+                f"  {'✓' if matched else '✗'} "
+                f"{format_position(start)}〜{format_position(end)}: {written}フレーム"
+                f"（期待: {stop - first}、{first}〜{stop - 1}フレーム目）"
+            )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="処理方式と従来の処理の一致の確認")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=list(BACKENDS),
+        default=list(BACKENDS),
+        help="確認する処理方式（デフォルト: 全て）",
+    )
+    parser.add_argument(
+        "--references",
+        nargs="+",
+        choices=list(REFERENCES),
+        default=list(REFERENCES),
+        help="基準（run: run.py の通常の処理, cv: remove_greenback_cv.py）",
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="*",
+        default=["1280x720", "1920x1080"],
+        help="合成クリップの解像度（例: 1920x1080、空なら合成クリップなし）",
+    )
+    parser.add_argument(
+        "--videos", nargs="*", default=[], help="追加で確認する手元の動画"
+    )
+    parser.add_argument("--bg", help="手元の動画に使う背景画像（省略時はグラデーション）")
+    parser.add_argument("--frames", type=int, default=8, help="1クリップのフレーム数")
+    parser.add_argument(
+        "--max-mask-diff",
+        type=float,
+        default=0.002,
+        help="マスクの不一致画素の割合の上限（デフォルト: 0.002 = 0.2%%）",
+    )
+    parser.add_argument(
+        "--min-psnr", type=float, default=40.0, help="PSNRの下限 dB（デフォルト: 40）"
+    )
+    parser.add_argument(
+        "--min-ssim", type=float, default=0.99, help="SSIMの下限（デフォルト: 0.99）"
+    )
+    parser.add_argument(
+        "--audio-sync",
+        action="store_true",
+        help="処理方式の比較の代わりに、音声のコピーの同期を確認（要ffmpeg）",
+    )
+    parser.add_argument(
+        "--seek",
+        action="store_true",
+        help="処理方式の比較の代わりに、範囲指定のシークの正確さを確認（--videos も確認）",
+    )
+    args = parser.parse_args()
+
+    if args.audio_sync:
+        sys.exit(0 if check_audio_sync(args) else 1)
+    if args.seek:
+        sys.exit(0 if check_seek(args) else 1)
+
+    backends = list(args.backends)
+    if "fused" in backends and not fused.FUSED_AVAILABLE:
+        print("Numba がインストールされていないため fused は確認しません")
+        backends.remove("fused")
+
+    clips = [synthetic_clip(size, args.frames) for size in args.sizes]
+    for path in args.videos:
+        clip = video_clip(path, args.frames, args.bg)
+        if clip is None:
+            print(f"動画を読み込めません: {path}")
+            sys.exit(1)
+        clips.append(clip)
+    if not clips:
+        print("確認するクリップがありません（--sizes / --videos）")
+        sys.exit(1)
+
+    print(
+        f"{'クリップ':<22} {'基準':>4} {'方式':>18} {'ms/frame':>9} {'速度比':>7} "
+        f"{'マスク差':>8} {'PSNR':>7} {'SSIM':>7} {'判定':>4}"
+    )
+    print("-" * 100)
+
+    failed = 0
+    for clip in clips:
+        for reference in args.references:
+            for backend, result in compare(clip, reference, backends, args):
+                mask_diff = result["mask_diff"]
+                mask_text = "-" if mask_diff is None else f"{mask_diff * 100:.3f}%"
+                print(
+                    f"{clip.name:<22} {reference:>4} {backend or '(基準)':>18} "
+                    f"{result['ms']:>9.2f} {result['speedup']:>6.2f}x "
+                    f"{mask_text:>8} {result['psnr']:>7.2f} {result['ssim']:>7.4f} "
+                    f"{'OK' if result['ok'] else 'NG':>4}"
+                )
+                failed += not result["ok"]
+
+    if failed:
+        print(f"\n✗ {failed}件が許容範囲を超えています")
+        sys.exit(1)
+    print("\n✓ 全ての処理方式が許容範囲内です")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+動画背景（ループ再生）の先読み
+
+背景が動画の場合、フレーム処理のループの中で背景動画もデコードすると
+1フレームあたりの待ち時間が2本分になる。ここでは別スレッドで背景動画を
+デコード・リサイズし、固定数のバッファ（リングバッファ）に先読みしておく。
+合成側はバッファから取り出すだけなので、背景のデコードを待たない。
+
+    - 背景動画の最後まで来たら先頭に戻ってループする
+    - 前景のフレームレートに合わせて、背景のフレームを間引く・繰り返す
+      （前景の i フレーム目には 時刻 i / 前景fps の背景フレームを使う）
+    - 輝度マッチング用の背景の平均HSV値もフレームごとに先読みスレッドで計算する
+"""
+
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+
+class VideoBackground:
+    """
+    背景動画を別スレッドでデコードし、出力サイズにリサイズして先読みする
+
+    Args:
+        path: 背景動画のパス
+        width: 出力の幅
+        height: 出力の高さ
+        fps: 前景（出力）のフレームレート
+        stats: フレームごとの統計値を計算する関数 stats(bg_img)（None なら計算しない）
+        buffer_size: 先読みするフレーム数
+    """
+
+    # フレームごとに背景が変わる（pipeline.Pipeline は合成先を毎フレーム背景で初期化する）
+    varying = True
+
+    def __init__(self, path, width, height, fps, stats=None, buffer_size=8):
+        self.cap = cv2.VideoCapture(str(path))
+        if not self.cap.isOpened():
+            raise ValueError(f"背景動画が開けません: {path}")
+
+        self.width = width
+        self.height = height
+        self.fps = fps if fps > 0 else 30.0
+        bg_fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.bg_fps = bg_fps if bg_fps > 0 else self.fps
+        self.stats = stats
+
+        # リングバッファ: 空きスロットと、デコード済みスロットの番号をやり取りする
+        self.slots = [
+            np.empty((height, width, 3), dtype=np.uint8) for _ in range(buffer_size)
+        ]
+        self.free = queue.Queue()
+        self.filled = queue.Queue()
+        for index in range(buffer_size):
+            self.free.put(index)
+        self.current = None
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        """先読みスレッド"""
+        try:
+            frame_index = 0  # 前景のフレーム番号
+            loop_start = 0  # 現在のループの先頭に当たる背景フレーム番号（通算）
+            decoded = -1  # 現在のループ内で最後にデコードした背景フレーム番号
+            previous = None
+
+            while not self.stopped.is_set():
+                # 前景のこのフレームの時刻に表示する背景フレーム（ループ内の番号）
+                target = int(frame_index * self.bg_fps / self.fps) - loop_start
+
+                # 目的のフレームまで読み飛ばす（デコードは最後の1枚だけ）
+                grabbed = False
+                while decoded < target:
+                    if not self.cap.grab():
+                        if decoded < 0:
+                            raise ValueError("背景動画からフレームを読み込めません")
+                        # 最後まで来たので先頭に戻る
+                        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        loop_start += decoded + 1
+                        target -= decoded + 1
+                        decoded = -1
+                        continue
+                    decoded += 1
+                    grabbed = True
+
+                slot = self.free.get()
+                if slot is None:
+                    break
+                image = self.slots[slot]
+
+                if grabbed:
+                    ok, raw = self.cap.retrieve()
+                    if not ok:
+                        raise ValueError("背景動画のデコードに失敗しました")
+                    cv2.resize(raw, (self.width, self.height), dst=image)
+                else:
+                    # 背景の方がフレームレートが低い: 前のフレームを繰り返す
+                    np.copyto(image, previous)
+                previous = image
+
+                stats = self.stats(image) if self.stats is not None else None
+                self.filled.put((slot, stats))
+                frame_index += 1
+        except Exception as e:
+            self.filled.put((None, e))
+
+    def next(self):
+        """
+        次のフレームの背景を取得
+
+        返した画像は次に next() を呼ぶまで有効（その後はバッファとして再利用される）。
+
+        Returns:
+            tuple: (背景画像, 統計値)
+        """
+        if self.current is not None:
+            self.free.put(self.current)
+            self.current = None
+
+        slot, stats = self.filled.get()
+        if slot is None:
+            raise RuntimeError(f"背景動画の読み込みに失敗しました: {stats}")
+        self.current = slot
+        return self.slots[slot], stats
+
+    def close(self):
+        """先読みスレッドを止めて背景動画を閉じる"""
+        self.stopped.set()
+        self.free.put(None)  # 空きスロット待ちで止まっているスレッドを起こす
+        self.thread.join()
+        self.cap.release()